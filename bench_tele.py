@@ -0,0 +1,586 @@
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Any, List
+
+import requests
+
+import tele
+from fake_telegram import FakeTelegramServer, command_message
+
+def _p95(samples: List[float]) -> float:
+    """
+        Returns the nearest-rank 95th percentile of sorted samples, which is
+        never below their median however few there are.
+    """
+    return samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)]
+
+def _timed(func: Callable[[], None], count: int) -> Dict[str, Any]:
+    """
+        Runs func count times and summarises the per-call wall clock latency.
+        Args:
+            func: the call to measure
+            count: how many times to call it
+        Returns:
+            A dictionary with the mean, median and p95 latency in milliseconds.
+    """
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "count": count,
+        "mean_ms": statistics.fmean(samples),
+        "median_ms": statistics.median(samples),
+        "p95_ms": _p95(samples),
+    }
+
+def _unthrottled() -> "tele.RateLimiter":
+    """
+        Returns a rate limiter that never holds a send back, so benchmarks measure transport cost rather than flood limits.
+    """
+    return tele.RateLimiter(global_rate=1e9, chat_rate=1e9, chat_burst=1e9, group_rate=1e9, group_burst=1e9)
+
+def bench_send_message(count: int, connect_latency: float) -> Dict[str, Any]:
+    """
+        Measures per-message latency of send_telegram against a local stand-in
+        server, once with a fresh connection per request and once over the
+        pooled keep-alive client.
+        Args:
+            count: number of messages to send in each mode
+            connect_latency: simulated handshake cost in seconds per new connection
+        Returns:
+            A dictionary with the results for the "unpooled" and "pooled" modes.
+    """
+    results = {}
+    with FakeTelegramServer(connect_latency=connect_latency) as server:
+        url = f"{server.url}/botTOKEN/sendMessage"
+        results["unpooled"] = _timed(lambda: requests.post(url, data={"chat_id": "1", "text": "hello"}), count)
+        results["unpooled"]["connections"] = server.connections
+
+        server.connections = 0
+        with tele.TelegramClient(api_url=server.url, rate_limiter=_unthrottled()) as client:
+            results["pooled"] = _timed(lambda: tele.send_telegram("TOKEN", "1", "hello", client), count)
+        results["pooled"]["connections"] = server.connections
+    return results
+
+def bench_throughput(count: int, concurrency: int, flood_every: int) -> Dict[str, Any]:
+    """
+        Measures how many messages per second a pooled TelegramClient gets
+        through a local stand-in server, sending from one thread, from
+        concurrency threads, from concurrency threads while the server
+        answers every flood_every-th call with 429 Too Many Requests, and
+        from concurrency threads with an ApiMetrics hook observing every call.
+        Args:
+            count: number of messages to send in each mode
+            concurrency: number of sending threads in the concurrent modes
+            flood_every: how often the server rate limits in the "flood" mode
+        Returns:
+            A dictionary with the results for the "sequential", "concurrent", "flood" and "instrumented" modes.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    results = {}
+    for mode, threads, every in (("sequential", 1, 0), ("concurrent", concurrency, 0), ("flood", concurrency, flood_every),
+                                 ("instrumented", concurrency, 0)):
+        metrics = tele.ApiMetrics()
+        if mode == "instrumented":
+            tele.add_api_hook(metrics)
+        with FakeTelegramServer(flood_every=every, retry_after=0.05) as server, \
+                tele.TelegramClient(api_url=server.url, pool_size=threads, rate_limiter=_unthrottled()) as client, \
+                ThreadPoolExecutor(threads) as pool, contextlib.redirect_stdout(io.StringIO()):
+
+            def send(i: int) -> None:
+                chat = str(i % 100)
+                client.send("TOKEN", "sendMessage", chat, data={"chat_id": chat, "text": "hello"})
+
+            start = time.perf_counter()
+            try:
+                list(pool.map(send, range(count)))
+            finally:
+                tele.remove_api_hook(metrics)
+            seconds = time.perf_counter() - start
+            results[mode] = {"count": count, "threads": threads, "seconds": seconds, "messages_per_s": count / seconds,
+                             "delivered": len(server.calls), "rate_limited": server.rate_limited}
+    return results
+
+def bench_transfer(size_mb: int, bandwidth_mb: float) -> Dict[str, Any]:
+    """
+        Measures media transfer throughput against a local stand-in server
+        capped at bandwidth_mb megabytes per second: uploading a document
+        through python-telegram-bot and streamed from disk, and downloading
+        it with get_telegram_file.
+        Args:
+            size_mb: size of the file in megabytes
+            bandwidth_mb: bandwidth cap of the server in megabytes per second, 0 for none
+        Returns:
+            A dictionary with the results for the "upload_buffered", "upload_streaming" and "download" modes.
+    """
+    results = {}
+    with FakeTelegramServer(bandwidth=bandwidth_mb * (1 << 20)) as server, tempfile.TemporaryDirectory() as tmp, \
+            contextlib.redirect_stdout(io.StringIO()):
+        path = os.path.join(tmp, "file.bin")
+        data = os.urandom(size_mb << 20)
+        with open(path, "wb") as f:
+            f.write(data)
+        for mode, stream_threshold in (("upload_buffered", tele.MAX_UPLOAD_SIZE + 1), ("upload_streaming", 0)):
+            sender = tele.AsyncSender(api_url=server.url, rate_limiter=_unthrottled(), stream_threshold=stream_threshold)
+            sender.run(asyncio.sleep(0, sender.get_bot("TOKEN")))
+            start = time.perf_counter()
+            sent = tele.send_telegram_file("TOKEN", "1", path, sender=sender)
+            seconds = time.perf_counter() - start
+            sender.close()
+            results[mode] = {"size_mb": size_mb, "ok": sent, "seconds": seconds, "mb_per_s": size_mb / seconds}
+            del server.uploads[:]
+        server.add_file("FILE", data, "documents/file.bin")
+        with tele.TelegramClient(api_url=server.url, rate_limiter=_unthrottled()) as client:
+            start = time.perf_counter()
+            sent = bool(tele.get_telegram_file("TOKEN", "", "FILE", tmp, client))
+            seconds = time.perf_counter() - start
+        results["download"] = {"size_mb": size_mb, "ok": sent, "seconds": seconds, "mb_per_s": size_mb / seconds}
+    return results
+
+def bench_update_poll(count: int) -> Dict[str, Any]:
+    """
+        Measures how long an update pushed to a local stand-in server takes
+        to come out of iter_telegram_updates while it is long polling.
+        Args:
+            count: number of updates to push
+        Returns:
+            A dictionary with the "long_poll" results.
+    """
+    import threading
+    samples = []
+    with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+        updates = tele.iter_telegram_updates("TOKEN", timeout=10, client=client)
+        for _ in range(count):
+            pushed = []
+
+            def push() -> None:
+                # Gives the poll time to be pending on the server first.
+                time.sleep(0.005)
+                pushed.append(time.perf_counter())
+                server.push_update(command_message("/ping"))
+
+            thread = threading.Thread(target=push)
+            thread.start()
+            next(updates)
+            samples.append((time.perf_counter() - pushed[0]) * 1000)
+            thread.join()
+        updates.close()
+    samples.sort()
+    return {"long_poll": {"count": count, "median_ms": statistics.median(samples), "p95_ms": _p95(samples)}}
+
+def _download_in_child(mode: str, api_url: str, file_id: str, out_dir: str, results) -> None:
+    """
+        Downloads a file inside a fresh process and reports its peak RSS growth.
+        Args:
+            mode: "buffered" reads the whole body into memory, "streaming" uses get_telegram_file
+            api_url: base url of the stand-in server
+            file_id: id of the file to download
+            out_dir: directory to store the file in
+            results: queue receiving the peak RSS growth in KiB
+    """
+    import resource
+    with contextlib.redirect_stdout(io.StringIO()), tele.TelegramClient(api_url=api_url) as client:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if mode == "buffered":
+            file_path = client.get(client.method_url("TOKEN", f"getFile?file_id={file_id}")).json()["result"]["file_path"]
+            with open(os.path.join(out_dir, "buffered.bin"), "wb") as f:
+                f.write(client.get(client.file_url("TOKEN", file_path)).content)
+        else:
+            tele.get_telegram_file("TOKEN", "", file_id, out_dir, client)
+        # ru_maxrss is reported in KiB on Linux.
+        results.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+
+def bench_download_memory(size_mb: int) -> Dict[str, Any]:
+    """
+        Measures peak RSS growth of downloading a file from a local stand-in
+        server, once buffering the whole body and once streaming it to disk.
+        Each download runs in its own process so earlier allocations do not
+        hide later ones.
+        Args:
+            size_mb: size of the file to download in megabytes
+        Returns:
+            A dictionary with the results for the "buffered" and "streaming" modes.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with FakeTelegramServer() as server, tempfile.TemporaryDirectory() as out_dir:
+        server.add_file("FILE", os.urandom(size_mb << 20), "videos/file.mp4")
+        for mode in ("buffered", "streaming"):
+            queue = context.Queue()
+            start = time.perf_counter()
+            process = context.Process(target=_download_in_child, args=(mode, server.url, "FILE", out_dir, queue))
+            process.start()
+            peak_kib = queue.get()
+            process.join()
+            results[mode] = {"size_mb": size_mb, "peak_rss_mb": peak_kib / 1024, "seconds": time.perf_counter() - start}
+    return results
+
+def _upload_in_child(mode: str, api_url: str, path: str, results) -> None:
+    """
+        Uploads a file inside a fresh process and reports its peak RSS growth.
+        Args:
+            mode: "buffered" hands the file to python-telegram-bot, "streaming" streams it from disk
+            api_url: base url of the stand-in server
+            path: path of the file to upload
+            results: queue receiving the peak RSS growth in KiB
+    """
+    import resource
+    stream_threshold = 0 if mode == "streaming" else tele.MAX_UPLOAD_SIZE + 1
+    sender = tele.AsyncSender(api_url=api_url, rate_limiter=_unthrottled(), stream_threshold=stream_threshold)
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Starts the loop and imports telegram before the baseline is taken.
+        sender.run(asyncio.sleep(0, sender.get_bot("TOKEN")))
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tele.send_telegram_file("TOKEN", "1", path, sender=sender)
+    results.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+    sender.close()
+
+def bench_upload_memory(size_mb: int) -> Dict[str, Any]:
+    """
+        Measures peak RSS growth of uploading a document to a local stand-in
+        server, once through python-telegram-bot and once streamed from disk,
+        each in its own process like bench_download_memory.
+        Args:
+            size_mb: size of the file to upload in megabytes
+        Returns:
+            A dictionary with the results for the "buffered" and "streaming" modes.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with FakeTelegramServer() as server, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "file.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size_mb << 20))
+        for mode in ("buffered", "streaming"):
+            queue = context.Queue()
+            start = time.perf_counter()
+            process = context.Process(target=_upload_in_child, args=(mode, server.url, path, queue))
+            process.start()
+            peak_kib = queue.get()
+            process.join()
+            results[mode] = {"size_mb": size_mb, "peak_rss_mb": peak_kib / 1024, "seconds": time.perf_counter() - start}
+            del server.uploads[:]
+    return results
+
+def bench_image_preprocessing(count: int) -> Dict[str, Any]:
+    """
+        Measures how much ImagePreprocessor shrinks a batch of camera sized
+        JPEGs and how long the batch takes with one worker and with the pool.
+        Args:
+            count: how many images are in the batch
+        Returns:
+            A dictionary with the results for the "serial" and "pool" modes.
+    """
+    from PIL import Image, ImageFilter
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(count):
+            paths.append(os.path.join(tmp, f"{i}.jpg"))
+            # Blurred noise compresses about like a photo does.
+            noise = Image.effect_noise((4000, 3000), 64).filter(ImageFilter.GaussianBlur(2))
+            Image.merge("RGB", (noise, noise.rotate(90, expand=False), noise.transpose(Image.FLIP_LEFT_RIGHT))).save(paths[-1], quality=95)
+        original = sum(os.path.getsize(path) for path in paths)
+        for mode, max_workers in (("serial", 1), ("pool", None)):
+            preprocessor = tele.ImagePreprocessor(max_workers=max_workers)
+            start = time.perf_counter()
+            outputs = preprocessor.process(paths)
+            seconds = time.perf_counter() - start
+            shrunk = sum(os.path.getsize(image) for image, _ in outputs)
+            preprocessor.close()
+            results[mode] = {"count": count, "original_mb": original / (1 << 20), "shrunk_mb": shrunk / (1 << 20), "seconds": seconds}
+    return results
+
+def _legacy_look_for(message: str, char: str, offset: int, max_offset: int) -> int:
+    """
+        The character-by-character search send_telegram used before iter_chunks, kept as a baseline.
+    """
+    for i in range(0, max_offset):
+        if message[offset - i] == char:
+            return offset - i
+    return -1
+
+def _legacy_chunks(message: str, chunk_size: int = 4090, max_search_back: int = 2048, min_size: int = 512):
+    """
+        The chunking loop send_telegram used before iter_chunks, kept as a baseline.
+    """
+    start = 0
+    while start < len(message):
+        end = min(start + chunk_size, len(message)) - 1
+        if start + chunk_size < len(message):
+            search = _legacy_look_for(message, '\n', end, min(max_search_back, end - start - min_size))
+            if search < 0:
+                search = _legacy_look_for(message, ' ', end, min(max_search_back, end - start - min_size))
+            if search > 0:
+                end = search
+        yield message[start:end + 1]
+        start = end + 1
+
+def bench_chunking(size_mb: int) -> Dict[str, Any]:
+    """
+        Measures how long it takes to split a size_mb text into telegram sized
+        chunks. The text has no newlines, so every chunk needs a full search
+        back for a newline before settling on a space, the worst case for the
+        legacy loop, which is only run up to 10 MB.
+        Args:
+            size_mb: size of the text in megabytes
+        Returns:
+            A dictionary with the results for the "legacy", "iter_chunks" and "iter_chunks_stream" modes.
+    """
+    text = ("lorem ipsum dolor sit amet " * ((size_mb << 20) // 27 + 1))[:size_mb << 20]
+    modes = {
+        "legacy": lambda: _legacy_chunks(text),
+        "iter_chunks": lambda: tele.iter_chunks(text),
+        "iter_chunks_stream": lambda: tele.iter_chunks(io.StringIO(text)),
+    }
+    results = {}
+    for mode, chunker in modes.items():
+        if mode == "legacy" and size_mb > 10:
+            continue
+        start = time.perf_counter()
+        chunks = sum(1 for _ in chunker())
+        results[mode] = {"size_mb": size_mb, "chunks": chunks, "seconds": time.perf_counter() - start}
+    return results
+
+def _import_time_us(module: str) -> int:
+    """
+        Returns the cumulative import time of module in microseconds, as reported by python -X importtime.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise ValueError(f"no import time reported for {module}")
+
+def bench_startup(count: int) -> Dict[str, Any]:
+    """
+        Measures the start up cost of the command line: the import time of
+        tele, and the wall clock time and number of API requests of a plain
+        text send run as a fresh process against a local stand-in server.
+        Args:
+            count: number of processes to start for each measurement
+        Returns:
+            A dictionary with the "import" and "send_message" results.
+    """
+    imports = sorted(_import_time_us("tele") / 1000 for _ in range(count))
+    heavy = ("asyncio", "telegram", "sqlite3", "httpx")
+    probe = f"import sys, tele; tele.main(sys.argv[1:]); print(','.join(m for m in {heavy!r} if m in sys.modules))"
+    samples = []
+    with FakeTelegramServer() as server:
+        env = dict(os.environ, TELEGRAM_API_URL=server.url)
+        command = [sys.executable, "-c", probe, "--bot_token", "TOKEN", "--chat_token", "1", "--message", "hello"]
+        for _ in range(count):
+            start = time.perf_counter()
+            result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+            samples.append((time.perf_counter() - start) * 1000)
+        loaded = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+        samples.sort()
+        return {
+            "import": {"count": count, "median_ms": statistics.median(imports)},
+            "send_message": {
+                "count": count,
+                "median_ms": statistics.median(samples),
+                "requests_per_send": len(server.calls) / count,
+                "heavy_modules": [m for m in loaded.split(",") if m in heavy],
+            },
+        }
+
+def bench_daemon(count: int, process_count: int, connect_latency: float) -> Dict[str, Any]:
+    """
+        Compares the latency of a text send through a one-shot command line
+        process, a command line process forwarding to a --serve daemon, and a
+        DaemonClient connected to the daemon, all against a local stand-in
+        server.
+        Args:
+            count: number of messages sent with the DaemonClient
+            process_count: number of processes started for each command line mode
+            connect_latency: simulated handshake cost in seconds per new connection
+        Returns:
+            A dictionary with the results for the "cli", "cli_via_daemon" and "client" modes.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tele.py")
+    results = {}
+    with FakeTelegramServer(connect_latency=connect_latency) as server, tempfile.TemporaryDirectory() as tmp, \
+            tele.TelegramClient(api_url=server.url, rate_limiter=_unthrottled()) as client:
+        socket_path = os.path.join(tmp, "tele.sock")
+        daemon = tele.TeleDaemon(socket_path, client=client).start()
+        env = dict(os.environ, TELEGRAM_API_URL=server.url)
+        try:
+            for mode, extra in (("cli", []), ("cli_via_daemon", ["--socket", socket_path])):
+                command = [sys.executable, script, "--bot_token", "TOKEN", "--chat_token", "1", "--message", "hello"] + extra
+                results[mode] = _timed(lambda: subprocess.run(command, env=env, capture_output=True, check=True), process_count)
+            with tele.DaemonClient(socket_path) as daemon_client, contextlib.redirect_stdout(io.StringIO()):
+                results["client"] = _timed(lambda: daemon_client.send_message("TOKEN", "1", "hello"), count)
+                results["client"]["daemon_median_ms"] = daemon_client.stats()["result"]["message"]["median_ms"]
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                daemon.stop()
+    return results
+
+def bench_handler_latency(count: int) -> Dict[str, Any]:
+    """
+        Measures the end to end latency from an update being delivered to its
+        command handler running, once with InteractiveBot receiving synthetic
+        updates posted to its webhook and once with it long polling a local
+        stand-in server the updates are pushed to.
+        Args:
+            count: number of updates delivered in each mode
+        Returns:
+            A dictionary with the results for the "webhook" and "polling" modes.
+    """
+    import http.client
+
+    async def measure(server: FakeTelegramServer, webhook: bool) -> Dict[str, Any]:
+        handled = asyncio.Event()
+
+        async def ping(update, context):
+            handled.set()
+
+        bot = tele.InteractiveBot("1:a", {"ping": ping}, api_url=server.url)
+        if webhook:
+            await bot.start_webhook(port=0, secret_token="secret")
+            connection = http.client.HTTPConnection(*bot.webhook_address)
+        else:
+            await bot.start()
+        samples = []
+        try:
+            for update_id in range(1, count + 1):
+                handled.clear()
+                start = time.perf_counter()
+                if webhook:
+                    body = json.dumps({"update_id": update_id, **command_message("/ping")})
+                    await asyncio.to_thread(lambda: (connection.request("POST", "/telegram", body, {"X-Telegram-Bot-Api-Secret-Token": "secret"}),
+                                                     connection.getresponse().read()))
+                else:
+                    server.push_update(command_message("/ping"))
+                await asyncio.wait_for(handled.wait(), 10)
+                samples.append((time.perf_counter() - start) * 1000)
+        finally:
+            if webhook:
+                connection.close()
+            await bot.stop()
+        samples.sort()
+        return {"count": count, "median_ms": statistics.median(samples), "p95_ms": _p95(samples)}
+
+    results = {}
+    for mode in ("webhook", "polling"):
+        with FakeTelegramServer() as server:
+            results[mode] = asyncio.run(measure(server, mode == "webhook"))
+    return results
+
+def _print_results(name: str, results: Any) -> None:
+    """
+        Prints the results of one benchmark in human readable form.
+        Args:
+            name: name of the benchmark, see BENCHMARKS
+            results: what the benchmark returned
+    """
+    if name == "send_message":
+        for mode, result in results.items():
+            print(f"send_message[{mode}]: mean {result['mean_ms']:.2f} ms, median {result['median_ms']:.2f} ms, "
+                  f"p95 {result['p95_ms']:.2f} ms over {result['count']} messages, {result['connections']} connections")
+    elif name == "throughput":
+        for mode, result in results.items():
+            print(f"throughput[{mode}]: {result['messages_per_s']:.0f} messages/s with {result['threads']} threads, "
+                  f"{result['delivered']} of {result['count']} delivered, {result['rate_limited']} rate limited")
+    elif name == "transfer":
+        for mode, result in results.items():
+            print(f"transfer[{mode}]: {result['mb_per_s']:.1f} MB/s for a {result['size_mb']} MB file")
+    elif name in ("download", "upload"):
+        for mode, result in results.items():
+            print(f"{name}[{mode}]: peak RSS +{result['peak_rss_mb']:.1f} MB for a {result['size_mb']} MB file "
+                  f"in {result['seconds']:.2f} s")
+    elif name == "startup":
+        print(f"startup[import]: median {results['import']['median_ms']:.1f} ms over {results['import']['count']} processes")
+        result = results["send_message"]
+        print(f"startup[send_message]: median {result['median_ms']:.1f} ms over {result['count']} processes, "
+              f"{result['requests_per_send']:.0f} requests per send, heavy modules loaded: {', '.join(result['heavy_modules']) or 'none'}")
+    elif name == "daemon":
+        for mode, result in results.items():
+            served = f", {result['daemon_median_ms']:.2f} ms inside the daemon" if "daemon_median_ms" in result else ""
+            print(f"daemon[{mode}]: median {result['median_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms over {result['count']} messages{served}")
+    elif name in ("handler", "update_poll"):
+        for mode, result in results.items():
+            print(f"{name}[{mode}]: median {result['median_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms over {result['count']} updates")
+    elif name == "images":
+        for mode, result in results.items():
+            print(f"images[{mode}]: {result['count']} images from {result['original_mb']:.1f} MB to {result['shrunk_mb']:.1f} MB "
+                  f"in {result['seconds']:.2f} s")
+    elif name == "chunking":
+        for size_results in results:
+            for mode, result in size_results.items():
+                print(f"chunking[{mode}]: {result['size_mb']} MB into {result['chunks']} chunks in {result['seconds']:.3f} s")
+
+# Every benchmark by name, run with the parsed command line arguments.
+BENCHMARKS = {
+    "send_message": lambda args: bench_send_message(args.count, args.connect_latency),
+    "throughput": lambda args: bench_throughput(args.count, args.concurrency, args.flood_every),
+    "transfer": lambda args: bench_transfer(args.download_mb, args.bandwidth_mb),
+    "download": lambda args: bench_download_memory(args.download_mb),
+    "upload": lambda args: bench_upload_memory(args.download_mb),
+    "startup": lambda args: bench_startup(args.startup_count),
+    "daemon": lambda args: bench_daemon(args.count, args.startup_count, args.connect_latency),
+    "handler": lambda args: bench_handler_latency(args.count),
+    "update_poll": lambda args: bench_update_poll(args.count),
+    "images": lambda args: bench_image_preprocessing(args.image_count),
+    "chunking": lambda args: [bench_chunking(size_mb) for size_mb in args.chunk_mb],
+}
+
+def main(argv=None):
+    import platform
+    parser = argparse.ArgumentParser(description="Benchmark tele.py against a local stand-in Bot API server")
+    parser.add_argument("--count", type=int, default=200, help="number of requests per measurement")
+    parser.add_argument("--connect_latency", type=float, default=0.02, help="simulated handshake cost per new connection in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of sending threads in the throughput benchmark")
+    parser.add_argument("--flood_every", type=int, default=20, help="every how many calls the server answers 429 in the flood benchmark")
+    parser.add_argument("--bandwidth_mb", type=float, default=0, help="bandwidth cap in MB/s of the server in the transfer benchmark, 0 for none")
+    parser.add_argument("--download_mb", type=int, default=20, help="size of the file used by the download, upload and transfer benchmarks")
+    parser.add_argument("--startup_count", type=int, default=10, help="number of processes started by the startup benchmark")
+    parser.add_argument("--image_count", type=int, default=8, help="number of images in the preprocessing benchmark, needs Pillow")
+    parser.add_argument("--chunk_mb", type=int, nargs="+", default=[1, 100], help="text sizes used by the chunking benchmark")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--json", type=str, default="", help="also write all results as json to this file, - for stdout only")
+    args = parser.parse_args(argv)
+
+    names = args.only or list(BENCHMARKS)
+    if "images" in names and importlib.util.find_spec("PIL") is None:
+        names.remove("images")
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name](args)
+        if args.json != "-":
+            _print_results(name, results[name])
+    if args.json:
+        report = {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "results": results,
+        }
+        if args.json == "-":
+            print(json.dumps(report, indent=2))
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,385 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+from urllib.parse import urlparse, parse_qs
+
+def command_message(text: str, chat_id: int = 1, message_id: int = 1) -> Dict[str, Any]:
+    """
+    Builds the body of an update carrying a text message, marking a leading /command
+    as a bot_command entity the way telegram does. Pass it to push_update, or add an
+    update_id and post it to a webhook.
+    """
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Tester"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+class FakeApiError(Exception):
+    """
+    Raised by a fake API method to reply with an error response.
+    """
+    def __init__(self, error_code: int, description: str):
+        super().__init__(description)
+        self.error_code = error_code
+        self.description = description
+
+class _FakeBotApiHandler(BaseHTTPRequestHandler):
+    """
+    Request handler implementing a small subset of the Bot API.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid delayed-ACK stalls on keep-alive.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        server = self.server.fake
+        with server.lock:
+            server.connections += 1
+        if server.connect_latency > 0:
+            # Stands in for the TCP+TLS handshake cost of a fresh connection.
+            time.sleep(server.connect_latency)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self) -> Dict[str, Any]:
+        parsed = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        length = int(self.headers.get("Content-Length", 0))
+        body = self._read_body(length)
+        content_type = self.headers.get("Content-Type", "")
+        if body and content_type.startswith("application/json"):
+            params.update(json.loads(body))
+        elif body and content_type.startswith("application/x-www-form-urlencoded"):
+            params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+        elif body and content_type.startswith("multipart/form-data"):
+            params.update(self._multipart(body, content_type))
+        return params
+
+    def _read_body(self, length: int) -> bytes:
+        server = self.server.fake
+        if server.bandwidth <= 0:
+            return self.rfile.read(length) if length > 0 else b""
+        chunks = []
+        while length > 0:
+            chunk = self.rfile.read(min(1 << 16, length))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length -= len(chunk)
+            server.throttle(len(chunk))
+        return b"".join(chunks)
+
+    def _multipart(self, body: bytes, content_type: str) -> Dict[str, Any]:
+        """
+        Parses a multipart/form-data body. Form fields become params, file parts are
+        recorded on the server's uploads as (field, filename, data) and become a
+        "<field>" param holding the filename.
+        """
+        match = re.search(r'boundary="?([^";]+)"?', content_type)
+        params = {}
+        for part in body.split(b"--" + match.group(1).encode())[1:-1]:
+            head, _, data = part[2:-2].partition(b"\r\n\r\n")
+            disposition = re.search(rb'name="([^"]*)"(?:; filename="([^"]*)")?', head)
+            name = disposition.group(1).decode()
+            if disposition.group(2) is None:
+                params[name] = data.decode()
+                continue
+            filename = disposition.group(2).decode()
+            with self.server.fake.lock:
+                self.server.fake.uploads.append((name, filename, data))
+            params[name] = filename
+        return params
+
+    def _reply(self, payload: Dict[str, Any], status: int = 200) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_file(self, file_path: str) -> None:
+        server = self.server.fake
+        data = server.files.get(file_path)
+        with server.lock:
+            server.downloads.append(file_path)
+        if data is None:
+            self._reply({"ok": False, "error_code": 404, "description": "Not Found"}, 404)
+            return
+        start = 0
+        status = 200
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data) - start))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+        view = memoryview(data)
+        for offset in range(start, len(data), 1 << 16):
+            self.wfile.write(view[offset:offset + (1 << 16)])
+            server.throttle(min(1 << 16, len(data) - offset))
+
+    def _handle(self):
+        server = self.server.fake
+        parts = urlparse(self.path).path.strip("/").split("/")
+        params = self._params()
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if len(parts) > 2 and parts[0] == "file" and parts[1].startswith("bot"):
+            self._serve_file("/".join(parts[2:]))
+            return
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply({"ok": False, "error_code": 404, "description": "Not Found"}, 404)
+            return
+        method = parts[1]
+        if server.flooded():
+            self._reply({"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {server.retry_after}",
+                         "parameters": {"retry_after": server.retry_after}}, 429)
+            return
+        with server.lock:
+            server.calls.append((method, params))
+        handler = getattr(server, f"_api_{method}", None)
+        if handler is None:
+            self._reply({"ok": False, "error_code": 404, "description": "Not Found"}, 404)
+            return
+        try:
+            result = handler(params)
+        except FakeApiError as e:
+            self._reply({"ok": False, "error_code": e.error_code, "description": e.description}, e.error_code)
+            return
+        self._reply({"ok": True, "result": result})
+
+    do_GET = _handle
+    do_POST = _handle
+
+class FakeTelegramServer:
+    """
+    A local stand-in for api.telegram.org, used by tests and benchmarks.
+    Runs a threaded HTTP/1.1 server with keep-alive on a background thread,
+    with configurable latency, bandwidth and flood control.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, connect_latency: float = 0.0,
+                 bandwidth: float = 0.0, flood_every: int = 0, retry_after: float = 1.0):
+        """
+        Initialize the server.
+
+        Args:
+            host: interface to listen on.
+            port: port to listen on, 0 picks a free port.
+            latency: seconds added to every response.
+            connect_latency: seconds added once per new connection, simulating a handshake.
+            bandwidth: bytes per second each connection uploads and downloads at, 0 for no cap.
+            flood_every: answer every flood_every-th API call with 429 Too Many Requests, 0 never does.
+            retry_after: seconds the 429 responses ask the client to wait.
+        """
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.bandwidth = bandwidth
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.rate_limited = 0
+        self._api_calls = 0
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.calls: List[Any] = []
+        self.files: Dict[str, bytes] = {}
+        self.downloads: List[str] = []
+        self.uploads: List[Any] = []
+        self._file_ids: Dict[str, Dict[str, Any]] = {}
+        self.updates: List[Dict[str, Any]] = []
+        self._update_id = 0
+        self._updates_ready = threading.Condition(self.lock)
+        self._message_id = 0
+        self._httpd = ThreadingHTTPServer((host, port), _FakeBotApiHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base url to hand to TelegramClient(api_url=...)."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegramServer":
+        """Starts serving on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving and closes the listening socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def throttle(self, size: int) -> None:
+        """Sleeps for as long as transferring size bytes takes at the bandwidth cap."""
+        if self.bandwidth > 0:
+            time.sleep(size / self.bandwidth)
+
+    def flooded(self) -> bool:
+        """Counts an API call, returns True if it is to be answered with 429."""
+        with self.lock:
+            self._api_calls += 1
+            if self.flood_every <= 0 or self._api_calls % self.flood_every:
+                return False
+            self.rate_limited += 1
+            return True
+
+    def add_file(self, file_id: str, data: bytes, file_path: str = None, file_unique_id: str = None) -> Dict[str, Any]:
+        """
+        Registers a file that getFile can resolve and that can then be downloaded.
+
+        Args:
+            file_id: id to resolve through getFile.
+            data: contents of the file.
+            file_path: server side path, defaults to documents/<file_id>.bin.
+            file_unique_id: unique id reported by getFile, defaults to file_id.
+        Returns:
+            The File object getFile returns for file_id.
+        """
+        file_path = file_path or f"documents/{file_id}.bin"
+        self.files[file_path] = data
+        self._file_ids[file_id] = {
+            "file_id": file_id,
+            "file_unique_id": file_unique_id or file_id,
+            "file_size": len(data),
+            "file_path": file_path,
+        }
+        return self._file_ids[file_id]
+
+    def push_update(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queues an update for getUpdates, waking up any pending long poll.
+
+        Args:
+            update: the update body without update_id, e.g. {"message": {...}}.
+        Returns:
+            The queued update including its update_id.
+        """
+        with self._updates_ready:
+            self._update_id += 1
+            update = {"update_id": self._update_id, **update}
+            self.updates.append(update)
+            self._updates_ready.notify_all()
+        return update
+
+    def _api_getUpdates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        deadline = time.monotonic() + float(params.get("timeout", 0))
+        allowed = params.get("allowed_updates")
+        if isinstance(allowed, str):
+            allowed = json.loads(allowed)
+        with self._updates_ready:
+            while True:
+                # Like telegram, an offset confirms every earlier update.
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                pending = [u for u in self.updates if not allowed or any(kind in u for kind in allowed)]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    return pending[:limit]
+                self._updates_ready.wait(remaining)
+
+    def _api_getMe(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    def _api_setWebhook(self, params: Dict[str, Any]) -> bool:
+        return True
+
+    def _api_deleteWebhook(self, params: Dict[str, Any]) -> bool:
+        return True
+
+    def _api_setMyCommands(self, params: Dict[str, Any]) -> bool:
+        return True
+
+    def _api_getFile(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params.get("file_id") not in self._file_ids:
+            raise FakeApiError(400, "Bad Request: invalid file_id")
+        return self._file_ids[params["file_id"]]
+
+    def _api_sendMessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def _api_editMessageText(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "message_id": int(params.get("message_id", 0)),
+            "date": int(time.time()),
+            "edit_date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def _media_message(self, params: Dict[str, Any], media: Any) -> Dict[str, Any]:
+        with self.lock:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "private"},
+            "caption": params.get("caption", ""),
+        }
+        message.update(media(message_id))
+        return message
+
+    def _api_sendDocument(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._media_message(params, lambda message_id: {
+            "document": {"file_id": f"doc{message_id}", "file_unique_id": f"udoc{message_id}", "file_name": params.get("document", "")},
+        })
+
+    def _api_sendPhoto(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._media_message(params, lambda message_id: {
+            "photo": [{"file_id": f"photo{message_id}", "file_unique_id": f"uphoto{message_id}", "width": 1, "height": 1}],
+        })
+
+    def _api_sendVideo(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._media_message(params, lambda message_id: {
+            "video": {"file_id": f"video{message_id}", "file_unique_id": f"uvideo{message_id}", "width": 1, "height": 1, "duration": 1},
+        })
+
+    def _api_sendAudio(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._media_message(params, lambda message_id: {
+            "audio": {"file_id": f"audio{message_id}", "file_unique_id": f"uaudio{message_id}", "duration": 1},
+        })
+
+    def _api_sendAnimation(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._media_message(params, lambda message_id: {
+            "animation": {"file_id": f"animation{message_id}", "file_unique_id": f"uanimation{message_id}", "width": 1, "height": 1,
+                          "duration": 1},
+        })
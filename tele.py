@@ -1,10 +1,679 @@
-import asyncio
-import requests
-import argparse
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
 import os
+import threading
 import sys
 import time
-from typing import Dict, Any, Callable, List
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, IO, Iterable, Iterator, List, Optional, Union
+
+# Overridable to point the command line at a local stand-in server.
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+
+class _TokenBucket:
+    """
+    A token bucket that lets callers reserve tokens ahead of time. The balance
+    may go negative, which is how long later callers have to wait.
+    """
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Takes a token, returns how many seconds to wait before using it."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Makes sure no token becomes available for the next seconds."""
+        self._refill(now)
+        # The next token is the one sent once the seconds are up.
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class RateLimiter:
+    """
+    Token buckets enforcing telegram's flood limits: a global bucket per bot,
+    and a bucket per chat, with a per-minute budget for groups and channels.
+    reserve() only computes how long to wait, so the same limiter can be shared
+    by threads sleeping and event loops awaiting.
+    """
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 5):
+        """
+        Initialize the limiter.
+
+        Args:
+            global_rate: messages per second a bot may send overall.
+            chat_rate: messages per second a bot may send to a single private chat.
+            chat_burst: messages that may be sent to a private chat back to back.
+            group_rate: messages per second a bot may send to a single group or channel.
+            group_burst: messages that may be sent to a group or channel back to back.
+        """
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.counters = {"throttled": 0, "rate_limited": 0, "retried": 0, "failed": 0}
+        self._buckets: Dict[Any, _TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, bot_token: str, chat_id: Any, now: float) -> List[_TokenBucket]:
+        keys = [(bot_token, None)]
+        if chat_id is not None:
+            keys.append((bot_token, str(chat_id)))
+        buckets = []
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                chat = key[1]
+                if chat is None:
+                    bucket = _TokenBucket(self.global_rate, self.global_rate, now)
+                elif chat.startswith('-') or chat.startswith('@'):
+                    # Groups, supergroups and channels have negative ids or public usernames.
+                    bucket = _TokenBucket(self.group_rate, self.group_burst, now)
+                else:
+                    bucket = _TokenBucket(self.chat_rate, self.chat_burst, now)
+                self._buckets[key] = bucket
+            buckets.append(bucket)
+        return buckets
+
+    def reserve(self, bot_token: str, chat_id: Any = None) -> float:
+        """
+        Reserves a slot for one message, returns how many seconds to wait before sending it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            wait = max(bucket.reserve(now) for bucket in self._buckets_for(bot_token, chat_id, now))
+            if wait > 0:
+                self.counters["throttled"] += 1
+        return wait
+
+    def pause(self, bot_token: str, chat_id: Any, retry_after: float) -> None:
+        """
+        Holds back every sender to the chat after telegram answered with retry_after.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.counters["rate_limited"] += 1
+            self._buckets_for(bot_token, chat_id, now)[-1].pause(now, retry_after)
+
+    def count(self, counter: str) -> None:
+        """Increments one of the counters."""
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Returns a snapshot of the throttled, rate_limited, retried and failed counters."""
+        with self._lock:
+            return dict(self.counters)
+
+_default_rate_limiter = None
+_default_rate_limiter_lock = threading.Lock()
+
+def get_default_rate_limiter() -> RateLimiter:
+    """
+        Returns the rate limiter shared by all clients and senders that are not
+        given an explicit one, creating it on first use.
+        Returns:
+            The shared RateLimiter
+    """
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        if _default_rate_limiter is None:
+            _default_rate_limiter = RateLimiter()
+        return _default_rate_limiter
+
+def set_default_rate_limiter(rate_limiter: RateLimiter) -> None:
+    """
+        Replaces the rate limiter shared by all clients and senders.
+        Args:
+            rate_limiter: the limiter to use by default, or None to reset to a fresh one on next use
+    """
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        _default_rate_limiter = rate_limiter
+
+def _backoff(attempt: int, base: float = 0.5, cap: float = 30) -> float:
+    """
+    Private helper computing the exponential backoff delay with jitter for a retry attempt.
+    """
+    import random
+    return min(cap, base * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+# Progress and errors of the library are logged here rather than printed, silence them with
+# logging.getLogger("tele").setLevel(logging.CRITICAL). Every Bot API call is also logged at
+# DEBUG on "tele.api", with the call's event in the api_call attribute of the record.
+logger = logging.getLogger("tele")
+_api_logger = logging.getLogger("tele.api")
+
+_api_hooks: List[Callable[[Dict[str, Any]], None]] = []
+
+# How many attempts of the Bot call running in the current task came before, set by _call_with_retries.
+_api_attempt = contextvars.ContextVar("tele_api_attempt", default=0)
+
+def add_api_hook(hook: Callable[[Dict[str, Any]], None]) -> None:
+    """
+        Registers a hook called after every Bot API request made by a client,
+        sender or interactive bot. It receives a dict with the method, chat_id,
+        bytes_sent, bytes_received, latency in seconds, retries (how many
+        attempts of the same call came before), status (None if no response
+        was received) and outcome ("ok", "error", "rate_limited" or
+        "network_error"). Hooks run on the thread or loop that made the
+        request, so they should be quick; exceptions they raise are logged.
+        Args:
+            hook: the callable to register, e.g. an ApiMetrics
+    """
+    _api_hooks.append(hook)
+
+def remove_api_hook(hook: Callable[[Dict[str, Any]], None]) -> None:
+    """
+        Unregisters a hook added with add_api_hook, does nothing if it is not registered.
+        Args:
+            hook: the callable to unregister
+    """
+    with contextlib.suppress(ValueError):
+        _api_hooks.remove(hook)
+
+def _api_observed() -> bool:
+    """
+    Private helper telling whether anyone listens to API calls, so the hot path
+    skips measuring them otherwise.
+    """
+    return bool(_api_hooks) or _api_logger.isEnabledFor(logging.DEBUG)
+
+def _api_outcome(status: Optional[int]) -> str:
+    if status is None:
+        return "network_error"
+    if status == 429:
+        return "rate_limited"
+    return "ok" if 200 <= status < 300 else "error"
+
+def _emit_api_call(method: str, chat_id: Any, bytes_sent: int, bytes_received: int, latency: float, retries: int,
+                   status: Optional[int]) -> None:
+    """
+    Private helper passing one Bot API request to the debug log and the registered hooks.
+    """
+    event = {"method": method, "chat_id": None if chat_id is None else str(chat_id), "bytes_sent": bytes_sent,
+             "bytes_received": bytes_received, "latency": latency, "retries": retries, "status": status,
+             "outcome": _api_outcome(status)}
+    _api_logger.debug("%s %s in %.1f ms, %d bytes sent, %d received", method, event["outcome"], latency * 1000,
+                      bytes_sent, bytes_received, extra={"api_call": event})
+    for hook in list(_api_hooks):
+        try:
+            hook(event)
+        except Exception:
+            logger.exception("API hook %r failed", hook)
+
+def _emit_response(method: str, chat_id: Any, response: Optional["requests.Response"], start: float, retries: int) -> None:
+    """
+    Private helper emitting a requests call that started at start (a perf_counter
+    reading), with None as the response if it failed before one arrived.
+    """
+    latency = time.perf_counter() - start
+    if response is None:
+        _emit_api_call(method, chat_id, 0, 0, latency, retries, None)
+        return
+    try:
+        bytes_sent = int(response.request.headers.get("Content-Length") or 0)
+    except (AttributeError, TypeError, ValueError):
+        bytes_sent = 0
+    try:
+        bytes_received = int(response.headers.get("Content-Length") or len(response.content))
+    except (AttributeError, TypeError, ValueError):
+        bytes_received = 0
+    _emit_api_call(method, chat_id, bytes_sent, bytes_received, latency, retries, response.status_code)
+
+def _request_data_size(request_data: Any) -> int:
+    """
+    Private helper estimating the body size of a python-telegram-bot request.
+    """
+    if request_data is None:
+        return 0
+    if not request_data.contains_files:
+        return len(request_data.json_payload)
+    size = len(request_data.url_encoded_parameters())
+    for part in request_data.multipart_data.values():
+        content = part[1]
+        if isinstance(content, (bytes, bytearray)):
+            size += len(content)
+        else:
+            with contextlib.suppress(AttributeError, OSError, ValueError):
+                size += os.fstat(content.fileno()).st_size
+    return size
+
+_InstrumentedRequest = None
+
+def _instrumented_request(**kwargs) -> Any:
+    """
+    Private helper returning a python-telegram-bot HTTPXRequest which passes every
+    request it makes to the API hooks. The subclass is only created on first use,
+    so importing tele does not import telegram.
+    """
+    global _InstrumentedRequest
+    if _InstrumentedRequest is None:
+        from telegram.request import HTTPXRequest
+
+        class InstrumentedRequest(HTTPXRequest):
+            async def do_request(self, url, method, request_data=None, *args, **kw):
+                if not _api_observed():
+                    return await super().do_request(url, method, request_data, *args, **kw)
+                start = time.perf_counter()
+                status, payload = None, b""
+                try:
+                    status, payload = await super().do_request(url, method, request_data, *args, **kw)
+                    return status, payload
+                finally:
+                    chat_id = request_data.parameters.get("chat_id") if request_data is not None else None
+                    _emit_api_call(url.rsplit("/", 1)[-1], chat_id, _request_data_size(request_data), len(payload),
+                                   time.perf_counter() - start, _api_attempt.get(), status)
+
+        _InstrumentedRequest = InstrumentedRequest
+    return _InstrumentedRequest(**kwargs)
+
+class ApiMetrics:
+    """
+    An API hook keeping latency histograms and byte and retry counters per
+    method and outcome, exported in the Prometheus text format. Chats are left
+    out of the labels to keep the number of series bounded. Register it with
+    add_api_hook(metrics).
+    """
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, prefix: str = "tele_api"):
+        """
+        Initialize the collector.
+
+        Args:
+            buckets: upper bounds in seconds of the latency histogram buckets.
+            prefix: prefix of the exported metric names.
+        """
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets))
+        self.prefix = prefix
+        self._series: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        import bisect
+        index = bisect.bisect_left(self.buckets, event["latency"])
+        with self._lock:
+            series = self._series.get((event["method"], event["outcome"]))
+            if series is None:
+                series = {"buckets": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0, "retries": 0,
+                          "bytes_sent": 0, "bytes_received": 0}
+                self._series[(event["method"], event["outcome"])] = series
+            series["buckets"][index] += 1
+            series["count"] += 1
+            series["sum"] += event["latency"]
+            series["retries"] += 1 if event["retries"] else 0
+            series["bytes_sent"] += event["bytes_sent"]
+            series["bytes_received"] += event["bytes_received"]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        Returns one dict per method and outcome with its count, latency sum,
+        retries (requests that were a retry), bytes_sent and bytes_received.
+        """
+        with self._lock:
+            return [{"method": method, "outcome": outcome, **{k: v for k, v in series.items() if k != "buckets"}}
+                    for (method, outcome), series in sorted(self._series.items())]
+
+    def prometheus_text(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        name = f"{self.prefix}_request_duration_seconds"
+        counters = [("retries_total", "retries", "Bot API requests that retried an earlier attempt."),
+                    ("sent_bytes_total", "bytes_sent", "Bytes sent in Bot API request bodies."),
+                    ("received_bytes_total", "bytes_received", "Bytes received in Bot API response bodies.")]
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self._series.items())
+        lines = [f"# HELP {name} Latency of Bot API requests.", f"# TYPE {name} histogram"]
+        for (method, outcome), values in series:
+            labels = f'method="{_prometheus_escape(method)}",outcome="{_prometheus_escape(outcome)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {values['sum']!r}")
+            lines.append(f"{name}_count{{{labels}}} {values['count']}")
+        for suffix, key, help_text in counters:
+            lines += [f"# HELP {self.prefix}_{suffix} {help_text}", f"# TYPE {self.prefix}_{suffix} counter"]
+            for (method, outcome), values in series:
+                labels = f'method="{_prometheus_escape(method)}",outcome="{_prometheus_escape(outcome)}"'
+                lines.append(f"{self.prefix}_{suffix}{{{labels}}} {values[key]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Atomically writes prometheus_text to path, e.g. for node_exporter's textfile collector."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+def _prometheus_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Largest file a bot may upload through the public Bot API.
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+class _MultipartBody:
+    """
+    A multipart/form-data request body streaming a byte range of one file
+    from disk through a single reused buffer, so uploads never hold the file
+    in memory. It is iterable any number of times, so a retried request sends
+    it again from the start, and has a length so requests sends a Content-Length.
+    """
+    def __init__(self, fields: Dict[str, Any], file_field: str, path: str, filename: str = None, offset: int = 0,
+                 length: int = None, chunk_size: int = 1 << 16, progress: Callable[[int, int], None] = None):
+        boundary = os.urandom(16).hex()
+        head = "".join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                       for name, value in fields.items() if value is not None)
+        filename = (filename or os.path.basename(path)).replace('"', "'")
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n')
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.path = path
+        self.offset = offset
+        self.length = os.path.getsize(path) - offset if length is None else length
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._head = head.encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+
+    def __len__(self) -> int:
+        return len(self._head) + self.length + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        sent = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while sent < self.length:
+                read = f.readinto(view[:min(self.chunk_size, self.length - sent)])
+                if not read:
+                    raise IOError(f"{self.path} shrank while it was being uploaded")
+                # The chunk is written out before the generator resumes, so the buffer can be reused.
+                yield view[:read]
+                sent += read
+                if self.progress is not None:
+                    self.progress(sent, self.length)
+        yield self._tail
+
+def _content_range_total(content_range: Optional[str]) -> Optional[int]:
+    """
+    Private helper returning the complete size from a Content-Range header such as "bytes */1234".
+    """
+    if not content_range or "/" not in content_range:
+        return None
+    try:
+        return int(content_range.rsplit("/", 1)[1])
+    except ValueError:
+        return None
+
+class TelegramClient:
+    """
+    A pooled, keep-alive HTTP client for the telegram Bot API. Reusing a single
+    client across calls avoids paying a fresh TCP+TLS handshake per request.
+    """
+    def __init__(self, api_url: str = TELEGRAM_API_URL, pool_size: int = 10, connect_timeout: float = 10, read_timeout: float = 60,
+                 rate_limiter: RateLimiter = None, max_retries: int = 3):
+        """
+        Initialize the client.
+
+        Args:
+            api_url: base url of the Bot API, overridable for local stand-in servers.
+            pool_size: maximum number of keep-alive connections kept per host.
+            connect_timeout: timeout in seconds for establishing a connection.
+            read_timeout: timeout in seconds for waiting on a response.
+            rate_limiter: limiter sends go through, defaults to the shared limiter.
+            max_retries: how many times a send is retried on flood control or network errors.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.api_url = api_url.rstrip("/")
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def method_url(self, bot_token: str, method: str) -> str:
+        """Returns the url of a Bot API method for a given bot."""
+        return f"{self.api_url}/bot{bot_token}/{method}"
+
+    def file_url(self, bot_token: str, file_path: str) -> str:
+        """Returns the download url of a file as returned by getFile."""
+        return f"{self.api_url}/file/bot{bot_token}/{file_path}"
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        """Issues a POST over the pooled session using the client timeouts by default."""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        """
+        Issues a GET over the pooled session using the client timeouts by default.
+        Bot API calls are passed to the API hooks, streamed downloads are by download.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if kwargs.get("stream") or not _api_observed():
+            return self.session.get(url, **kwargs)
+        method = url.split("?", 1)[0].rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.session.get(url, **kwargs)
+            return response
+        finally:
+            _emit_response(method, None, response, start, 0)
+
+    def send(self, bot_token: str, method: str, chat_id: Any, **kwargs) -> Optional["requests.Response"]:
+        """
+        POSTs to a Bot API send method for chat_id through the rate limiter.
+        Flood control (429) is retried after the retry_after telegram asks
+        for, server and network errors with exponential backoff.
+
+        Args:
+            bot_token: unique identifier for the telegram bot.
+            method: Bot API method, e.g. "sendMessage".
+            chat_id: chat the request sends to, used for per-chat limits.
+            kwargs: passed on to post, e.g. data.
+        Returns:
+            The last response, or None if no response was ever received.
+        """
+        import requests
+        limiter = self.rate_limiter or get_default_rate_limiter()
+        url = self.method_url(bot_token, method)
+        response = None
+        for attempt in range(self.max_retries + 1):
+            time.sleep(limiter.reserve(bot_token, chat_id))
+            start = time.perf_counter()
+            try:
+                response = self.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if _api_observed():
+                    _emit_response(method, chat_id, None, start, attempt)
+                logger.warning("Error calling %s: %s", method, e)
+                delay = _backoff(attempt)
+            else:
+                if _api_observed():
+                    _emit_response(method, chat_id, response, start, attempt)
+                if response.status_code == 429:
+                    try:
+                        delay = float(response.json()["parameters"]["retry_after"])
+                    except (ValueError, KeyError, TypeError):
+                        delay = _backoff(attempt)
+                    limiter.pause(bot_token, chat_id, delay)
+                elif response.status_code >= 500:
+                    delay = _backoff(attempt)
+                else:
+                    return response
+            if attempt == self.max_retries:
+                break
+            limiter.count("retried")
+            time.sleep(delay)
+        limiter.count("failed")
+        return response
+
+    def download(self, url: str, out_path: str, part_path: str = None, chunk_size: int = 1 << 16,
+                 progress: Callable[[int, Optional[int]], None] = None, sha256: str = None, size: int = None) -> bool:
+        """
+        Streams a file to disk in fixed-size chunks. Data is written to part_path
+        and atomically renamed to out_path once complete. An existing part_path is
+        resumed with an HTTP Range request. A part_path that does not match the
+        file's size, e.g. left over from a different file, is discarded and the
+        download starts over.
+
+        Args:
+            url: url of the file to download.
+            out_path: final location of the file.
+            part_path: location of the partial download, defaults to out_path + ".part".
+            chunk_size: number of bytes read from the connection at a time.
+            progress: optional callback receiving (bytes_done, bytes_total or None).
+            sha256: optional expected hex digest of the complete file.
+            size: optional expected size of the complete file, e.g. getFile's file_size.
+        Returns:
+            True if the file was stored at out_path, False otherwise.
+        """
+        part_path = part_path or out_path + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if size is not None and offset > size:
+            offset = 0
+            os.remove(part_path)
+        restart = False
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        start = time.perf_counter()
+        received = 0
+        status = None
+        response = None
+        try:
+            response = self.get(url, headers=headers, stream=True)
+            status = response.status_code
+            if response.status_code == 416:
+                # The range starts past the end, which only means the part file already
+                # holds the whole file if its size is the file's size.
+                total = _content_range_total(response.headers.get("Content-Range"))
+                if total is None:
+                    total = size
+                if total != offset:
+                    if offset == 0:
+                        logger.error("Error downloading %s: HTTP 416", out_path)
+                        return False
+                    restart = True
+            elif response.status_code not in (200, 206):
+                logger.error("Error downloading %s: HTTP %s", out_path, response.status_code)
+                return False
+            else:
+                if response.status_code == 200:
+                    # Server ignored the range, start over.
+                    offset = 0
+                length = response.headers.get("Content-Length")
+                total = offset + int(length) if length else None
+                done = offset
+                with open(part_path, "ab" if offset > 0 else "wb") as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        done += len(chunk)
+                        received += len(chunk)
+                        if progress:
+                            progress(done, total)
+        except BaseException:
+            # A transfer cut short counts as failed whatever the status said.
+            status = None
+            raise
+        finally:
+            if response is not None:
+                response.close()
+            if _api_observed():
+                _emit_api_call("download", None, 0, received, time.perf_counter() - start, 0, status)
+
+        if restart:
+            logger.warning("Discarding %s, it does not match the size of %s", part_path, out_path)
+            os.remove(part_path)
+            return self.download(url, out_path, part_path, chunk_size, progress, sha256, size)
+        if sha256 and file_digest(part_path) != sha256.lower():
+            logger.error("Error downloading %s: checksum mismatch", out_path)
+            os.remove(part_path)
+            return False
+        os.replace(part_path, out_path)
+        return True
+
+    def upload(self, bot_token: str, method: str, chat_id: Any, file_field: str, path: str, fields: Dict[str, Any] = None,
+               filename: str = None, offset: int = 0, length: int = None, progress: Callable[[int, int], None] = None,
+               **kwargs) -> Optional["requests.Response"]:
+        """
+        Uploads a file, or length bytes of it starting at offset, to a Bot API
+        send method as a streamed multipart request, going through the rate
+        limiter and retries like send. The file is read from disk in fixed
+        size chunks while it is sent, so memory use does not grow with its size.
+
+        Args:
+            bot_token: unique identifier for the telegram bot.
+            method: the Bot API method, e.g. sendDocument.
+            chat_id: the chat sent to, also used as the chat_id field.
+            file_field: name of the file field, e.g. document.
+            path: path of the file to upload.
+            fields: further form fields, e.g. caption.
+            filename: file name telegram shows, defaults to the name of path.
+            offset: first byte of the file to upload.
+            length: how many bytes to upload, defaults to the rest of the file.
+            progress: called with the bytes sent so far and the total after every chunk.
+            kwargs: passed on to post, e.g. timeout.
+        Returns:
+            The last response, or None if no response was ever received.
+        """
+        body = _MultipartBody({"chat_id": chat_id, **(fields or {})}, file_field, path, filename, offset, length, progress=progress)
+        return self.send(bot_token, method, chat_id, data=body, headers={"Content-Type": body.content_type}, **kwargs)
+
+    def close(self) -> None:
+        """Closes all pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_default_client = None
+# Threads such as queue workers and daemon handlers may all ask for the default at once.
+_default_client_lock = threading.Lock()
+
+def get_default_client() -> TelegramClient:
+    """
+        Returns the client shared by all Bot API calls that are not given
+        an explicit client, creating it on first use.
+        Returns:
+            The shared TelegramClient
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = TelegramClient()
+        return _default_client
+
+def set_default_client(client: TelegramClient) -> None:
+    """
+        Replaces the client shared by all Bot API calls.
+        Args:
+            client: the client to use by default, or None to reset to a fresh one on next use
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
 
 def look_for(message: str, char: str, offset: int, max_offset: int) -> int:
     """
@@ -19,76 +688,845 @@ def look_for(message: str, char: str, offset: int, max_offset: int) -> int:
         Returns:
             An index in message where the char was found or -1 if not found.
     """
-    for i in range(max_offset):
-        if message[offset - i] == char:
-            return offset - i
-    return -1
+    if max_offset <= 0:
+        return -1
+    return message.rfind(char, max(offset - max_offset + 1, 0), offset + 1)
 
-def send_telegram(bot_token: str, chat_token: str, message: str) -> None:
+def utf16_len(text: str) -> int:
     """
-        Sends a given message via telegram from bot specified by bot_token,
-        to a chat specified by chat_token.
+        Returns the length of text in UTF-16 code units, which is how
+        telegram measures message limits.
         Args:
-            bot_token: unique identifier for the telegram bot
-            chat_token: unique identifier for a chat
-            message: message to be sent
+            text: the text to measure
         Returns:
-            Nothing
+            The number of UTF-16 code units in text
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+def _utf16_prefix(text: str, start: int, limit: int) -> int:
+    """
+    Private helper returning how many code points from start fit in limit UTF-16 code units.
+    """
+    candidate = text[start:start + limit]
+    if candidate.isascii():
+        return len(candidate)
+    encoded = candidate.encode('utf-16-le')
+    if len(encoded) <= 2 * limit:
+        return len(candidate)
+    encoded = encoded[:2 * limit]
+    if 0xD8 <= encoded[-1] <= 0xDB:
+        # Never split a surrogate pair.
+        encoded = encoded[:-2]
+    return len(encoded.decode('utf-16-le'))
+
+def iter_chunks(text: Union[str, Iterable[str], IO[str]], chunk_size: int = 4090, max_search_back: int = 2048,
+                min_size: int = 512) -> Iterator[str]:
+    """
+        Splits text into chunks of at most chunk_size UTF-16 code units,
+        preferring to break after a newline, then after a space, within
+        max_search_back of the limit. Text may be a string, an iterable of
+        strings or a file-like object, the latter two are read lazily.
+        Args:
+            text: the text to split
+            chunk_size: maximum chunk length in UTF-16 code units
+            max_search_back: how far back from the limit to look for a break
+            min_size: minimum length of a chunk that ends at a break
+        Returns:
+            An iterator over the chunks
     """
-    print(f"Sending to {chat_token}: {message}")
-    chunk_size = 4090
-    max_search_back = 2048
-    min_size = 512
-    start = 0
-    while start < len(message):
-        end = min(start + chunk_size, len(message)) - 1
-        if start + chunk_size < len(message):
-            search = look_for(message, '\n', end, min(max_search_back, end - start - min_size))
+    if isinstance(text, str):
+        pieces = iter([text])
+    elif hasattr(text, 'read'):
+        pieces = iter(lambda: text.read(1 << 16), '')
+    else:
+        pieces = iter(text)
+    buffer = ""
+    pos = 0
+    exhausted = False
+    while True:
+        # More than chunk_size code points is always more than chunk_size code units.
+        while not exhausted and len(buffer) - pos <= chunk_size:
+            piece = next(pieces, None)
+            if piece is None:
+                exhausted = True
+            elif piece:
+                buffer = buffer[pos:] + piece
+                pos = 0
+        if pos >= len(buffer):
+            return
+        fits = _utf16_prefix(buffer, pos, chunk_size)
+        end = pos + fits - 1
+        if pos + fits < len(buffer):
+            window = min(max_search_back, fits - 1 - min_size)
+            search = look_for(buffer, '\n', end, window)
             if search < 0:
-                search = look_for(message, ' ', end, min(max_search_back, end - start - min_size))
-            if search > 0:
+                search = look_for(buffer, ' ', end, window)
+            if search > pos:
                 end = search
-        chunk = message[start:end + 1]
-        start = end + 1
+        yield buffer[pos:end + 1]
+        pos = end + 1
 
+def send_telegram(bot_token: str, chat_token: str, message: Union[str, Iterable[str], IO[str]], client: TelegramClient = None) -> bool:
+    """
+        Sends a given message via telegram from bot specified by bot_token,
+        to a chat specified by chat_token. Long messages are split into
+        several messages, see iter_chunks.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            message: message to be sent, a string, an iterable of strings or a file-like object
+            client: http client to send with, defaults to the shared pooled client
+        Returns:
+            True if every chunk of the message was sent
+    """
+    client = client or get_default_client()
+    logger.info("Sending to %s: %s", chat_token, message if isinstance(message, str) else '<stream>')
+    sent = True
+    for chunk in iter_chunks(message):
         try:
-            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
             data = {"chat_id": chat_token, "text": chunk}
-            requests.post(url, data=data)
+            response = client.send(bot_token, "sendMessage", chat_token, data=data)
+            if response is None or response.status_code != 200:
+                logger.error("Error sending message: %s", response.text if response is not None else 'no response')
+                sent = False
         except Exception as e:
-            print(f"Error sending message: {e}")
+            logger.error("Error sending message: %s", e)
+            sent = False
+    return sent
+
+class LiveMessage:
+    """
+    A message kept up to date as text is appended to it, with at most one
+    request per min_interval seconds. Text beyond chunk_size rolls over into
+    new messages, the last of which becomes the live one, so a stream of
+    output costs a request per second and per chunk rather than per line.
+    """
+    def __init__(self, bot_token: str, chat_token: str, client: TelegramClient = None, min_interval: float = 1.0, chunk_size: int = 4090):
+        """
+        Initialize the message, nothing is sent until text is published.
+
+        Args:
+            bot_token: unique identifier for the telegram bot.
+            chat_token: chat the message is sent to.
+            client: http client to send with, defaults to the shared pooled client.
+            min_interval: seconds between two publishes.
+            chunk_size: maximum length of a message in UTF-16 code units.
+        """
+        self.bot_token = bot_token
+        self.chat_token = chat_token
+        self.client = client
+        self.min_interval = min_interval
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.messages = 0
+        self._message_id = None
+        self._text = ""
+        self._published = ""
+        self._pending = ""
+        self._next_publish = 0.0
+        self._lock = threading.Lock()
+
+    def append(self, text: str) -> None:
+        """Adds text to the end of the message, it is sent by the next publish."""
+        with self._lock:
+            self._pending += text
+
+    @property
+    def pending(self) -> bool:
+        """True if text was appended since the last publish."""
+        with self._lock:
+            return bool(self._pending)
+
+    def wait(self) -> None:
+        """Sleeps until the next publish is allowed."""
+        delay = self._next_publish - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _call(self, method: str, data: Dict[str, Any]) -> Optional[int]:
+        """Calls a Bot API method, returns the message_id of the resulting message or None on failure."""
+        self.requests += 1
+        client = self.client or get_default_client()
+        try:
+            response = client.send(self.bot_token, method, self.chat_token, data={"chat_id": self.chat_token, **data})
+            if response is not None and response.status_code == 200:
+                return response.json()["result"]["message_id"]
+            logger.error("Error calling %s: %s", method, response.text if response is not None else 'no response')
+        except Exception as e:
+            logger.error("Error calling %s: %s", method, e)
+        return None
+
+    def _show(self, text: str) -> bool:
+        # Telegram trims trailing whitespace and rejects edits that change nothing.
+        text = text.rstrip()
+        if not text or text == self._published:
+            return True
+        if self._message_id is not None:
+            if self._call("editMessageText", {"message_id": self._message_id, "text": text}) is not None:
+                self._published = text
+                return True
+        message_id = self._call("sendMessage", {"text": text})
+        if message_id is None:
+            return False
+        self._message_id = message_id
+        self._published = text
+        self.messages += 1
+        return True
+
+    def _roll_over(self) -> None:
+        self._message_id = None
+        self._published = ""
+
+    def publish(self) -> bool:
+        """
+        Sends the appended text now, editing the live message and sending a
+        new one for every chunk it overflows into. Returns True if every
+        request succeeded.
+        """
+        with self._lock:
+            text = self._text + self._pending
+            self._pending = ""
+        chunks = list(iter_chunks(text, self.chunk_size, self.chunk_size // 2, self.chunk_size // 8)) or [""]
+        ok = True
+        for chunk in chunks[:-1]:
+            ok = self._show(chunk) and ok
+            self._roll_over()
+        ok = self._show(chunks[-1]) and ok
+        self._text = chunks[-1]
+        self._next_publish = time.monotonic() + self.min_interval
+        return ok
+
+def send_telegram_live(bot_token: str, chat_token: str, stream: IO[str], client: TelegramClient = None, min_interval: float = 1.0,
+                       chunk_size: int = 4090) -> bool:
+    """
+        Sends text read from a stream, e.g. stdin, as it arrives, keeping a
+        single live message up to date with at most one request per
+        min_interval seconds and rolling over to a new message once it is
+        full, see LiveMessage. Returns once the stream is exhausted and the
+        last of it has been sent.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            stream: file-like object the text is read from line by line
+            client: http client to send with, defaults to the shared pooled client
+            min_interval: seconds between two requests
+            chunk_size: maximum length of a message in UTF-16 code units
+        Returns:
+            True if every request succeeded
+    """
+    live = LiveMessage(bot_token, chat_token, client, min_interval, chunk_size)
+    changed = threading.Event()
+    finished = threading.Event()
+
+    def read() -> None:
+        try:
+            for line in iter(stream.readline, ''):
+                live.append(line)
+                changed.set()
+        finally:
+            finished.set()
+            changed.set()
+
+    threading.Thread(target=read, name="tele-live-reader", daemon=True).start()
+    ok = True
+    while True:
+        changed.wait()
+        # Text keeps accumulating while the interval runs out.
+        live.wait()
+        changed.clear()
+        done = finished.is_set()
+        ok = live.publish() and ok
+        if done and not live.pending:
+            return ok
+
+def file_digest(path: str) -> str:
+    """
+        Computes the sha256 hex digest of a file without loading it whole.
+        Args:
+            path: path of the file to hash
+        Returns:
+            The hex digest of the file contents
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FileIdCache:
+    """
+    A persistent SQLite index mapping file content hash and media type to the
+    file_id telegram returned for the first upload, so identical media can be
+    resent by id instead of uploading the bytes again. Entries are evicted
+    when older than max_age or, least recently used first, beyond max_entries.
+    """
+    def __init__(self, path: str, max_entries: int = 10000, max_age: float = 30 * 24 * 3600):
+        """
+        Initialize the cache, creating the database if needed.
+
+        Args:
+            path: location of the SQLite database file.
+            max_entries: maximum number of file ids to keep.
+            max_age: seconds after which a file id is no longer trusted.
+        """
+        import sqlite3
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            " bot_id TEXT NOT NULL, media_type TEXT NOT NULL, digest TEXT NOT NULL,"
+            " file_id TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (bot_id, media_type, digest))")
+        self._db.commit()
+
+    @staticmethod
+    def _bot_id(bot_token: str) -> str:
+        # File ids are only valid for the bot that received them, key by its numeric id.
+        return bot_token.split(':')[0]
+
+    def get(self, bot_token: str, media_type: str, digest: str) -> Optional[str]:
+        """Returns the cached file_id for the content, or None if unknown or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id FROM file_ids WHERE bot_id = ? AND media_type = ? AND digest = ? AND created >= ?",
+                (self._bot_id(bot_token), media_type, digest, now - self.max_age)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE file_ids SET last_used = ? WHERE bot_id = ? AND media_type = ? AND digest = ?",
+                (now, self._bot_id(bot_token), media_type, digest))
+            self._db.commit()
+        return row[0]
+
+    def put(self, bot_token: str, media_type: str, digest: str, file_id: str) -> None:
+        """Records the file_id for the content and applies the eviction policy."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?, ?, ?, ?)",
+                (self._bot_id(bot_token), media_type, digest, file_id, now, now))
+            self._db.execute("DELETE FROM file_ids WHERE created < ?", (now - self.max_age,))
+            self._db.execute(
+                "DELETE FROM file_ids WHERE rowid NOT IN"
+                " (SELECT rowid FROM file_ids ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+            self._db.commit()
+
+    def discard(self, bot_token: str, media_type: str, digest: str) -> None:
+        """Forgets the file_id for the content, e.g. after telegram rejected it."""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM file_ids WHERE bot_id = ? AND media_type = ? AND digest = ?",
+                (self._bot_id(bot_token), media_type, digest))
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+
+    def close(self) -> None:
+        """Closes the database."""
+        with self._lock:
+            self._db.close()
+
+def _save_jpeg(image: Any, path: str, quality: int) -> None:
+    """
+    Private helper writing an image as a JPEG without any metadata, atomically replacing path.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp_path, "JPEG", quality=quality, optimize=True)
+    os.replace(tmp_path, path)
+
+def _shrink_image(source: str, image_path: str, thumbnail_path: str, max_side: int, quality: int, thumbnail_side: int) -> None:
+    """
+    Private helper run in a worker process, downsizing and re-encoding an
+    image and writing a thumbnail of it, see ImagePreprocessor.
+    """
+    from PIL import Image, ImageOps
+    with Image.open(source) as original:
+        # Orientation lives in the exif data that is dropped, so it is applied to the pixels first.
+        image = ImageOps.exif_transpose(original)
+        if image.mode != "RGB":
+            # JPEG has no alpha channel, transparent pixels become white.
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        _save_jpeg(image, image_path, quality)
+        image.thumbnail((thumbnail_side, thumbnail_side), Image.LANCZOS)
+        _save_jpeg(image, thumbnail_path, quality)
+
+def _process_pool(max_workers: Optional[int]) -> "concurrent.futures.ProcessPoolExecutor":
+    """
+    Private helper creating a process pool that never forks the calling process.
+    Pools are created from threaded code (the sender loop, daemon handlers),
+    and forking a process with other threads running can deadlock the children.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+
+class ImagePreprocessor:
+    """
+    Shrinks images before they are uploaded. Telegram recompresses photos to
+    about 1280px anyway, so uploading the camera original only costs time and
+    bandwidth. Images are downsized to max_side, re-encoded as JPEG without
+    metadata and given a thumbnail, in a process pool so batches are handled
+    in parallel. Results are kept in cache_dir by content hash, so an image
+    is only ever processed once. Needs the optional Pillow package.
+    """
+    def __init__(self, cache_dir: str = None, max_side: int = 1280, quality: int = 85, thumbnail_side: int = 320, max_workers: int = None):
+        """
+        Initialize the preprocessor, the process pool is started on first use.
+
+        Args:
+            cache_dir: directory keeping processed images, defaults to a temporary directory removed by close.
+            max_side: longest side of processed images in pixels, smaller images keep their size.
+            quality: JPEG quality of processed images and thumbnails.
+            thumbnail_side: longest side of thumbnails in pixels, telegram accepts up to 320.
+            max_workers: size of the process pool, defaults to the number of CPUs.
+        """
+        import tempfile
+        import PIL  # noqa: F401, fails here rather than in a worker when Pillow is missing
+        self._temporary = cache_dir is None
+        self.cache_dir = tempfile.mkdtemp(prefix="tele-images-") if cache_dir is None else cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_side = max_side
+        self.quality = quality
+        self.thumbnail_side = thumbnail_side
+        self.max_workers = max_workers
+        self._pool = None
+        self._pending: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _outputs(self, digest: str) -> List[str]:
+        name = os.path.join(self.cache_dir, f"{digest}-{self.max_side}-{self.quality}")
+        return [f"{name}.jpg", f"{name}-thumb{self.thumbnail_side}.jpg"]
+
+    def _submit(self, path: str, digest: str) -> "concurrent.futures.Future":
+        """Starts processing path in the pool unless the same content is already being processed."""
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is None:
+                if self._pool is None:
+                    self._pool = _process_pool(self.max_workers)
+                future = self._pool.submit(_shrink_image, path, *self._outputs(digest), self.max_side, self.quality, self.thumbnail_side)
+                self._pending[digest] = future
+                future.add_done_callback(lambda _: self._pending.pop(digest, None))
+            return future
+
+    async def prepare(self, path: str) -> List[str]:
+        """
+        Processes an image in the pool without blocking the event loop.
+        Returns the paths of the processed image and of its thumbnail.
+        """
+        import asyncio
+        digest = await asyncio.to_thread(file_digest, path)
+        outputs = self._outputs(digest)
+        if not all(os.path.exists(output) for output in outputs):
+            await asyncio.wrap_future(self._submit(path, digest))
+        return outputs
+
+    def process(self, paths: List[str]) -> List[List[str]]:
+        """
+        Processes a batch of images in parallel, blocking until all are done.
+        Returns for each image the paths of the processed image and of its thumbnail.
+        """
+        results = []
+        futures = []
+        for path in paths:
+            digest = file_digest(path)
+            results.append(self._outputs(digest))
+            if not all(os.path.exists(output) for output in results[-1]):
+                futures.append(self._submit(path, digest))
+        for future in futures:
+            future.result()
+        return results
+
+    def close(self) -> None:
+        """Stops the process pool and removes the cache directory if it is temporary."""
+        import shutil
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+        if self._temporary:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+class AsyncSender:
+    """
+    Owns one long-lived event loop on a background thread and one telegram.Bot
+    per token, so every media send shares a single loop and HTTP connection pool.
+    """
+    def __init__(self, api_url: str = TELEGRAM_API_URL, pool_size: int = 8, max_concurrent_uploads: int = 4, file_id_cache: FileIdCache = None,
+                 rate_limiter: RateLimiter = None, max_retries: int = 3, max_upload_size: int = MAX_UPLOAD_SIZE, oversize: str = "reject",
+                 stream_threshold: int = 10 * 1024 * 1024, upload_progress: Callable[[str, int, int], None] = None,
+                 image_preprocessor: ImagePreprocessor = None):
+        """
+        Initialize the sender, the loop itself is started on first use.
+
+        Args:
+            api_url: base url of the Bot API, overridable for local stand-in servers.
+            pool_size: maximum number of connections in each bot's HTTP pool.
+            max_concurrent_uploads: how many files may be uploaded at the same time.
+            file_id_cache: optional cache used to resend known content by file_id.
+            rate_limiter: limiter sends go through, defaults to the shared limiter.
+            max_retries: how many times a send is retried on flood control or network errors.
+            max_upload_size: files larger than this many bytes are not uploaded as they are.
+            oversize: what to do with larger files, "reject" them, "split" them into numbered
+                      document parts, or "compress" them with gzip first and split what is still too large.
+            stream_threshold: files of at least this many bytes are streamed from disk rather than read into memory.
+            upload_progress: called with the path, bytes sent so far and total bytes while a file is streamed.
+            image_preprocessor: optional preprocessor shrinking photos before upload and giving image documents a thumbnail.
+        """
+        import asyncio
+        if oversize not in ("reject", "split", "compress"):
+            raise ValueError(f"unknown oversize policy {oversize!r}")
+        self.max_upload_size = max_upload_size
+        self.oversize = oversize
+        self.stream_threshold = stream_threshold
+        self.upload_progress = upload_progress
+        self.image_preprocessor = image_preprocessor
+        self._client = None
+        self.api_url = api_url.rstrip("/")
+        self.file_id_cache = file_id_cache
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.upload_slots = asyncio.Semaphore(max_concurrent_uploads)
+        self._bots: Dict[str, Any] = {}
+        self._requests: List[Any] = []
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> "asyncio.AbstractEventLoop":
+        import asyncio
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="tele-sender", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def get_bot(self, bot_token: str):
+        """Returns the shared Bot for bot_token. Must be called on the sender loop."""
+        bot = self._bots.get(bot_token)
+        if bot is None:
+            from telegram import Bot
+            request = _instrumented_request(connection_pool_size=self.pool_size)
+            bot = Bot(token=bot_token, request=request,
+                      base_url=f"{self.api_url}/bot", base_file_url=f"{self.api_url}/file/bot")
+            self._requests.append(request)
+            self._bots[bot_token] = bot
+        return bot
+
+    def get_client(self) -> TelegramClient:
+        """Returns the pooled http client streamed uploads go through, sharing the sender's limiter."""
+        with self._lock:
+            if self._client is None:
+                self._client = TelegramClient(api_url=self.api_url, pool_size=self.pool_size, rate_limiter=self.rate_limiter,
+                                              max_retries=self.max_retries)
+            return self._client
+
+    def run(self, coro) -> Any:
+        """Runs a coroutine on the sender loop, blocking until it completes."""
+        import asyncio
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def submit(self, coro) -> Any:
+        """Awaits a coroutine on the sender loop from any event loop."""
+        import asyncio
+        loop = self._ensure_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def close(self) -> None:
+        """Closes all bot connection pools and stops the sender loop."""
+        import asyncio
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+        if loop is None:
+            return
+
+        async def shutdown():
+            for request in self._requests:
+                await request.shutdown()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        self._bots.clear()
+        self._requests.clear()
+        self.upload_slots = asyncio.Semaphore(self.max_concurrent_uploads)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+_default_sender = None
+_default_sender_lock = threading.Lock()
+
+def get_default_sender() -> AsyncSender:
+    """
+        Returns the sender shared by all media sends that are not given
+        an explicit sender, creating it on first use.
+        Returns:
+            The shared AsyncSender
+    """
+    global _default_sender
+    with _default_sender_lock:
+        if _default_sender is None:
+            _default_sender = AsyncSender()
+            atexit.register(_default_sender.close)
+        return _default_sender
 
-async def _send_media_helper(bot_token: str, chat_token: str, file_path: str, caption: str, timeout: int, method_name: str, file_arg_name: str) -> None:
+def set_default_sender(sender: AsyncSender) -> None:
+    """
+        Replaces the sender shared by all media sends.
+        Args:
+            sender: the sender to use by default, or None to reset to a fresh one on next use
+    """
+    global _default_sender
+    with _default_sender_lock:
+        _default_sender = sender
+
+async def _send_media_helper(bot_token: str, chat_token: str, file_path: str, caption: str, timeout: int, method_name: str, file_arg_name: str, sender: AsyncSender = None) -> bool:
     """
     Private helper to send various media types to avoid code duplication.
+    The send always runs on the sender loop, whichever loop awaits it.
+    """
+    sender = sender or get_default_sender()
+    return await sender.submit(_send_media(sender, bot_token, chat_token, file_path, caption, timeout, method_name, file_arg_name))
+
+async def _call_with_retries(sender: AsyncSender, bot_token: str, chat_token: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Private helper running a Bot call through the rate limiter, retrying on
+    flood control after the retry_after telegram asks for and on network
+    errors with exponential backoff. Re-raises the last error once out of retries.
+    """
+    import asyncio
+    from telegram.error import BadRequest, NetworkError, RetryAfter
+    limiter = sender.rate_limiter or get_default_rate_limiter()
+    for attempt in range(sender.max_retries + 1):
+        await asyncio.sleep(limiter.reserve(bot_token, chat_token))
+        token = _api_attempt.set(attempt)
+        try:
+            return await call()
+        except RetryAfter as e:
+            error = e
+            delay = float(e.retry_after)
+            limiter.pause(bot_token, chat_token, delay)
+        except BadRequest:
+            raise
+        except NetworkError as e:
+            error = e
+            delay = _backoff(attempt)
+        finally:
+            _api_attempt.reset(token)
+        if attempt == sender.max_retries:
+            break
+        limiter.count("retried")
+        await asyncio.sleep(delay)
+    limiter.count("failed")
+    raise error
+
+# Telegram's wording for a file_id it no longer accepts, as opposed to errors about the chat or caption.
+_FILE_ID_ERRORS = ("file identifier", "file_reference", "file reference", "wrong remote file", "media_empty",
+                   "type of file mismatch")
+
+def _is_file_id_error(error: Exception) -> bool:
+    """
+    Private helper telling whether a BadRequest rejected the file_id itself,
+    the only case where uploading the file again can help.
     """
+    message = str(error).lower()
+    return any(marker in message for marker in _FILE_ID_ERRORS)
+
+def _message_file_id(message: Any, file_arg_name: str) -> Optional[str]:
+    """
+    Private helper extracting the file_id of the media attached to a sent message.
+    """
+    media = getattr(message, file_arg_name, None)
+    if isinstance(media, (tuple, list)):
+        # Photos come back as several sizes, the last one is the original.
+        media = media[-1] if media else None
+    return getattr(media, 'file_id', None)
+
+def _api_method(method_name: str) -> str:
+    """
+    Private helper turning a Bot method name into its Bot API name, e.g. 'sendPhoto' from 'send_photo'.
+    """
+    first, *rest = method_name.split('_')
+    return first + ''.join(part.capitalize() for part in rest)
+
+async def _stream_upload(sender: AsyncSender, bot_token: str, chat_token: str, api_method: str, file_field: str, path: str,
+                         fields: Dict[str, Any], timeout: int, filename: str = None, offset: int = 0, length: int = None) -> Any:
+    """
+    Private helper streaming a file, or a byte range of it, from disk through
+    the sender's http client on a worker thread. Returns the sent Message,
+    failures are raised as the python-telegram-bot errors the Bot would raise.
+    """
+    import asyncio
+    import functools
+    from telegram import Message
+    from telegram.error import BadRequest, NetworkError, TelegramError
+    client = sender.get_client()
+    progress = functools.partial(sender.upload_progress, path) if sender.upload_progress else None
+    kwargs = {'timeout': (client.timeout[0], timeout)} if timeout else {}
+    async with sender.upload_slots:
+        response = await asyncio.to_thread(client.upload, bot_token, api_method, chat_token, file_field, path, fields, filename,
+                                           offset, length, progress, **kwargs)
+    if response is None:
+        raise NetworkError(f"No response uploading {path}")
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    if not payload.get("ok"):
+        description = payload.get("description") or f"HTTP {response.status_code}"
+        raise BadRequest(description) if response.status_code == 400 else TelegramError(description)
+    return Message.de_json(payload["result"], sender.get_bot(bot_token))
+
+def _gzip_file(path: str) -> str:
+    """
+    Private helper compressing a file into a temporary file, returns the temporary file's path.
+    """
+    import gzip
+    import shutil
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix=".gz", delete=False) as tmp:
+        with open(path, 'rb') as f, gzip.GzipFile(fileobj=tmp, mode='wb', filename=os.path.basename(path)) as out:
+            shutil.copyfileobj(f, out, 1 << 20)
+    return tmp.name
+
+async def _send_oversized(sender: AsyncSender, bot_token: str, chat_token: str, file_path: str, caption: str, timeout: int, size: int) -> bool:
+    """
+    Private helper applying the sender's oversize policy to a file over its
+    max_upload_size, returns True if the file, or all of its parts, were sent.
+    Parts are streamed as documents named <name>.001, <name>.002 and so on.
+    """
+    import asyncio
+    limit = sender.max_upload_size
+    if sender.oversize == "reject":
+        logger.error("Error: %s is %d bytes, over the %d byte upload limit", file_path, size, limit)
+        return False
+    name = os.path.basename(file_path)
+    source = file_path
+    try:
+        if sender.oversize == "compress":
+            source = await asyncio.to_thread(_gzip_file, file_path)
+            name += ".gz"
+            size = os.path.getsize(source)
+        parts = max(1, -(-size // limit))
+        for i in range(parts):
+            offset = i * limit
+            part_caption = caption if parts == 1 else f"{caption} ({i + 1}/{parts})"
+            part_name = name if parts == 1 else f"{name}.{i + 1:03d}"
+            await _stream_upload(sender, bot_token, chat_token, "sendDocument", "document", source, {'caption': part_caption},
+                                 timeout, part_name, offset, min(limit, size - offset))
+        logger.info("%s sent successfully as %d document part(s)!", file_path, parts)
+        return True
+    finally:
+        if source != file_path:
+            os.unlink(source)
+
+async def _preprocess(sender: AsyncSender, file_path: str, media_type: str) -> List[Optional[str]]:
+    """
+    Private helper running the sender's image preprocessor on an image about
+    to be sent. Photos are replaced by their processed version, documents are
+    sent as they are with the thumbnail. Returns the path to upload and the
+    thumbnail, if any. Images that cannot be processed are sent as they are.
+    """
+    preprocessor = sender.image_preprocessor
+    if preprocessor is None or media_type not in ('photo', 'document') or _media_type_for(file_path) != 'photo':
+        return [file_path, None]
+    try:
+        image_path, thumbnail_path = await preprocessor.prepare(file_path)
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        logger.warning("Could not shrink %s, sending it as it is: %s", file_path, e)
+        return [file_path, None]
+    return [image_path, None] if media_type == 'photo' else [file_path, thumbnail_path]
+
+async def _send_media(sender: AsyncSender, bot_token: str, chat_token: str, file_path: str, caption: str, timeout: int, method_name: str, file_arg_name: str) -> bool:
+    """
+    Private helper performing the media send on the sender loop, returns True if it was sent.
+    """
+    import asyncio
     media_type = method_name.split('_')[-1] # e.g. 'photo' from 'send_photo' or 'document' from 'send_document'
-    # Actually, method_name passed will be 'send_photo', 'send_video' etc.
-    # Cleaner to just use method_name for logging? No, let's use file path.
-    print(f"Sending {media_type} to {chat_token}: {file_path} {caption}")
+    logger.info("Sending %s to %s: %s %s", media_type, chat_token, file_path, caption)
     try:
-        from telegram.ext import Application
-        application = Application.builder().token(bot_token).build()
+        from telegram.error import BadRequest
+        upload_path, thumbnail_path = await _preprocess(sender, file_path, media_type)
+        # Checked before any bytes are sent, telegram would only reject the file after the whole upload.
+        size = os.path.getsize(upload_path)
+        if size > sender.max_upload_size:
+            return await _send_oversized(sender, bot_token, chat_token, upload_path, caption, timeout, size)
+        method = getattr(sender.get_bot(bot_token), method_name)
+        # Construct arguments dynamically
+        kwargs = {
+            'chat_id': chat_token,
+            'caption': caption,
+            'read_timeout': timeout,
+            'write_timeout': timeout,
+        }
 
-        method = getattr(application.bot, method_name)
-        
-        with open(file_path, 'rb') as f:
-            # Construct arguments dynamically
-            kwargs = {
-                'chat_id': chat_token,
-                'caption': caption,
-                'read_timeout': timeout,
-                'write_timeout': timeout,
-                file_arg_name: f
-            }
-            await method(**kwargs)
-        print(f"{media_type.capitalize()} {file_path} sent successfully!")
+        cache = sender.file_id_cache
+        digest = None
+        if cache is not None:
+            digest = await asyncio.to_thread(file_digest, upload_path)
+            file_id = cache.get(bot_token, file_arg_name, digest)
+            if file_id:
+                try:
+                    await _call_with_retries(sender, bot_token, chat_token, lambda: method(**kwargs, **{file_arg_name: file_id}))
+                    logger.info("%s %s sent successfully by file_id!", media_type.capitalize(), file_path)
+                    return True
+                except BadRequest as e:
+                    if not _is_file_id_error(e):
+                        raise
+                    logger.warning("Cached file_id for %s rejected, uploading again: %s", file_path, e)
+                    cache.discard(bot_token, file_arg_name, digest)
+
+        async def upload():
+            async with sender.upload_slots:
+                with contextlib.ExitStack() as stack:
+                    files = {file_arg_name: stack.enter_context(open(upload_path, 'rb'))}
+                    if thumbnail_path:
+                        files['thumbnail'] = stack.enter_context(open(thumbnail_path, 'rb'))
+                    return await method(**kwargs, **files)
+
+        if size >= sender.stream_threshold:
+            message = await _stream_upload(sender, bot_token, chat_token, _api_method(method_name), file_arg_name, upload_path,
+                                           {'caption': caption}, timeout)
+        else:
+            message = await _call_with_retries(sender, bot_token, chat_token, upload)
+        if cache is not None:
+            file_id = _message_file_id(message, file_arg_name)
+            if file_id:
+                cache.put(bot_token, file_arg_name, digest, file_id)
+        logger.info("%s %s sent successfully!", media_type.capitalize(), file_path)
+        return True
     except FileNotFoundError:
-        print(f"Error: {media_type.capitalize()} file not found at \"{file_path}\"")
+        logger.error("Error: %s file not found at \"%s\"", media_type.capitalize(), file_path)
     except Exception as e:
-        print(f"Error sending {media_type}: {e}")
+        logger.error("Error sending %s: %s", media_type, e)
+    return False
 
-async def send_telegram_image(bot_token: str, chat_token: str, image_path: str, caption: str = "", timeout: int = None) -> None:
+async def send_telegram_image(bot_token: str, chat_token: str, image_path: str, caption: str = "", timeout: int = None, sender: AsyncSender = None) -> bool:
     """
         Sends a given image via telegram from bot specified by bot_token,
         to a chat specified by chat_token.
@@ -98,191 +1536,1243 @@ async def send_telegram_image(bot_token: str, chat_token: str, image_path: str,
             image_path: path to the image file to send
             caption: caption to associate with the image
             timeout: timeout in seconds how long to attempt to send
+            sender: sender to upload with, defaults to the shared sender
         Returns:
-            Nothing
+            True if the file was sent
+    """
+    return await _send_media_helper(bot_token, chat_token, image_path, caption, timeout, 'send_photo', 'photo', sender)
+
+async def send_telegram_video(bot_token: str, chat_token: str, video_path: str, caption: str = "", timeout: int = None, sender: AsyncSender = None) -> bool:
+    """
+        Sends a given video via telegram from bot specified by bot_token,
+        to a chat specified by chat_token.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            video_path: path to the video file to send
+            caption: caption to associate with the image
+            timeout: timeout in seconds how long to attempt to send
+            sender: sender to upload with, defaults to the shared sender
+        Returns:
+            True if the file was sent
+    """
+    return await _send_media_helper(bot_token, chat_token, video_path, caption, timeout, 'send_video', 'video', sender)
+
+async def send_telegram_audio(bot_token: str, chat_token: str, audio_path: str, caption: str = "", timeout: int = None, sender: AsyncSender = None) -> bool:
+    """
+        Sends a given audio via telegram from bot specified by bot_token,
+        to a chat specified by chat_token.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            audio_path: path to the audio file to send
+            caption: caption to associate with the image
+            timeout: timeout in seconds how long to attempt to send
+            sender: sender to upload with, defaults to the shared sender
+        Returns:
+            True if the file was sent
+    """
+    return await _send_media_helper(bot_token, chat_token, audio_path, caption, timeout, 'send_audio', 'audio', sender)
+
+async def send_telegram_animation(bot_token: str, chat_token: str, animation_path: str, caption: str = "", timeout: int = None, sender: AsyncSender = None) -> bool:
+    """
+        Sends a given animation via telegram from bot specified by bot_token,
+        to a chat specified by chat_token.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            animation_path: path to the animation file to send
+            caption: caption to associate with the file
+            timeout: timeout in seconds how long to attempt to send
+            sender: sender to upload with, defaults to the shared sender
+        Returns:
+            True if the file was sent
+    """
+    return await _send_media_helper(bot_token, chat_token, animation_path, caption, timeout, 'send_animation', 'animation', sender)
+
+async def send_telegram_document(bot_token: str, chat_token: str, document_path: str, caption: str = "", timeout: int = None, sender: AsyncSender = None) -> bool:
+    """
+        Sends a given document via telegram from bot specified by bot_token,
+        to a chat specified by chat_token.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            document_path: path to the document file to send
+            caption: caption to associate with the file
+            timeout: timeout in seconds how long to attempt to send
+            sender: sender to upload with, defaults to the shared sender
+        Returns:
+            True if the file was sent
+    """
+    return await _send_media_helper(bot_token, chat_token, document_path, caption, timeout, 'send_document', 'document', sender)
+
+def _media_type_for(filename: str) -> str:
+    """
+    Private helper picking the media type, i.e. the Bot API file argument, matching a file extension.
+    """
+    lower = filename.lower()
+    if lower.endswith(".mp3"):
+        return 'audio'
+    elif lower.endswith(".mp4") or lower.endswith(".webp"):
+        return 'video'
+    elif lower.endswith(".jpg") or lower.endswith(".jpeg") or lower.endswith(".png"):
+        return 'photo'
+    elif lower.endswith(".gif"):
+        return 'animation'
+    return 'document'
+
+_MEDIA_TYPES = ("photo", "video", "audio", "animation", "document")
+
+def _media_sender_for_type(media_type: str) -> Callable:
+    """
+    Private helper picking the async send function for a media type.
+    """
+    if media_type == 'audio':
+        return send_telegram_audio
+    elif media_type == 'video':
+        return send_telegram_video
+    elif media_type == 'photo':
+        return send_telegram_image
+    elif media_type == 'animation':
+        return send_telegram_animation
+    return send_telegram_document
+
+def _media_sender_for(filename: str) -> Callable:
+    """
+    Private helper picking the async send function matching a file extension.
+    """
+    return _media_sender_for_type(_media_type_for(filename))
+
+async def _gather_sends(sends: List[Any]) -> List[bool]:
+    """
+    Private helper awaiting several sends at once, the sender's upload slots
+    bound how many of them actually upload concurrently.
+    """
+    import asyncio
+    return list(await asyncio.gather(*sends))
+
+# Which media types may share an album, photos and videos mix while audio and
+# documents only group with their own kind. Animations cannot be grouped at all.
+_ALBUM_GROUPS = {'photo': 'visual', 'video': 'visual', 'audio': 'audio', 'document': 'document'}
+MAX_ALBUM_SIZE = 10
+
+def _file_size(path: str) -> int:
+    """
+    Private helper returning the size of a file, 0 if it cannot be read so the error is reported when it is sent.
     """
-    await _send_media_helper(bot_token, chat_token, image_path, caption, timeout, 'send_photo', 'photo')
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def group_album_items(media_types: List[str], max_size: int = MAX_ALBUM_SIZE) -> List[List[int]]:
+    """
+        Splits a sequence of media into runs that can be sent as one album,
+        keeping their order. Consecutive media of compatible types are grouped
+        up to max_size items, anything else ends up in a group of its own.
+        Args:
+            media_types: media type of every item, e.g. 'photo' or 'document'
+            max_size: maximum number of items in an album
+        Returns:
+            the groups as lists of indexes into media_types
+    """
+    groups = []
+    current_group = None
+    for index, media_type in enumerate(media_types):
+        group = _ALBUM_GROUPS.get(media_type)
+        if group is None or group != current_group or len(groups[-1]) >= max_size:
+            groups.append([])
+        groups[-1].append(index)
+        current_group = group
+    return groups
+
+async def _send_album(sender: AsyncSender, bot_token: str, chat_token: str, items: List[Any], timeout: int) -> List[bool]:
+    """
+    Private helper sending (path, media_type, caption) items as one media group on the sender loop.
+    Returns for each item True if it was sent.
+    """
+    import asyncio
+    paths = [path for path, _, _ in items]
+    logger.info("Sending album to %s: %s", chat_token, ' '.join(paths))
+    try:
+        from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+        from telegram.error import BadRequest
+        input_media = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'audio': InputMediaAudio, 'document': InputMediaDocument}
+        bot = sender.get_bot(bot_token)
+        prepared = await asyncio.gather(*(_preprocess(sender, path, media_type) for path, media_type, _ in items))
+        items = [(upload_path, media_type, caption) for (upload_path, _), (_, media_type, caption) in zip(prepared, items)]
+        cache = sender.file_id_cache
+        digests = [None] * len(items)
+        file_ids = [None] * len(items)
+        if cache is not None:
+            for i, (path, media_type, _) in enumerate(items):
+                digests[i] = await asyncio.to_thread(file_digest, path)
+                file_ids[i] = cache.get(bot_token, media_type, digests[i])
+
+        async def upload():
+            async with sender.upload_slots:
+                with contextlib.ExitStack() as stack:
+                    media = []
+                    for (path, media_type, caption), file_id in zip(items, file_ids):
+                        source = file_id or stack.enter_context(open(path, 'rb'))
+                        media.append(input_media[media_type](media=source, caption=caption))
+                    return await bot.send_media_group(chat_id=chat_token, media=media, read_timeout=timeout, write_timeout=timeout)
+
+        try:
+            messages = await _call_with_retries(sender, bot_token, chat_token, upload)
+        except BadRequest as e:
+            if not any(file_ids) or not _is_file_id_error(e):
+                raise
+            logger.warning("Cached file_ids for album rejected, uploading again: %s", e)
+            for (_, media_type, _), digest, file_id in zip(items, digests, file_ids):
+                if file_id:
+                    cache.discard(bot_token, media_type, digest)
+            file_ids = [None] * len(items)
+            messages = await _call_with_retries(sender, bot_token, chat_token, upload)
+        if cache is not None:
+            for message, (_, media_type, _), digest in zip(messages, items, digests):
+                file_id = _message_file_id(message, media_type)
+                if file_id:
+                    cache.put(bot_token, media_type, digest, file_id)
+        logger.info("Album of %d sent successfully!", len(items))
+        return [True] * len(items)
+    except FileNotFoundError as e:
+        logger.error("Error: album file not found at \"%s\"", e.filename)
+    except Exception as e:
+        logger.error("Error sending album: %s", e)
+    return [False] * len(items)
+
+async def send_telegram_album(bot_token: str, chat_token: str, paths: List[str], captions: List[str] = None, timeout: int = None,
+                              sender: AsyncSender = None, media_types: List[str] = None) -> List[bool]:
+    """
+        Sends several files via telegram from bot specified by bot_token,
+        to a chat specified by chat_token, grouping compatible files into
+        albums of up to 10 items so each album is a single request and a
+        single notification. Files that cannot be grouped are sent on their own.
+        Albums are sent one after the other, so the order of paths is kept.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            paths: paths to the files to send
+            captions: caption of every file, defaults to each file name
+            timeout: timeout in seconds how long to attempt to send each album
+            sender: sender to upload with, defaults to the shared sender
+            media_types: media type of every file, defaults to guessing from each extension
+        Returns:
+            for each file, True if it was sent
+    """
+    sender = sender or get_default_sender()
+    captions = captions or [os.path.basename(path) for path in paths]
+    media_types = media_types or [_media_type_for(path) for path in paths]
+    # Media groups are uploaded in one buffered request, files big enough to be streamed or split go on their own.
+    limit = min(sender.stream_threshold - 1, sender.max_upload_size)
+    groupable = [None if _file_size(path) > limit else media_type for path, media_type in zip(paths, media_types)]
+    results = []
+    for group in group_album_items(groupable):
+        if len(group) == 1:
+            index = group[0]
+            send = _media_sender_for_type(media_types[index])
+            results.append(await send(bot_token, chat_token, paths[index], captions[index], timeout, sender))
+        else:
+            items = [(paths[i], media_types[i], captions[i]) for i in group]
+            results.extend(await sender.submit(_send_album(sender, bot_token, chat_token, items, timeout)))
+    return results
+
+def send_telegram_file(bot_token: str, chat_token: str, filename: str, caption: str = "", timeout: int = None, sender: AsyncSender = None) -> bool:
+    """
+        Sends a given file via telegram from bot specified by bot_token,
+        to a chat specified by chat_token.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            filename: path to the file to send
+            caption: caption to associate with the image
+            timeout: timeout in seconds how long to attempt to send
+            sender: sender to upload with, defaults to the shared sender
+        Returns:
+            True if the file was sent
+    """
+    sender = sender or get_default_sender()
+    file_name = os.path.basename(filename)
+    if caption == "":
+        caption = file_name
+    send = _media_sender_for(filename)
+    return sender.run(send(bot_token, chat_token, filename, caption, timeout, sender))
+
+def send_telegram_files(bot_token: str, chat_token: str, filenames: List[str], caption: str = "", timeout: int = None, sender: AsyncSender = None,
+                        albums: bool = False) -> List[bool]:
+    """
+        Sends several files via telegram from bot specified by bot_token,
+        to a chat specified by chat_token. Files are uploaded concurrently up
+        to the sender's max_concurrent_uploads, so they may arrive out of order,
+        unless albums is set, see send_telegram_album.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_token: unique identifier for a chat
+            filenames: paths to the files to send
+            caption: caption to associate with every file, defaults to each file name
+            timeout: timeout in seconds how long to attempt to send each file
+            sender: sender to upload with, defaults to the shared sender
+            albums: group compatible files into albums sent in order
+        Returns:
+            for each file, True if it was sent
+    """
+    sender = sender or get_default_sender()
+    if albums:
+        captions = [caption or os.path.basename(filename) for filename in filenames]
+        return sender.run(send_telegram_album(bot_token, chat_token, filenames, captions, timeout, sender))
+    sends = []
+    for filename in filenames:
+        send = _media_sender_for(filename)
+        sends.append(send(bot_token, chat_token, filename, caption or os.path.basename(filename), timeout, sender))
+    return sender.run(_gather_sends(sends))
+
+async def _broadcast(sender: AsyncSender, bot_token: str, chat_tokens: List[str], message: str, filenames: List[str], caption: str,
+                     timeout: int, max_concurrent: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Private helper performing a broadcast on the sender loop, see broadcast_telegram.
+    """
+    import asyncio
+    from telegram.error import BadRequest
+    bot = sender.get_bot(bot_token)
+    cache = sender.file_id_cache
+    chunks = list(iter_chunks(message)) if message else []
+    media = [(path, _media_type_for(path), caption or os.path.basename(path)) for path in filenames or []]
+
+    async def prepare(path: str, media_type: str) -> str:
+        try:
+            return (await _preprocess(sender, path, media_type))[0]
+        except FileNotFoundError:
+            # Reported for every chat once it is sent.
+            return path
+
+    prepared = await asyncio.gather(*(prepare(path, media_type) for path, media_type, _ in media))
+    media = [(upload_path, media_type, file_caption) for upload_path, (_, media_type, file_caption) in zip(prepared, media)]
+    digests = [None] * len(media)
+    file_ids = [None] * len(media)
+    if cache is not None:
+        for i, (path, media_type, _) in enumerate(media):
+            try:
+                digests[i] = await asyncio.to_thread(file_digest, path)
+            except OSError as e:
+                # Like an oversized file, an unreadable one fails every chat before anything is sent.
+                error = str(e) or type(e).__name__
+                return {chat: {"ok": False, "error": error} for chat in chat_tokens}
+            file_ids[i] = cache.get(bot_token, media_type, digests[i])
+    cached = [file_id is not None for file_id in file_ids]
+    sizes = [_file_size(path) for path, _, _ in media]
+    oversized = [path for (path, _, _), size in zip(media, sizes) if size > sender.max_upload_size]
+    if oversized:
+        # Checked up front so no chat gets half of the broadcast.
+        error = f"{oversized[0]} is over the {sender.max_upload_size} byte upload limit"
+        return {chat: {"ok": False, "error": error} for chat in chat_tokens}
+    # Only one chat uploads each file, everyone else waits for its file_id.
+    upload_locks = [asyncio.Lock() for _ in media]
+    slots = asyncio.Semaphore(max_concurrent)
+    report = {}
+
+    async def send_file(chat: str, i: int) -> None:
+        path, media_type, file_caption = media[i]
+        method = getattr(bot, f"send_{media_type}")
+        kwargs = {'chat_id': chat, 'caption': file_caption, 'read_timeout': timeout, 'write_timeout': timeout}
+        if file_ids[i] is None:
+            async with upload_locks[i]:
+                if file_ids[i] is None:
+                    async def upload():
+                        async with sender.upload_slots:
+                            with open(path, 'rb') as f:
+                                return await method(**kwargs, **{media_type: f})
+
+                    if sizes[i] >= sender.stream_threshold:
+                        sent = await _stream_upload(sender, bot_token, chat, _api_method(f"send_{media_type}"), media_type, path,
+                                                    {'caption': file_caption}, timeout)
+                    else:
+                        sent = await _call_with_retries(sender, bot_token, chat, upload)
+                    file_ids[i] = _message_file_id(sent, media_type)
+                    if cache is not None and file_ids[i]:
+                        cache.put(bot_token, media_type, digests[i], file_ids[i])
+                    return
+        file_id = file_ids[i]
+        from_cache = cached[i]
+        try:
+            await _call_with_retries(sender, bot_token, chat, lambda: method(**kwargs, **{media_type: file_id}))
+        except BadRequest as e:
+            if not from_cache or not _is_file_id_error(e):
+                raise
+            if file_ids[i] == file_id:
+                # A stale cached file_id, drop it so the file is uploaded again.
+                cache.discard(bot_token, media_type, digests[i])
+                cached[i] = False
+                file_ids[i] = None
+            await send_file(chat, i)
+
+    async def send_to(chat: str) -> None:
+        async with slots:
+            try:
+                for chunk in chunks:
+                    await _call_with_retries(sender, bot_token, chat, lambda: bot.send_message(chat_id=chat, text=chunk))
+                for i in range(len(media)):
+                    await send_file(chat, i)
+                report[chat] = {"ok": True, "error": None}
+            except Exception as e:
+                report[chat] = {"ok": False, "error": str(e) or type(e).__name__}
+
+    await asyncio.gather(*(send_to(chat) for chat in chat_tokens))
+    return {chat: report[chat] for chat in chat_tokens}
+
+def broadcast_telegram(bot_token: str, chat_tokens: List[str], message: str = "", filenames: List[str] = None, caption: str = "",
+                       timeout: int = None, sender: AsyncSender = None, max_concurrent: int = 30) -> Dict[str, Dict[str, Any]]:
+    """
+        Sends the same message and files via telegram from bot specified by
+        bot_token to many chats. Each file is uploaded once and every other
+        chat receives it by the returned file_id. Chats are served
+        concurrently, the sender's rate limiter keeps the sends within
+        telegram's flood limits. Files over the sender's max_upload_size fail
+        every chat before anything is sent. Nothing is printed, the outcome
+        for every chat is returned instead.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            chat_tokens: unique identifiers of the chats to send to, duplicates are sent to once
+            message: text message to send before the files, may be empty
+            filenames: paths to the files to send
+            caption: caption to associate with every file, defaults to each file name
+            timeout: timeout in seconds how long to attempt to send each file
+            sender: sender to upload with, defaults to the shared sender
+            max_concurrent: how many chats are sent to at the same time
+        Returns:
+            for each chat, a dictionary with "ok" and the "error" that stopped sending to it, if any
+    """
+    sender = sender or get_default_sender()
+    chat_tokens = list(dict.fromkeys(str(chat) for chat in chat_tokens))
+    return sender.run(_broadcast(sender, bot_token, chat_tokens, message, filenames, caption, timeout, max_concurrent))
+
+class MessageQueue:
+    """
+    A durable outbound spool kept in SQLite in WAL mode. Enqueueing returns as
+    soon as the message is on disk and QueueWorker threads drain it in priority
+    order. Rows are leased while being sent and only deleted once delivered, so
+    rows held by a crashed worker are sent again once their lease expires
+    (at-least-once delivery). Several processes may share the same file.
+    """
+    def __init__(self, path: str, lease: float = 300, max_attempts: int = 10):
+        """
+        Initialize the queue, creating the database if needed.
+
+        Args:
+            path: location of the SQLite database file.
+            lease: seconds a claimed message is reserved for the worker sending it.
+            max_attempts: attempts after which a message is set aside as dead.
+        """
+        import sqlite3
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, bot_token TEXT NOT NULL, chat_token TEXT NOT NULL,"
+            " kind TEXT NOT NULL, payload TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, available_at REAL NOT NULL, leased_until REAL NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0, dead INTEGER NOT NULL DEFAULT 0)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_order ON outbox (dead, priority DESC, id)")
+
+    def _enqueue(self, bot_token: str, chat_token: str, kind: str, payload: Dict[str, Any], priority: int) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (bot_token, chat_token, kind, payload, priority, created, available_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (bot_token, str(chat_token), kind, json.dumps(payload), priority, now, now))
+        return cursor.lastrowid
+
+    def enqueue_message(self, bot_token: str, chat_token: str, message: str, priority: int = 0) -> int:
+        """
+        Spools a text message, higher priorities are sent first. Returns its queue id.
+        """
+        return self._enqueue(bot_token, chat_token, "message", {"message": message}, priority)
+
+    def enqueue_file(self, bot_token: str, chat_token: str, filename: str, caption: str = "", timeout: int = None,
+                     media: str = None, priority: int = 0) -> int:
+        """
+        Spools a file by path, higher priorities are sent first. Returns its queue id.
+        media forces one of "photo", "video", "audio", "animation" or "document",
+        the media types used throughout the module, by default the type is
+        detected from the extension as in send_telegram_file.
+        """
+        if media is not None and media not in _MEDIA_TYPES:
+            raise ValueError(f"unknown media type {media!r}, expected one of {', '.join(_MEDIA_TYPES)}")
+        payload = {"filename": os.path.abspath(filename), "caption": caption, "timeout": timeout, "media": media}
+        return self._enqueue(bot_token, chat_token, "file", payload, priority)
+
+    def claim(self, batch_size: int = 10) -> List[Dict[str, Any]]:
+        """
+        Leases up to batch_size messages that are due, highest priority first.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, bot_token, chat_token, kind, payload, attempts FROM outbox"
+                    " WHERE dead = 0 AND available_at <= ? AND leased_until <= ?"
+                    " ORDER BY priority DESC, id LIMIT ?", (now, now, batch_size)).fetchall()
+                self._db.executemany(
+                    "UPDATE outbox SET leased_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [{"id": row[0], "bot_token": row[1], "chat_token": row[2], "kind": row[3],
+                 "attempts": row[5] + 1, **json.loads(row[4])} for row in rows]
+
+    def ack(self, ids: List[int]) -> None:
+        """Removes delivered messages from the queue."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            self._db.execute("COMMIT")
+
+    def nack(self, item: Dict[str, Any], delay: float) -> None:
+        """Releases a message that failed to send, to be retried after delay seconds."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET leased_until = 0, available_at = ?, dead = ? WHERE id = ?",
+                (time.time() + delay, int(item["attempts"] >= self.max_attempts), item["id"]))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the number of pending, in flight and dead messages and the age
+        in seconds of the oldest pending message, for alerting on backlog.
+        """
+        now = time.time()
+        with self._lock:
+            pending, oldest, in_flight = self._db.execute(
+                "SELECT COUNT(*), MIN(created), SUM(leased_until > ?) FROM outbox WHERE dead = 0", (now,)).fetchone()
+            dead = self._db.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1").fetchone()[0]
+        return {"depth": pending, "in_flight": in_flight or 0, "dead": dead,
+                "oldest_age": now - oldest if oldest is not None else 0.0}
 
-async def send_telegram_video(bot_token: str, chat_token: str, video_path: str, caption: str = "", timeout: int = None) -> None:
+    def close(self) -> None:
+        """Closes the database."""
+        with self._lock:
+            self._db.close()
+
+class QueueWorker:
     """
-        Sends a given video via telegram from bot specified by bot_token,
-        to a chat specified by chat_token.
-        Args:
-            bot_token: unique identifier for the telegram bot
-            chat_token: unique identifier for a chat
-            video_path: path to the video file to send
-            caption: caption to associate with the image
-            timeout: timeout in seconds how long to attempt to send
-        Returns:
-            Nothing
+    Background threads draining a MessageQueue. Each thread claims a batch of
+    messages, sends them and acknowledges the delivered ones, failed ones are
+    retried with exponential backoff.
     """
-    await _send_media_helper(bot_token, chat_token, video_path, caption, timeout, 'send_video', 'video')
+    def __init__(self, queue: MessageQueue, workers: int = 2, batch_size: int = 10, poll_interval: float = 1.0,
+                 client: TelegramClient = None, sender: AsyncSender = None):
+        """
+        Initialize the workers, call start() to run them.
 
-async def send_telegram_audio(bot_token: str, chat_token: str, audio_path: str, caption: str = "", timeout: int = None) -> None:
-    """
-        Sends a given audio via telegram from bot specified by bot_token,
-        to a chat specified by chat_token.
         Args:
-            bot_token: unique identifier for the telegram bot
-            chat_token: unique identifier for a chat
-            audio_path: path to the audio file to send
-            caption: caption to associate with the image
-            timeout: timeout in seconds how long to attempt to send
-        Returns:
-            Nothing
-    """
-    await _send_media_helper(bot_token, chat_token, audio_path, caption, timeout, 'send_audio', 'audio')
+            queue: the queue to drain.
+            workers: number of sending threads.
+            batch_size: messages claimed per database round-trip.
+            poll_interval: seconds an idle thread waits before looking for new messages.
+            client: http client for text messages, defaults to the shared pooled client.
+            sender: sender for files, defaults to the shared sender.
+        """
+        self.queue = queue
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.client = client
+        self.sender = sender
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _send(self, item: Dict[str, Any]) -> bool:
+        if item["kind"] == "message":
+            return send_telegram(item["bot_token"], item["chat_token"], item["message"], self.client)
+        sender = self.sender or get_default_sender()
+        # Spools written before the media types were unified may still say "image".
+        media = "photo" if item["media"] == "image" else item["media"]
+        send = _media_sender_for_type(media) if media else _media_sender_for(item["filename"])
+        caption = item["caption"] or os.path.basename(item["filename"])
+        return sender.run(send(item["bot_token"], item["chat_token"], item["filename"], caption, item["timeout"], sender))
+
+    def run_once(self) -> int:
+        """
+        Claims and sends one batch, returns how many messages were claimed.
+        """
+        batch = self.queue.claim(self.batch_size)
+        delivered = []
+        for item in batch:
+            try:
+                sent = self._send(item)
+            except Exception as e:
+                logger.error("Error sending queued message %s: %s", item['id'], e)
+                sent = False
+            if sent:
+                delivered.append(item["id"])
+            else:
+                self.queue.nack(item, _backoff(item["attempts"] - 1, base=2, cap=600))
+        self.queue.ack(delivered)
+        return len(batch)
+
+    def drain(self) -> None:
+        """Sends on the calling thread until no message is due."""
+        while self.run_once() > 0:
+            pass
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.run_once() == 0:
+                self._stop.wait(self.poll_interval)
+
+    def start(self) -> "QueueWorker":
+        """Starts the worker threads."""
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"tele-queue-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = None) -> None:
+        """Stops the worker threads once their current batch is done."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
 
-async def send_telegram_animation(bot_token: str, chat_token: str, animation_path: str, caption: str = "", timeout: int = None) -> None:
+class TelegramLogHandler(logging.Handler):
     """
-        Sends a given animation via telegram from bot specified by bot_token,
-        to a chat specified by chat_token.
+    A logging handler sending records to a telegram chat in batches. Records
+    are only buffered on the logging thread, a background thread sends them
+    joined into as few messages as fit, after flush_interval seconds, once
+    about max_chars are pending, or right away for records at flush_level.
+    Repeats of a record within a batch are sent once with an "xN" count.
+    When the buffer is full new records are dropped and counted, batches
+    that cannot be delivered are spilled to an optional MessageQueue.
+    """
+    def __init__(self, bot_token: str, chat_token: str, level: int = logging.NOTSET, flush_interval: float = 5.0,
+                 max_chars: int = 4000, flush_level: int = logging.ERROR, capacity: int = 1000, client: TelegramClient = None,
+                 spill: MessageQueue = None):
+        """
+        Initialize the handler and start its sending thread.
+
         Args:
-            bot_token: unique identifier for the telegram bot
-            chat_token: unique identifier for a chat
-            animation_path: path to the animation file to send
-            caption: caption to associate with the file
-            timeout: timeout in seconds how long to attempt to send
-        Returns:
-            Nothing
+            bot_token: unique identifier for the telegram bot.
+            chat_token: chat the records are sent to.
+            level: minimum level of handled records.
+            flush_interval: seconds a record waits at most before it is sent.
+            max_chars: size of a message in UTF-16 code units, a batch is sent once this much is pending.
+            flush_level: records of this level or above are sent right away.
+            capacity: maximum number of distinct buffered records, more are dropped.
+            client: http client to send with, defaults to the shared pooled client.
+            spill: optional queue undeliverable batches are spooled to for a QueueWorker to retry.
+        """
+        super().__init__(level)
+        self.bot_token = bot_token
+        self.chat_token = chat_token
+        self.flush_interval = flush_interval
+        self.max_chars = max_chars
+        self.flush_level = flush_level
+        self.capacity = capacity
+        self.client = client
+        self.spill = spill
+        # Distinct records in arrival order, mapped to their text and repeat count.
+        self._buffer: Dict[Any, List[Any]] = {}
+        self._pending_chars = 0
+        self._counters = {"sent": 0, "deduplicated": 0, "dropped": 0, "spilled": 0, "failed": 0, "errors": 0}
+        self._unreported_drops = 0
+        self._buffer_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sending = threading.local()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tele-log-handler", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Buffers a record, never waits on the network."""
+        if getattr(self._sending, "active", False):
+            # Logged while sending, e.g. by urllib3, sending it would feed back into itself.
+            return
+        try:
+            text = self.format(record)
+            key = (record.levelno, record.name, record.getMessage(), record.exc_text)
+            with self._buffer_lock:
+                entry = self._buffer.get(key)
+                if entry is not None:
+                    entry[1] += 1
+                    self._counters["deduplicated"] += 1
+                elif len(self._buffer) >= self.capacity:
+                    self._counters["dropped"] += 1
+                    self._unreported_drops += 1
+                    return
+                else:
+                    self._buffer[key] = [text, 1]
+                    self._pending_chars += utf16_len(text) + 1
+                full = self._pending_chars >= self.max_chars
+            if full or record.levelno >= self.flush_level:
+                self._wake.set()
+        except Exception:
+            self.handleError(record)
+
+    def _take_batch(self) -> List[str]:
+        """Empties the buffer into the messages to send, as large as max_chars allows."""
+        with self._buffer_lock:
+            entries = list(self._buffer.values())
+            drops, self._unreported_drops = self._unreported_drops, 0
+            self._buffer = {}
+            self._pending_chars = 0
+        lines = [text if count == 1 else f"{text} x{count}" for text, count in entries]
+        if drops:
+            lines.append(f"... {drops} log records dropped")
+        messages = []
+        current = []
+        size = 0
+        for line in lines:
+            length = utf16_len(line)
+            if current and size + 1 + length > self.max_chars:
+                messages.append("\n".join(current))
+                current, size = [], 0
+            if length > self.max_chars:
+                messages.extend(iter_chunks(line, chunk_size=self.max_chars))
+                continue
+            current.append(line)
+            size += length + (1 if size else 0)
+        if current:
+            messages.append("\n".join(current))
+        return messages
+
+    def _send_batch(self) -> None:
+        # One batch at a time, so flush() and the background thread keep records in order.
+        with self._send_lock:
+            self._sending.active = True
+            try:
+                for message in self._take_batch():
+                    try:
+                        response = (self.client or get_default_client()).send(
+                            self.bot_token, "sendMessage", self.chat_token, data={"chat_id": self.chat_token, "text": message})
+                        sent = response is not None and response.status_code == 200
+                    except Exception:
+                        sent = False
+                    outcome = "sent" if sent else "failed"
+                    if not sent and self.spill is not None:
+                        try:
+                            self.spill.enqueue_message(self.bot_token, self.chat_token, message)
+                            outcome = "spilled"
+                        except Exception:
+                            self._count("errors")
+                    self._count(outcome)
+            finally:
+                self._sending.active = False
+
+    def _count(self, counter: str) -> None:
+        with self._buffer_lock:
+            self._counters[counter] += 1
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._send_batch()
+            except Exception:
+                # Logging it could feed back into this handler, it is counted instead.
+                self._count("errors")
+
+    def flush(self) -> None:
+        """Sends everything buffered on the calling thread."""
+        self._send_batch()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns counters of messages sent, spilled and failed, of records
+        deduplicated and dropped, of unexpected errors while sending, and the
+        number of records pending.
+        """
+        with self._buffer_lock:
+            return {**self._counters, "pending": len(self._buffer)}
+
+    def close(self) -> None:
+        """Stops the sending thread and sends what is left."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        super().close()
+
+def _resolve_telegram_file(bot_token: str, chat_token: str, file_id: str, client: TelegramClient) -> Optional[Dict[str, Any]]:
+    """
+    Private helper resolving a file_id through getFile, returns None on failure.
     """
-    await _send_media_helper(bot_token, chat_token, animation_path, caption, timeout, 'send_animation', 'animation')
+    telegram_link = client.method_url(bot_token, f"getFile?file_id={file_id}")
+    telegram_response = client.get(telegram_link)
+    if telegram_response.status_code == 200:
+        response = telegram_response.json()
+    else:
+        # Proxies in front of the API answer errors with html rather than json.
+        response = {"ok": False, "description": f"HTTP {telegram_response.status_code}: {telegram_response.text[:200]}"}
+
+    if not response["ok"]:
+        logger.error("error with response %s", response)
+        if chat_token and len(chat_token) > 0:
+            send_telegram(bot_token, chat_token, "Error getting image", client)
+        else:
+            logger.error("Error getting image")
+        return None
+    logger.debug("telegram response %s", response)
+    return response['result']
 
-async def send_telegram_document(bot_token: str, chat_token: str, document_path: str, caption: str = "", timeout: int = None) -> None:
+def _fetch_telegram_file(bot_token: str, chat_token: str, result: Dict[str, Any], FILES_DIR: str, client: TelegramClient,
+                         progress: Callable[[int, Optional[int]], None] = None, sha256: str = None) -> str:
     """
-        Sends a given document via telegram from bot specified by bot_token,
-        to a chat specified by chat_token.
-        Args:
-            bot_token: unique identifier for the telegram bot
-            chat_token: unique identifier for a chat
-            document_path: path to the document file to send
-            caption: caption to associate with the file
-            timeout: timeout in seconds how long to attempt to send
-        Returns:
-            Nothing
+    Private helper downloading a resolved file, stored under its file_unique_id
+    so a file that is already present is never fetched again.
     """
-    await _send_media_helper(bot_token, chat_token, document_path, caption, timeout, 'send_document', 'document')
+    _, file_extension = os.path.splitext(result['file_path'])
+    unique_id = result['file_unique_id']
+    filename = f"{unique_id}{file_extension}"
+    out_path = os.path.join(FILES_DIR, filename)
+    if os.path.exists(out_path):
+        logger.info("Already have %s. Stored as %s", unique_id, out_path)
+        return filename
+
+    part_path = os.path.join(FILES_DIR, f".{filename}.part")
+    telegram_link = client.file_url(bot_token, result['file_path'])
+    if not client.download(telegram_link, out_path, part_path, progress=progress, sha256=sha256, size=result.get('file_size')):
+        logger.error("Telegram is unhappy %s", result['file_path'])
+        if chat_token and len(chat_token) > 0:
+            send_telegram(bot_token, chat_token, "Error fetching image", client)
+        return ""
+
+    logger.info("Fetched %s from telegram. Stored as %s", unique_id, out_path)
+    return filename
 
-def send_telegram_file(bot_token: str, chat_token: str, filename: str, caption: str = "", timeout: int = None) -> None:
+def get_telegram_file(bot_token: str, chat_token: str, file_id: str, FILES_DIR: str, client: TelegramClient = None,
+                      progress: Callable[[int, Optional[int]], None] = None, sha256: str = None) -> str:
     """
-        Sends a given file via telegram from bot specified by bot_token,
-        to a chat specified by chat_token.
+        Retrieves a given file from telegram and stores it in FIlES_DIR,
+        named after its file_unique_id. A file that is already present is
+        not downloaded again and an interrupted download of the same file
+        is resumed on the next call.
         Args:
             bot_token: unique identifier for the telegram bot
             chat_token: unique identifier for a chat
-            filename: path to the file to send
-            caption: caption to associate with the image
-            timeout: timeout in seconds how long to attempt to send
+            file_id: telegram file identifier
+            FILES_DIR: location where to store the file
+            client: http client to fetch with, defaults to the shared pooled client
+            progress: optional callback receiving (bytes_done, bytes_total or None)
+            sha256: optional expected hex digest of the file
         Returns:
-            Nothing
+            filename of the file that was stored in the FILES_DIR
     """
-    file_name = os.path.basename(filename)
-    if caption == "":
-        caption = file_name
-    if filename.lower().endswith(".mp3"):
-        asyncio.run(send_telegram_audio(bot_token, chat_token, filename, caption, timeout))
-    elif filename.lower().endswith(".mp4") or filename.lower().endswith(".webp"):
-        asyncio.run(send_telegram_video(bot_token, chat_token, filename, caption, timeout))
-    elif filename.lower().endswith(".jpg") or filename.lower().endswith(".jpeg") or filename.lower().endswith(".png"):
-        asyncio.run(send_telegram_image(bot_token, chat_token, filename, caption, timeout))
-    elif filename.lower().endswith(".gif"):
-        asyncio.run(send_telegram_animation(bot_token, chat_token, filename, caption, timeout))
-    else:
-        asyncio.run(send_telegram_document(bot_token, chat_token, filename, caption, timeout))
+    client = client or get_default_client()
+    result = _resolve_telegram_file(bot_token, chat_token, file_id, client)
+    if result is None:
+        return ""
+    return _fetch_telegram_file(bot_token, chat_token, result, FILES_DIR, client, progress, sha256)
 
-def get_telegram_file(bot_token: str, chat_token: str, file_id: str, FILES_DIR: str) -> str:
+def get_telegram_files(bot_token: str, file_ids: List[str], FILES_DIR: str, client: TelegramClient = None, max_workers: int = 4) -> Dict[str, str]:
     """
-        Retrieves a given file from telegram and stores it in FIlES_DIR.
+        Retrieves many files from telegram concurrently and stores them in
+        FILES_DIR named after their file_unique_id. Ids that refer to the
+        same file, or files that are already present, are fetched only once.
         Args:
             bot_token: unique identifier for the telegram bot
-            chat_token: unique identifier for a chat
-            file_id: telegram file identifier
-            FILES_DIR: location where to store the file
+            file_ids: telegram file identifiers
+            FILES_DIR: location where to store the files
+            client: http client to fetch with, defaults to the shared pooled client
+            max_workers: how many requests to run at the same time
         Returns:
-            filename of the file that was stored in the FILES_DIR
+            mapping from each file_id to the path of the stored file, or "" if it failed
     """
-    telegram_link = f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}"
-    telegram_response = requests.get(telegram_link)
-    response = telegram_response.json()
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+    client = client or get_default_client()
+    file_ids = list(dict.fromkeys(file_ids))
 
-    if not response["ok"]:
-        print("error with response", response)
-        if chat_token and len(chat_token) > 0:
-            send_telegram(bot_token, chat_token, "Error getting image")
-        else:
-            print("Error getting image")
-        return ""
+    def resolve(file_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return _resolve_telegram_file(bot_token, "", file_id, client)
+        except (requests.RequestException, ValueError) as e:
+            logger.error("Error getting %s: %s", file_id, e)
+            return None
 
-    telegram_link = f"https://api.telegram.org/file/bot{bot_token}/{response['result']['file_path']}"
-    telegram_response = requests.get(telegram_link)
-    print("telegram response", response)
+    def fetch(unique_id: str) -> str:
+        try:
+            return _fetch_telegram_file(bot_token, "", by_unique_id[unique_id], FILES_DIR, client)
+        except (requests.RequestException, ValueError) as e:
+            logger.error("Error fetching %s: %s", unique_id, e)
+            return ""
 
-    if telegram_response.status_code != 200:
-        print("Telegram is unhappy", telegram_response)
-        if chat_token and len(chat_token) > 0:
-            send_telegram(bot_token, chat_token, "Error fetching image")
-        return ""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        resolved = dict(zip(file_ids, executor.map(resolve, file_ids)))
 
-    filename, file_extension = os.path.splitext(response['result']['file_path'])
-    unique_id = response['result']['file_unique_id']
-    filename = f"{int(time.time()*1000)}{file_extension}"
-    out_path = os.path.join(FILES_DIR, filename)
-    with open(out_path, "wb") as f:
-        f.write(telegram_response.content)
-    print(f"Fetched {unique_id} from telegram. Stored as {out_path}")
-    return filename
+        by_unique_id = {}
+        for result in resolved.values():
+            if result is not None:
+                by_unique_id.setdefault(result['file_unique_id'], result)
+        unique_ids = list(by_unique_id.keys())
+        fetched = dict(zip(unique_ids, executor.map(fetch, unique_ids)))
+
+    paths = {}
+    for file_id, result in resolved.items():
+        filename = fetched.get(result['file_unique_id'], "") if result is not None else ""
+        paths[file_id] = os.path.join(FILES_DIR, filename) if filename else ""
+    return paths
 
 
-def telegram_set_commands(bot_token: str, commands: Dict[str, Any]) -> None:
+def telegram_set_commands(bot_token: str, commands: Dict[str, Any], api_url: str = None) -> None:
     """
         Sets the commands available on a given bot to telegram.
         Args:
             bot_token: bot for which we set commands
             commands: mapping from the command to a description.
+            api_url: base url of the Bot API, defaults to TELEGRAM_API_URL
         Returns:
             Nothing
     """
+    import asyncio
     import telegram
     commands_dict = []
     for command_name in commands.keys():
         commands_dict.append(telegram.BotCommand(command_name, commands[command_name]))
 
     try:
-        asyncio.run(telegram.Bot(token = bot_token).set_my_commands(commands_dict))
-        print(f"Commands have been successfully set with {commands.keys()}")
+        api_url = (api_url or TELEGRAM_API_URL).rstrip("/")
+        request = _instrumented_request()
+        bot = telegram.Bot(token=bot_token, request=request, base_url=f"{api_url}/bot", base_file_url=f"{api_url}/file/bot")
+
+        async def set_commands():
+            try:
+                await bot.set_my_commands(commands_dict)
+            finally:
+                await request.shutdown()
+
+        asyncio.run(set_commands())
+        logger.info("Commands have been successfully set with %s", commands.keys())
     except telegram.error.TelegramError as e:
-        print(f'Error setting commands: {e}')
+        logger.error('Error setting commands: %s', e)
+
+def _p95(samples: List[float]) -> float:
+    """
+    Private helper returning the nearest-rank 95th percentile of sorted samples,
+    never below their median however few there are.
+    """
+    import math
+    return samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)]
+
+class HandlerMetrics:
+    """
+    Counters and recent durations of the updates an InteractiveBot handles,
+    updated on the bot's event loop and read with snapshot().
+    """
+    def __init__(self, window: int = 1000):
+        """
+        Initialize empty metrics.
+
+        Args:
+            window: number of most recent durations kept per command.
+        """
+        self.window = window
+        self.waiting = 0
+        self.running = 0
+        self.counters = {"handled": 0, "timed_out": 0, "failed": 0}
+        self._durations: Dict[str, Any] = {}
+        self._failed_updates = set()
+
+    def mark_failed(self, update: Any) -> None:
+        """Marks an update whose handler raised, the error handler is called before the update finishes."""
+        self._failed_updates.add(id(update))
+
+    def take_failed(self, update: Any) -> bool:
+        """Returns whether the update was marked failed, forgetting the mark."""
+        if id(update) in self._failed_updates:
+            self._failed_updates.discard(id(update))
+            return True
+        return False
+
+    def record(self, command: str, seconds: float, outcome: str) -> None:
+        """Records how long handling an update for command took and whether it was handled, timed_out or failed."""
+        from collections import deque
+        self.counters[outcome] += 1
+        self._durations.setdefault(command, deque(maxlen=self.window)).append(seconds * 1000)
+
+    def snapshot(self, queued: int = 0) -> Dict[str, Any]:
+        """
+        Returns the queue depth (queued not yet picked up, waiting for their
+        chat or a free slot, running), the counters, and for every command the
+        count, mean, p95 and max handler duration in milliseconds over the window.
+        """
+        durations = {}
+        for command, samples in self._durations.items():
+            samples = sorted(samples)
+            durations[command] = {
+                "count": len(samples),
+                "mean_ms": sum(samples) / len(samples),
+                "p95_ms": _p95(samples),
+                "max_ms": samples[-1],
+            }
+        return {"queued": queued, "waiting": self.waiting, "running": self.running, **self.counters, "durations": durations}
+
+def _update_command(update: Any) -> str:
+    """
+    Private helper naming the command an update invokes, for metrics.
+    """
+    message = getattr(update, "effective_message", None)
+    text = getattr(message, "text", None) or ""
+    if text.startswith("/"):
+        return text.split()[0][1:].split("@")[0]
+    return "other"
+
+def _chat_ordered_processor(max_concurrent_updates: int, handler_timeout: Optional[float], metrics: HandlerMetrics,
+                            max_pending: int = 4096):
+    """
+    Private helper building an update processor that handles updates of
+    different chats concurrently, up to max_concurrent_updates at a time, but
+    updates of the same chat strictly one after another in arrival order.
+    Built on demand, so importing tele does not import python-telegram-bot.
+    """
+    import asyncio
+    from telegram.ext import BaseUpdateProcessor
+
+    class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+        def __init__(self):
+            # The base semaphore only bounds the updates in flight including those
+            # waiting for their chat, the running ones are bounded by _slots after the
+            # chat lock so a busy chat cannot occupy every slot with waiting updates.
+            super().__init__(1 if max_concurrent_updates == 1 else max_pending)
+            self._slots = asyncio.Semaphore(max_concurrent_updates)
+            self._chat_locks: Dict[Any, List[Any]] = {}
+
+        async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+            chat = getattr(update, "effective_chat", None)
+            key = chat.id if chat is not None else None
+            entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0]) if key is not None else [contextlib.nullcontext(), 0]
+            entry[1] += 1
+            metrics.waiting += 1
+            started = False
+            try:
+                async with entry[0], self._slots:
+                    metrics.waiting -= 1
+                    started = True
+                    metrics.running += 1
+                    try:
+                        await self._run(update, coroutine)
+                    finally:
+                        metrics.running -= 1
+            finally:
+                if not started:
+                    metrics.waiting -= 1
+                entry[1] -= 1
+                if key is not None and entry[1] == 0:
+                    del self._chat_locks[key]
+
+        async def _run(self, update: object, coroutine: Awaitable[Any]) -> None:
+            command = _update_command(update)
+            start = time.perf_counter()
+            outcome = "handled"
+            try:
+                if handler_timeout:
+                    await asyncio.wait_for(coroutine, handler_timeout)
+                else:
+                    await coroutine
+            except asyncio.TimeoutError:
+                outcome = "timed_out"
+                logger.warning("Handler for /%s timed out after %ss", command, handler_timeout)
+            except Exception as e:
+                outcome = "failed"
+                logger.error("Error handling /%s: %s", command, e)
+            if metrics.take_failed(update):
+                outcome = "failed"
+            metrics.record(command, time.perf_counter() - start, outcome)
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+    return ChatOrderedUpdateProcessor()
 
 class InteractiveBot:
     """
     A wrapper around python-telegram-bot Application to handle interactive commands.
+    Updates are received either by long polling (start) or by an embedded
+    webhook receiver (start_webhook).
     """
-    def __init__(self, token: str, command_handlers: Dict[str, Callable]):
+    # Largest update body the webhook receiver accepts.
+    MAX_WEBHOOK_BODY = 1 << 20
+
+    def __init__(self, token: str, command_handlers: Dict[str, Callable], api_url: str = TELEGRAM_API_URL,
+                 concurrent_updates: int = 1, handler_timeout: float = None, max_workers: int = None):
         """
         Initialize the interactive bot.
         
         Args:
             token: Telegram bot token.
             command_handlers: Dictionary mapping command strings (e.g., "start") to async callback functions.
-                              The callback should accept (update, context).
+                              The callback should accept (update, context). Plain (non async) functions
+                              are run on a thread pool so they do not block the event loop.
+            api_url: base url of the Bot API, overridable for local stand-in servers.
+            concurrent_updates: how many updates are handled at the same time. Updates of the
+                                same chat are always handled one after another, in order.
+            handler_timeout: seconds after which handling an update is cancelled, None for no limit.
+            max_workers: size of the thread and process pools, see offload.
         """
+        import asyncio
+        import functools
         from telegram.ext import Application, CommandHandler
-        self.application = Application.builder().token(token).build()
+        api_url = api_url.rstrip("/")
+        self.handler_metrics = HandlerMetrics()
+        processor = _chat_ordered_processor(concurrent_updates, handler_timeout, self.handler_metrics)
+        self.application = Application.builder().token(token).base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot") \
+            .request(_instrumented_request(connection_pool_size=256)).get_updates_request(_instrumented_request()) \
+            .concurrent_updates(processor).build()
+        self.application.add_error_handler(self._on_error)
+        self.max_workers = max_workers
+        self._executors: Dict[bool, Any] = {}
+        self.secret_token = None
+        self.webhook_address = None
+        self._webhook_server = None
+        self._webhook_path = None
+        self._webhook_connections = set()
         
         for command, handler in command_handlers.items():
+            if not asyncio.iscoroutinefunction(handler):
+                handler = functools.partial(self.offload, handler)
             self.application.add_handler(CommandHandler(command, handler))
+
+    async def _on_error(self, update, context):
+        self.handler_metrics.mark_failed(update)
+        logger.error("Error handling /%s: %s", _update_command(update), context.error)
+
+    async def offload(self, func: Callable, *args, process: bool = False) -> Any:
+        """
+        Runs a CPU bound function on the bot's thread pool, or with process set
+        on its process pool, without blocking the event loop, and returns its
+        result. For the process pool func and args must be picklable, so pass
+        e.g. the file path to render rather than the update itself.
+        """
+        import asyncio
+        import functools
+        executor = self._executors.get(process)
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = _process_pool(self.max_workers) if process else ThreadPoolExecutor(max_workers=self.max_workers)
+            self._executors[process] = executor
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the queue depth and handler duration metrics, see HandlerMetrics.snapshot.
+        """
+        return self.handler_metrics.snapshot(self.application.update_queue.qsize())
             
     async def start(self):
         """Initialize and start the bot application."""
         await self.application.initialize()
         await self.application.start()
         await self.application.updater.start_polling()
+
+    async def start_webhook(self, listen: str = "127.0.0.1", port: int = 8080, url_path: str = "/telegram", secret_token: str = None,
+                            webhook_url: str = None, allowed_updates: List[str] = None):
+        """
+        Initialize and start the bot application, receiving updates on an
+        embedded HTTP server instead of polling for them. Every POST to
+        url_path carrying the secret token in its X-Telegram-Bot-Api-Secret-Token
+        header is handed to the application as soon as it arrives.
+
+        Args:
+            listen: interface to listen on, typically behind a reverse proxy terminating TLS.
+            port: port to listen on, 0 picks a free port, see webhook_address.
+            url_path: path updates are posted to.
+            secret_token: token telegram sends along with every update, a random one is generated if not given.
+            webhook_url: public url of the receiver, if given it is registered with telegram via setWebhook.
+            allowed_updates: update types to register with setWebhook, e.g. ["message"].
+        """
+        import asyncio
+        import secrets
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self._webhook_path = "/" + url_path.lstrip("/")
+        await self.application.initialize()
+        await self.application.start()
+        self._webhook_server = await asyncio.start_server(self._serve_webhook, listen, port)
+        self.webhook_address = self._webhook_server.sockets[0].getsockname()[:2]
+        if webhook_url:
+            await self.application.bot.set_webhook(webhook_url, secret_token=self.secret_token, allowed_updates=allowed_updates)
+
+    async def _webhook_status(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> str:
+        import hmac
+        from telegram import Update
+        if target.split("?", 1)[0] != self._webhook_path:
+            return "404 Not Found"
+        if method != "POST":
+            return "405 Method Not Allowed"
+        if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", "").encode(), self.secret_token.encode()):
+            return "403 Forbidden"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return "400 Bad Request"
+        await self.application.update_queue.put(update)
+        return "200 OK"
+
+    async def _serve_webhook(self, reader, writer):
+        import asyncio
+        self._webhook_connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length > self.MAX_WEBHOOK_BODY:
+                    status = "413 Payload Too Large"
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length > 0 else b""
+                    status = await self._webhook_status(method, target, headers, body)
+                connection = "keep-alive" if keep_alive else "close"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: {connection}\r\n\r\n".encode())
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._webhook_connections.discard(writer)
+            writer.close()
         
     async def stop(self):
         """Stop and shutdown the bot application."""
-        await self.application.updater.stop()
+        if self._webhook_server is not None:
+            self._webhook_server.close()
+            # Idle keep-alive connections would otherwise hold wait_closed() up.
+            for writer in list(self._webhook_connections):
+                writer.close()
+            await self._webhook_server.wait_closed()
+            self._webhook_server = None
+        if self.application.updater.running:
+            await self.application.updater.stop()
         await self.application.stop()
         await self.application.shutdown()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
         
     async def send_video(self, chat_id, video_file, caption, read_timeout=120, write_timeout=120):
         """Send a video using the active application bot instance."""
@@ -294,23 +2784,417 @@ class InteractiveBot:
             write_timeout=write_timeout
         )
 
-def get_telegram_updates(bot_token: str, last_update: int) -> Dict[str, Any]:
+def get_telegram_updates(bot_token: str, last_update: int, client: TelegramClient = None) -> Dict[str, Any]:
     """
         Retrieves the latest updates from telegram.
         Args:
             bot_token: unique identifier for the telegram bot
             last_update: the index of the update that was last processed.
+            client: http client to poll with, defaults to the shared pooled client
         Returns:
             A json structure with the updates from telegram
     """
-    url = f"https://api.telegram.org/bot{bot_token}/getUpdates"
+    client = client or get_default_client()
+    url = client.method_url(bot_token, "getUpdates")
     if last_update > 0:
         url = url + "?offset=" + str(last_update + 1)
-    response = requests.get(url)
+    response = client.get(url)
     updates = response.json()
     return updates
 
+def _load_offset(offset_file: str) -> int:
+    """
+    Private helper reading a persisted getUpdates offset, 0 if there is none.
+    """
+    try:
+        with open(offset_file) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def _save_offset(offset_file: str, offset: int) -> None:
+    """
+    Private helper atomically persisting a getUpdates offset.
+    """
+    tmp_path = offset_file + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(offset))
+    os.replace(tmp_path, offset_file)
+
+def iter_telegram_updates(bot_token: str, timeout: int = 30, limit: int = 100, allowed_updates: List[str] = None,
+                          offset_file: str = None, client: TelegramClient = None) -> Iterator[Dict[str, Any]]:
+    """
+        Long-polls telegram for updates and yields them one at a time as
+        they arrive. When offset_file is given the offset is checkpointed
+        after the consumer is done with each update, so a restarted consumer
+        resumes with the first update it has not finished processing.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            timeout: seconds telegram holds a poll open waiting for updates
+            limit: maximum number of updates fetched per poll
+            allowed_updates: update types to receive, e.g. ["message"], None for the bot's default
+            offset_file: optional file to persist the offset in
+            client: http client to poll with, defaults to the shared pooled client
+        Returns:
+            An iterator over the updates
+    """
+    client = client or get_default_client()
+    offset = _load_offset(offset_file) if offset_file else 0
+    errors = 0
+    while True:
+        updates = _poll_updates(client, bot_token, offset, timeout, limit, allowed_updates)
+        if not updates.get("ok"):
+            errors += 1
+            logger.error("Error getting updates: %s", updates.get('description'))
+            time.sleep(min(2 ** errors, 60))
+            continue
+        errors = 0
+        for update in updates["result"]:
+            yield update
+            offset = update["update_id"] + 1
+            if offset_file:
+                _save_offset(offset_file, offset)
+
+def _poll_updates(client: TelegramClient, bot_token: str, offset: int, timeout: int, limit: int,
+                  allowed_updates: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Private helper making a single getUpdates long poll, errors are returned as a not ok response.
+    """
+    import requests
+    params = {"timeout": timeout, "limit": limit}
+    if offset > 0:
+        params["offset"] = offset
+    if allowed_updates is not None:
+        params["allowed_updates"] = json.dumps(allowed_updates)
+    try:
+        # The read timeout has to outlast the time telegram holds the poll.
+        response = client.get(client.method_url(bot_token, "getUpdates"), params=params,
+                              timeout=(client.timeout[0], client.timeout[1] + timeout))
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        return {"ok": False, "description": str(e)}
+
+async def aiter_telegram_updates(bot_token: str, timeout: int = 30, limit: int = 100, allowed_updates: List[str] = None,
+                                 offset_file: str = None, client: TelegramClient = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+        Async counterpart of iter_telegram_updates, making each poll on a worker
+        thread so the event loop is never blocked. Cancelling the iterator
+        leaves at most the poll in flight, which ends within timeout seconds.
+        Args:
+            bot_token: unique identifier for the telegram bot
+            timeout: seconds telegram holds a poll open waiting for updates
+            limit: maximum number of updates fetched per poll
+            allowed_updates: update types to receive, e.g. ["message"], None for the bot's default
+            offset_file: optional file to persist the offset in
+            client: http client to poll with, defaults to the shared pooled client
+        Returns:
+            An async iterator over the updates
+    """
+    import asyncio
+    client = client or get_default_client()
+    offset = _load_offset(offset_file) if offset_file else 0
+    errors = 0
+    while True:
+        updates = await asyncio.to_thread(_poll_updates, client, bot_token, offset, timeout, limit, allowed_updates)
+        if not updates.get("ok"):
+            errors += 1
+            logger.error("Error getting updates: %s", updates.get('description'))
+            await asyncio.sleep(min(2 ** errors, 60))
+            continue
+        errors = 0
+        for update in updates["result"]:
+            yield update
+            offset = update["update_id"] + 1
+            if offset_file:
+                _save_offset(offset_file, offset)
+
+# Frames on the daemon socket are a 4 byte big-endian length followed by that many bytes of JSON.
+MAX_FRAME_SIZE = 64 << 20
+
+def _send_frame(sock, payload: Dict[str, Any]) -> None:
+    """
+    Private helper writing one length prefixed JSON frame to a socket.
+    """
+    body = json.dumps(payload).encode()
+    sock.sendall(len(body).to_bytes(4, "big") + body)
+
+def _recv_exactly(sock, size: int) -> Optional[bytes]:
+    """
+    Private helper reading exactly size bytes from a socket, returns None if it is closed first.
+    """
+    data = bytearray()
+    while len(data) < size:
+        block = sock.recv(size - len(data))
+        if not block:
+            return None
+        data += block
+    return bytes(data)
+
+def _recv_frame(sock) -> Optional[Dict[str, Any]]:
+    """
+    Private helper reading one length prefixed JSON frame from a socket, returns None once the socket is closed.
+    """
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    size = int.from_bytes(header, "big")
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"frame of {size} bytes exceeds {MAX_FRAME_SIZE}")
+    body = _recv_exactly(sock, size)
+    if body is None:
+        return None
+    return json.loads(body)
+
+class TeleDaemon:
+    """
+    A resident process serving send, fetch and stats requests from local
+    scripts over a Unix socket, so they share one warm HTTP pool, event loop
+    and Bot instance instead of each paying interpreter start up, imports
+    and a TLS handshake. Every connection may carry any number of requests.
+    """
+    def __init__(self, path: str, client: TelegramClient = None, sender: AsyncSender = None):
+        """
+        Initialize the daemon, call start() or serve_forever() to accept requests.
+
+        Args:
+            path: location of the Unix socket, a stale socket file is replaced.
+            client: http client for text messages and fetches, defaults to the shared pooled client.
+            sender: sender for files, defaults to the shared sender.
+        """
+        import socket
+        import socketserver
+        import stat
+        import tempfile
+
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        request = _recv_frame(self.request)
+                    except (OSError, ValueError):
+                        return
+                    if request is None:
+                        return
+                    _send_frame(self.request, daemon.handle(request))
+
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError(f"a daemon is already listening on {path}")
+            except ConnectionRefusedError:
+                os.unlink(path)
+            finally:
+                probe.close()
+        self.path = path
+        self.client = client
+        self.sender = sender
+        self._latencies: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        # The socket is bound and made owner-only inside a private directory, then
+        # moved into place, so no other user can ever connect and have arbitrary
+        # paths uploaded.
+        private_dir = tempfile.mkdtemp(prefix=".tele-", dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            private_path = os.path.join(private_dir, "s")
+            self._server = socketserver.ThreadingUnixStreamServer(private_path, Handler)
+            os.chmod(private_path, 0o600)
+            os.rename(private_path, path)
+        except BaseException:
+            if hasattr(self, "_server"):
+                self._server.server_close()
+            raise
+        finally:
+            with contextlib.suppress(OSError):
+                os.unlink(os.path.join(private_dir, "s"))
+            os.rmdir(private_dir)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def _dispatch(self, request: Dict[str, Any]) -> Any:
+        op = request.get("op")
+        if op == "ping":
+            return "pong"
+        if op == "stats":
+            return self.stats()
+        if op == "message":
+            return send_telegram(request["bot_token"], request["chat_token"], request["message"], self.client)
+        if op == "files":
+            sender = self.sender or get_default_sender()
+            paths = request["files"]
+            captions = request.get("captions") or [request.get("caption") or os.path.basename(path) for path in paths]
+            media_types = request.get("media_types") or [_media_type_for(path) for path in paths]
+            timeout = request.get("timeout", 360)
+            if request.get("albums", True):
+                return sender.run(send_telegram_album(request["bot_token"], request["chat_token"], paths, captions, timeout,
+                                                      sender, media_types))
+            sends = [_media_sender_for_type(media_type)(request["bot_token"], request["chat_token"], path, caption, timeout, sender)
+                     for path, caption, media_type in zip(paths, captions, media_types)]
+            return sender.run(_gather_sends(sends))
+        if op == "fetch":
+            return get_telegram_files(request["bot_token"], request["file_ids"], request.get("fetch_dir", "./"), self.client,
+                                      request.get("workers", 4))
+        raise ValueError(f"unknown op {op!r}")
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Serves one request, returns the response frame including the time it took to serve in milliseconds.
+        """
+        start = time.perf_counter()
+        try:
+            response = {"ok": True, "result": self._dispatch(request)}
+        except Exception as e:
+            response = {"ok": False, "error": str(e) or type(e).__name__}
+        latency_ms = (time.perf_counter() - start) * 1000
+        response["latency_ms"] = latency_ms
+        op = str(request.get("op"))
+        with self._lock:
+            self._latencies.setdefault(op, []).append(latency_ms)
+        logger.info("Served %s in %.1f ms%s", op, latency_ms, "" if response["ok"] else f": {response['error']}")
+        return response
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns for every op served so far its count and mean, median and p95 latency in milliseconds.
+        """
+        with self._lock:
+            latencies = {op: sorted(samples) for op, samples in self._latencies.items()}
+        return {
+            op: {
+                "count": len(samples),
+                "mean_ms": sum(samples) / len(samples),
+                "median_ms": samples[len(samples) // 2],
+                "p95_ms": _p95(samples),
+            }
+            for op, samples in latencies.items()
+        }
+
+    def serve_forever(self) -> None:
+        """Serves requests on the calling thread until stop() is called."""
+        self._server.serve_forever(poll_interval=0.05)
+
+    def start(self) -> "TeleDaemon":
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="tele-daemon", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving, closes the socket and removes the socket file."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class DaemonClient:
+    """
+    A thin client forwarding requests to a TeleDaemon over its Unix socket.
+    It only needs the standard library, so scripts using it start quickly.
+    Files are passed by absolute path, the daemon reads them itself.
+    """
+    def __init__(self, path: str, timeout: float = None):
+        """
+        Connects to the daemon.
+
+        Args:
+            path: location of the daemon's Unix socket.
+            timeout: seconds to wait for a response, None waits as long as the send takes.
+        """
+        import socket
+        self.path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._lock = threading.Lock()
+
+    def request(self, op: str, **params) -> Dict[str, Any]:
+        """
+        Sends one request and returns the daemon's response with "ok",
+        "result" or "error", and the "latency_ms" the daemon took to serve it.
+        """
+        with self._lock:
+            _send_frame(self._sock, {"op": op, **params})
+            response = _recv_frame(self._sock)
+        if response is None:
+            raise ConnectionError(f"daemon at {self.path} closed the connection")
+        return response
+
+    def send_message(self, bot_token: str, chat_token: str, message: str) -> Dict[str, Any]:
+        """Sends a text message through the daemon, see send_telegram."""
+        return self.request("message", bot_token=bot_token, chat_token=chat_token, message=message)
+
+    def send_files(self, bot_token: str, chat_token: str, filenames: List[str], captions: List[str] = None,
+                   media_types: List[str] = None, timeout: int = 360, albums: bool = True) -> Dict[str, Any]:
+        """Sends files through the daemon, grouped into albums unless albums is False, see send_telegram_album."""
+        return self.request("files", bot_token=bot_token, chat_token=chat_token, files=[os.path.abspath(f) for f in filenames],
+                            captions=captions, media_types=media_types, timeout=timeout, albums=albums)
+
+    def fetch(self, bot_token: str, file_ids: List[str], fetch_dir: str = "./", workers: int = 4) -> Dict[str, Any]:
+        """Downloads files through the daemon, see get_telegram_files."""
+        return self.request("fetch", bot_token=bot_token, file_ids=file_ids, fetch_dir=os.path.abspath(fetch_dir), workers=workers)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the daemon's per op latency statistics."""
+        return self.request("stats")
+
+    def close(self) -> None:
+        """Closes the connection."""
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _sender_from_args(args: Any, file_id_cache: Optional[FileIdCache]) -> AsyncSender:
+    """
+    Private helper building the sender configured by the command line arguments.
+    """
+    image_preprocessor = None
+    if args.shrink_images:
+        image_preprocessor = ImagePreprocessor(args.image_cache or None)
+        atexit.register(image_preprocessor.close)
+    return AsyncSender(max_concurrent_uploads=args.max_concurrent_uploads, file_id_cache=file_id_cache, oversize=args.oversize,
+                       image_preprocessor=image_preprocessor)
+
+class _JsonFormatter(logging.Formatter):
+    """
+    Private formatter writing every record as one line of json, with the
+    event of API call records under "api_call".
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        if hasattr(record, "api_call"):
+            entry["api_call"] = record.api_call
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+_cli_log_handler = None
+
+def _configure_logging(args: Any) -> None:
+    """
+    Private helper sending the library's log to stderr at the level chosen on the command line.
+    """
+    global _cli_log_handler
+    if _cli_log_handler is None:
+        _cli_log_handler = logging.StreamHandler()
+        logger.addHandler(_cli_log_handler)
+        # The library's records are handled here rather than again by any root handler.
+        logger.propagate = False
+    _cli_log_handler.setFormatter(_JsonFormatter() if args.log_json else logging.Formatter("%(message)s"))
+    logger.setLevel(logging.WARNING if args.quiet else logging.DEBUG if args.verbose else logging.INFO)
+
 def main(argv=None):
+    import argparse
     parser = argparse.ArgumentParser(description="Send a telegram message in a chat")
     parser.add_argument("--message", type=str, default="", help="message to send")
     parser.add_argument("--bot_token", type=str, default="", help="bot token for telegram")
@@ -321,51 +3205,199 @@ def main(argv=None):
     parser.add_argument("--document", action='extend', nargs='+', help="document file to send")
     parser.add_argument("--animation", action='extend', nargs='+', help="animation file to send")
     parser.add_argument("--file", action='extend', nargs='+', help="arbitrary file to send")
-    parser.add_argument("--updates", type=int, default=0, help="query updates from bot")
-    parser.add_argument("--fetch", type=str, default="", help="fetches a telegram file")
+    parser.add_argument("--updates", type=int, default=None, help="query updates from bot after the given update id")
+    parser.add_argument("--follow", action='store_true', help="long-poll updates from bot and print them as they arrive")
+    parser.add_argument("--offset_file", type=str, default="", help="file persisting the --follow offset across restarts")
+    parser.add_argument("--poll_timeout", type=int, default=30, help="seconds telegram holds each --follow poll open")
+    parser.add_argument("--allowed_updates", action='extend', nargs='+', help="update types --follow receives, e.g. message")
+    parser.add_argument("--stdin_follow", "--stdin-follow", action='store_true',
+                        help="send stdin as it arrives, editing one live message and rolling over to a new one when it is full")
+    parser.add_argument("--edit_interval", type=float, default=1.0, help="seconds between two --stdin_follow requests")
+    parser.add_argument("--fetch", action='extend', nargs='+', help="fetches one or more telegram files by file_id")
+    parser.add_argument("--fetch_dir", type=str, default="./", help="directory to store fetched files in")
+    parser.add_argument("--fetch_workers", type=int, default=4, help="how many files to fetch at the same time")
+    parser.add_argument("--serve", action='store_true', help="run as a resident daemon serving send and fetch requests on --socket")
+    parser.add_argument("--socket", type=str, default="", help="unix socket of the --serve daemon, without --serve the message, files and fetches are forwarded to it")
+    parser.add_argument("--chats", action='extend', nargs='+', help="broadcast the message and files to these chats and print a json report")
+    parser.add_argument("--no_albums", action='store_true', help="send every file on its own instead of grouping them into albums")
+    parser.add_argument("--max_concurrent_uploads", type=int, default=4, help="how many files to upload at the same time")
+    parser.add_argument("--oversize", type=str, default="reject", choices=["reject", "split", "compress"],
+                        help="what to do with files over telegram's 50 MB upload limit")
+    parser.add_argument("--shrink_images", action='store_true', help="downsize photos to 1280px and strip their metadata before upload, needs Pillow")
+    parser.add_argument("--image_cache", type=str, default="", help="directory keeping --shrink_images results across runs")
+    parser.add_argument("--file_id_cache", type=str, default="", help="sqlite file caching uploaded file ids to avoid re-uploads")
+    parser.add_argument("--queue", type=str, default="", help="sqlite spool to enqueue the message and files in instead of sending them")
+    parser.add_argument("--priority", type=int, default=0, help="priority of enqueued messages, higher is sent first")
+    parser.add_argument("--drain", action='store_true', help="send everything due in the --queue spool")
+    parser.add_argument("--queue_stats", action='store_true', help="print depth and age of the --queue spool as json")
+    parser.add_argument("--quiet", action='store_true', help="only log warnings and errors")
+    parser.add_argument("--verbose", action='store_true', help="also log every Bot API call with its latency and size")
+    parser.add_argument("--log_json", action='store_true', help="log to stderr as one json object per line")
+    parser.add_argument("--metrics_file", type=str, default="", help="write Bot API latency histograms in Prometheus text format to this file on exit")
     args = parser.parse_args(argv)
+    _configure_logging(args)
+    if args.metrics_file:
+        metrics = ApiMetrics()
+        add_api_hook(metrics)
+        atexit.register(metrics.write, args.metrics_file)
 
-    if args.bot_token == "":
+    queue_only = args.queue and (args.drain or args.queue_stats) and not args.message
+    if args.bot_token == "" and not queue_only and not args.serve:
         print("must specify bot token")
         sys.exit(-1)
 
-    updates = get_telegram_updates(args.bot_token, args.updates)
-    if "result" in updates and len(updates["result"]) > 0:
-        print("Updates: ", updates)
+    if args.serve:
+        if not args.socket:
+            print("must specify --socket")
+            sys.exit(-1)
+        file_id_cache = FileIdCache(args.file_id_cache) if args.file_id_cache else None
+        set_default_sender(_sender_from_args(args, file_id_cache))
+        daemon = TeleDaemon(args.socket)
+        print(f"Serving on {args.socket}", flush=True)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.stop()
+            get_default_sender().close()
+            if file_id_cache is not None:
+                file_id_cache.close()
+        return
+
+    if args.socket:
+        paths, captions, media_types = [], [], []
+        for media_list, media_type in ((args.image, 'photo'), (args.video, 'video'), (args.audio, 'audio'),
+                                       (args.document, 'document'), (args.animation, 'animation'), (args.file, None)):
+            for item in media_list or []:
+                paths.append(item)
+                captions.append(args.message or item)
+                media_types.append(media_type or _media_type_for(item))
+        responses = []
+        with DaemonClient(args.socket) as daemon:
+            if paths:
+                responses.append(daemon.send_files(args.bot_token, args.chat_token, paths, captions, media_types, albums=not args.no_albums))
+            elif len(args.message) > 0:
+                responses.append(daemon.send_message(args.bot_token, args.chat_token, args.message))
+            if args.fetch:
+                responses.append(daemon.fetch(args.bot_token, args.fetch, args.fetch_dir, args.fetch_workers))
+        for response in responses:
+            print(json.dumps(response))
+        return
+
+    if args.queue:
+        queue = MessageQueue(args.queue)
+        queued = False
+        # List of (argument_values, media_type, timeout)
+        queue_actions = [
+            (args.image, "photo", 60),
+            (args.video, "video", 180),
+            (args.audio, "audio", 60),
+            (args.document, "document", 120),
+            (args.animation, "animation", 120),
+            (args.file, None, 360)
+        ]
+        for media_list, media, timeout in queue_actions:
+            for item in media_list or []:
+                queue.enqueue_file(args.bot_token, args.chat_token, item, args.message or item, timeout, media, args.priority)
+                queued = True
+        if not queued and len(args.message) > 0:
+            queue.enqueue_message(args.bot_token, args.chat_token, args.message, args.priority)
+        if args.drain:
+            QueueWorker(queue).drain()
+        if args.queue_stats:
+            print(json.dumps(queue.stats()))
+        queue.close()
+        return
+
+    if args.stdin_follow:
+        try:
+            send_telegram_live(args.bot_token, args.chat_token, sys.stdin, min_interval=args.edit_interval)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.follow:
+        try:
+            for update in iter_telegram_updates(args.bot_token, args.poll_timeout, allowed_updates=args.allowed_updates,
+                                                offset_file=args.offset_file or None):
+                print(json.dumps(update), flush=True)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.updates is not None:
+        updates = get_telegram_updates(args.bot_token, args.updates)
+        if "result" in updates and len(updates["result"]) > 0:
+            print("Updates: ", updates)
+
+    if args.fetch:
+        paths = get_telegram_files(args.bot_token, args.fetch, args.fetch_dir, max_workers=args.fetch_workers)
+        for file_id, path in paths.items():
+            print(f"{file_id}: {path}" if path else f"{file_id}: failed")
 
-    if args.fetch and len(args.fetch) > 0:
-        get_telegram_file(args.bot_token, "", args.fetch, "./")
+    filenames = []
+    for media_list in (args.image, args.video, args.audio, args.document, args.animation, args.file):
+        filenames.extend(media_list or [])
+    if not filenames and not args.chats:
+        # A plain text message needs neither the event loop nor python-telegram-bot.
+        if len(args.message) > 0:
+            send_telegram(args.bot_token, args.chat_token, args.message)
+        return
 
-    sent = False
-    
-    # List of (argument_values, function_to_call, timeout)
+    file_id_cache = FileIdCache(args.file_id_cache) if args.file_id_cache else None
+    set_default_sender(_sender_from_args(args, file_id_cache))
+    sends = []
+
+    if args.chats:
+        chats = ([args.chat_token] if args.chat_token else []) + args.chats
+        # As for a single chat, the message is the caption when there are files.
+        message = "" if filenames else args.message
+        report = broadcast_telegram(args.bot_token, chats, message, filenames, args.message, timeout=360)
+        get_default_sender().close()
+        if file_id_cache is not None:
+            file_id_cache.close()
+        print(json.dumps(report))
+        return
+
+    # List of (argument_values, function_to_call, media_type, timeout)
     media_actions = [
-        (args.image, send_telegram_image, 60),
-        (args.video, send_telegram_video, 180),
-        (args.audio, send_telegram_audio, 60),
-        (args.document, send_telegram_document, 120),
-        (args.animation, send_telegram_animation, 120)
+        (args.image, send_telegram_image, 'photo', 60),
+        (args.video, send_telegram_video, 'video', 180),
+        (args.audio, send_telegram_audio, 'audio', 60),
+        (args.document, send_telegram_document, 'document', 120),
+        (args.animation, send_telegram_animation, 'animation', 120)
     ]
 
-    for media_list, func, timeout in media_actions:
+    # List of (function_to_call, path, caption, media_type, timeout)
+    items = []
+    for media_list, func, media_type, timeout in media_actions:
         if media_list:
             for item in media_list:
                 message = args.message
                 if not message:
                     message = item
-                asyncio.run(func(args.bot_token, args.chat_token, item, message, timeout=timeout))
-                sent = True
+                items.append((func, item, message, media_type, timeout))
 
     if args.file:
         for file in args.file:
             message = args.message
             if not message:
                 message = file
-            send_telegram_file(args.bot_token, args.chat_token, file, message, timeout=360)
-            sent = True
+            items.append((_media_sender_for(file), file, message, _media_type_for(file), 360))
+
+    if len(items) > 1 and not args.no_albums:
+        sends.append(send_telegram_album(args.bot_token, args.chat_token, [item[1] for item in items], [item[2] for item in items],
+                                         timeout=max(item[4] for item in items), media_types=[item[3] for item in items]))
+    else:
+        for func, item, message, _, timeout in items:
+            sends.append(func(args.bot_token, args.chat_token, item, message, timeout=timeout))
 
-    if not sent and len(args.message) > 0:
-        send_telegram(args.bot_token, args.chat_token, args.message)
+    sender = get_default_sender()
+    sender.run(_gather_sends(sends))
+    sender.close()
+    if file_id_cache is not None:
+        file_id_cache.close()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
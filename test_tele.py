@@ -1,27 +1,45 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock, call
 import os
 import sys
 import tele
+from fake_telegram import FakeTelegramServer, command_message
+
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
 
 class TestTele(unittest.TestCase):
 
+    def setUp(self):
+        # Every test starts with empty flood-control buckets.
+        tele.set_default_rate_limiter(None)
+
     def test_look_for(self):
         message = "hello world"
         self.assertEqual(tele.look_for(message, " ", 5, 5), 5)
         self.assertEqual(tele.look_for(message, "o", 10, 5), 7)
         self.assertEqual(tele.look_for(message, "z", 10, 10), -1)
 
-    @patch('requests.post')
+    @patch.object(tele.TelegramClient, 'post')
     def test_send_telegram(self, mock_post):
+        mock_post.return_value.status_code = 200
         tele.send_telegram("bot_token", "chat_token", "test message")
         mock_post.assert_called_with(
             "https://api.telegram.org/botbot_token/sendMessage",
             data={"chat_id": "chat_token", "text": "test message"}
         )
 
-    @patch('requests.post')
+    @patch.object(tele.TelegramClient, 'post')
     def test_send_telegram_chunking(self, mock_post):
+        mock_post.return_value.status_code = 200
         # Create a message longer than chunk_size (4090)
         # We'll use a message with 5000 'a's
         long_message = "a" * 5000
@@ -38,7 +56,642 @@ class TestTele(unittest.TestCase):
         second_call_args = mock_post.call_args_list[1]
         self.assertEqual(second_call_args[1]['data']['text'], "a" * (5000 - 4090))
 
-    @patch('requests.get')
+    def test_iter_chunks_prefers_newlines(self):
+        message = ("x" * 99 + "\n") * 50
+        chunks = list(tele.iter_chunks(message))
+        self.assertEqual("".join(chunks), message)
+        self.assertEqual(len(chunks[0]), 4000)
+        self.assertTrue(all(chunk.endswith("\n") for chunk in chunks))
+
+    def test_iter_chunks_counts_utf16_units(self):
+        # Each emoji is a single code point but two UTF-16 code units.
+        message = "a" + "\U0001F600" * 3000
+        chunks = list(tele.iter_chunks(message))
+        self.assertEqual("".join(chunks), message)
+        self.assertEqual([tele.utf16_len(chunk) for chunk in chunks], [4089, 1912])
+        self.assertFalse(any(0xD800 <= ord(c) <= 0xDFFF for chunk in chunks for c in chunk))
+
+    def test_iter_chunks_lazy_input(self):
+        message = "word " * 3000
+        expected = list(tele.iter_chunks(message))
+        self.assertEqual(list(tele.iter_chunks(io.StringIO(message))), expected)
+        self.assertEqual(list(tele.iter_chunks(iter(message[i:i + 7] for i in range(0, len(message), 7)))), expected)
+
+    def test_send_telegram_reuses_connection(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+            with patch('builtins.print'):
+                tele.send_telegram("bot_token", "chat_token", "a" * 10000, client)
+            self.assertEqual(len(server.calls), 3)
+            self.assertEqual(server.calls[0][0], "sendMessage")
+            self.assertEqual(server.connections, 1)
+
+    def test_telegram_client_upload_streams_range(self):
+        data = os.urandom(200000)
+        progress = []
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.bin")
+            with open(path, "wb") as f:
+                f.write(data)
+            response = client.upload("bot_token", "sendDocument", "chat_token", "document", path, {"caption": "part"},
+                                     offset=10, length=150000, progress=lambda sent, total: progress.append((sent, total)))
+            self.assertTrue(response.json()["ok"])
+            self.assertEqual(server.uploads, [("document", "data.bin", data[10:150010])])
+            self.assertEqual(server.calls[0][1]["caption"], "part")
+        self.assertEqual(progress[-1], (150000, 150000))
+
+    def test_send_oversized_file_policies(self):
+        import gzip
+        with FakeTelegramServer() as server, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "big.bin")
+            data = os.urandom(2500)
+            with open(path, "wb") as f:
+                f.write(data)
+            for oversize in ("reject", "split"):
+                sender = tele.AsyncSender(api_url=server.url, max_upload_size=1000, oversize=oversize,
+                                          rate_limiter=tele.RateLimiter(chat_burst=10))
+                with patch('builtins.print'):
+                    result = tele.send_telegram_file("bot_token", "chat_token", path, "big", sender=sender)
+                sender.close()
+                self.assertEqual(result, oversize == "split")
+            self.assertEqual([name for _, name, _ in server.uploads], ["big.bin.001", "big.bin.002", "big.bin.003"])
+            self.assertEqual(b"".join(part for _, _, part in server.uploads), data)
+            self.assertEqual([params["caption"] for _, params in server.calls], ["big (1/3)", "big (2/3)", "big (3/3)"])
+            del server.uploads[:]
+            data = b"compressible " * 500
+            with open(path, "wb") as f:
+                f.write(data)
+            sender = tele.AsyncSender(api_url=server.url, max_upload_size=1000, oversize="compress",
+                                      rate_limiter=tele.RateLimiter(chat_burst=10))
+            with patch('builtins.print'):
+                self.assertTrue(tele.send_telegram_file("bot_token", "chat_token", path, sender=sender))
+            sender.close()
+            [(field, name, part)] = server.uploads
+            self.assertEqual((field, name), ("document", "big.bin.gz"))
+            self.assertEqual(gzip.decompress(part), data)
+
+    @unittest.skipUnless(HAS_PILLOW, "needs Pillow")
+    def test_image_preprocessor_shrinks_and_caches(self):
+        from PIL import Image
+        with tempfile.TemporaryDirectory() as tmp:
+            photo = os.path.join(tmp, "photo.jpg")
+            exif = Image.Exif()
+            exif[0x0112] = 6  # rotated 90 degrees
+            Image.new("RGB", (3000, 2000), "red").save(photo, exif=exif)
+            png = os.path.join(tmp, "shot.png")
+            Image.new("RGBA", (800, 600), (0, 0, 0, 0)).save(png)
+            copy = os.path.join(tmp, "copy.png")
+            with open(png, "rb") as src, open(copy, "wb") as dst:
+                dst.write(src.read())
+            preprocessor = tele.ImagePreprocessor(os.path.join(tmp, "cache"), max_workers=2)
+            try:
+                (image, thumbnail), (small, _), (small_copy, _) = preprocessor.process([photo, png, copy])
+            finally:
+                preprocessor.close()
+            with Image.open(image) as shrunk, Image.open(thumbnail) as thumb, Image.open(small) as flattened:
+                self.assertEqual((shrunk.format, shrunk.size), ("JPEG", (853, 1280)))
+                self.assertEqual(len(shrunk.getexif()), 0)
+                self.assertEqual(thumb.size, (213, 320))
+                self.assertEqual((flattened.size, flattened.getpixel((0, 0))), ((800, 600), (255, 255, 255)))
+            self.assertEqual(small, small_copy)
+            preprocessor = tele.ImagePreprocessor(os.path.join(tmp, "cache"))
+            self.assertEqual(preprocessor.process([photo])[0], [image, thumbnail])
+            self.assertIsNone(preprocessor._pool)
+            preprocessor.close()
+            self.assertTrue(os.path.exists(image))
+
+    @unittest.skipUnless(HAS_PILLOW, "needs Pillow")
+    def test_send_preprocessed_images(self):
+        from PIL import Image
+        with FakeTelegramServer() as server, tempfile.TemporaryDirectory() as tmp:
+            photo = os.path.join(tmp, "photo.png")
+            Image.new("RGB", (2560, 1440), "blue").save(photo)
+            preprocessor = tele.ImagePreprocessor()
+            sender = tele.AsyncSender(api_url=server.url, image_preprocessor=preprocessor, rate_limiter=tele.RateLimiter(chat_burst=10))
+            with patch('builtins.print'):
+                self.assertTrue(tele.send_telegram_file("bot_token", "chat_token", photo, sender=sender))
+                self.assertTrue(sender.run(tele.send_telegram_document("bot_token", "chat_token", photo, sender=sender)))
+            sender.close()
+            preprocessor.close()
+            self.assertFalse(os.path.exists(preprocessor.cache_dir))
+        (_, _, shrunk), (_, name, original), (field, _, thumbnail) = server.uploads
+        with Image.open(io.BytesIO(shrunk)) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (1280, 720)))
+        self.assertEqual(name, "photo.png")
+        with Image.open(io.BytesIO(original)) as image:
+            self.assertEqual(image.size, (2560, 1440))
+        self.assertEqual(server.calls[-1][1]["thumbnail"], f"attach://{field}")
+        with Image.open(io.BytesIO(thumbnail)) as image:
+            self.assertEqual(image.size, (320, 180))
+
+    def test_log_handler_batches_and_deduplicates(self):
+        logger = logging.getLogger("test_tele.batches")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+            handler = tele.TelegramLogHandler("bot_token", "chat_token", flush_interval=60, max_chars=60, client=client)
+            logger.addHandler(handler)
+            try:
+                for _ in range(3):
+                    logger.warning("disk at %d%%", 91)
+                logger.warning("load high")
+                self.assertEqual(server.calls, [])
+                logger.error("boom")
+                for _ in range(100):
+                    if server.calls:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual([params["text"] for _, params in server.calls], ["disk at 91% x3\nload high\nboom"])
+                for i in range(10):
+                    logger.info("record %03d", i)
+                handler.flush()
+            finally:
+                logger.removeHandler(handler)
+                handler.close()
+            texts = [params["text"] for _, params in server.calls[1:]]
+        self.assertEqual("\n".join(texts), "\n".join(f"record {i:03d}" for i in range(10)))
+        self.assertTrue(all(len(text) <= 60 for text in texts))
+        stats = handler.stats()
+        self.assertEqual((stats["deduplicated"], stats["dropped"], stats["pending"]), (2, 0, 0))
+        self.assertEqual(stats["sent"], len(server.calls))
+
+    def test_log_handler_drops_and_spills(self):
+        logger = logging.getLogger("test_tele.spills")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        with tempfile.TemporaryDirectory() as tmp, tele.TelegramClient(api_url="http://127.0.0.1:9", max_retries=0) as client:
+            queue = tele.MessageQueue(os.path.join(tmp, "spill.sqlite"))
+            handler = tele.TelegramLogHandler("bot_token", "chat_token", flush_interval=60, capacity=2, client=client, spill=queue)
+            logger.addHandler(handler)
+            try:
+                for name in ("a", "b", "a", "c"):
+                    logger.info(name)
+                with patch('builtins.print'):
+                    handler.flush()
+            finally:
+                logger.removeHandler(handler)
+                handler.close()
+            [item] = queue.claim()
+            queue.close()
+        self.assertEqual(item["message"], "a x2\nb\n... 1 log records dropped")
+        self.assertEqual({k: handler.stats()[k] for k in ("dropped", "spilled", "sent")}, {"dropped": 1, "spilled": 1, "sent": 0})
+        broken_spill = MagicMock()
+        broken_spill.enqueue_message.side_effect = OSError("disk full")
+        with tele.TelegramClient(api_url="http://127.0.0.1:9", max_retries=0) as client:
+            handler = tele.TelegramLogHandler("bot_token", "chat_token", flush_interval=60, client=client, spill=broken_spill)
+            handler.emit(logging.makeLogRecord({"msg": "lost", "levelno": logging.INFO}))
+            handler.close()
+        self.assertEqual({k: handler.stats()[k] for k in ("spilled", "failed", "errors")}, {"spilled": 0, "failed": 1, "errors": 1})
+
+    def test_send_telegram_live_edits_and_rolls_over(self):
+        lines = [f"line {i:02d}" for i in range(60)]
+        read_fd, write_fd = os.pipe()
+
+        def write():
+            with os.fdopen(write_fd, "w") as f:
+                for line in lines:
+                    f.write(line + "\n")
+                    f.flush()
+                    time.sleep(0.005)
+
+        limiter = tele.RateLimiter(chat_rate=1000, chat_burst=1000)
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url, rate_limiter=limiter) as client, \
+                os.fdopen(read_fd) as stream:
+            threading.Thread(target=write).start()
+            self.assertTrue(tele.send_telegram_live("bot_token", "chat_token", stream, client, min_interval=0.1, chunk_size=100))
+        texts = {}
+        for method, params in server.calls:
+            message_id = params.get("message_id") or str(len(texts) + 1)
+            texts[message_id] = params["text"]
+        self.assertEqual("\n".join(texts.values()).split("\n"), lines)
+        self.assertTrue(all(len(text) <= 100 for text in texts.values()))
+        methods = [method for method, _ in server.calls]
+        self.assertIn("editMessageText", methods)
+        self.assertEqual(methods.count("sendMessage"), len(texts))
+        self.assertLess(len(methods), len(lines) // 2)
+
+    @patch('tele.send_telegram_live')
+    def test_main_stdin_follow(self, mock_live):
+        tele.main(['--bot_token', 'bot_token', '--chat_token', 'chat_token', '--stdin-follow', '--edit_interval', '2'])
+        mock_live.assert_called_once_with('bot_token', 'chat_token', sys.stdin, min_interval=2.0)
+
+    def test_send_telegram_recovers_from_injected_flood(self):
+        limiter = tele.RateLimiter(chat_rate=1000, chat_burst=1000)
+        with FakeTelegramServer(flood_every=2, retry_after=0.01) as server, \
+                tele.TelegramClient(api_url=server.url, rate_limiter=limiter) as client:
+            with patch('builtins.print'):
+                self.assertTrue(tele.send_telegram("bot_token", "chat_token", "a" * 10000, client))
+            self.assertEqual(len(server.calls), 3)
+            self.assertEqual(server.rate_limited, 2)
+        self.assertEqual(limiter.stats()["rate_limited"], 2)
+
+    def test_api_hooks_see_every_call(self):
+        events = []
+        metrics = tele.ApiMetrics(buckets=[0.001, 10])
+        tele.add_api_hook(events.append)
+        tele.add_api_hook(metrics)
+        try:
+            limiter = tele.RateLimiter(chat_rate=1000, chat_burst=1000)
+            with FakeTelegramServer(flood_every=2, retry_after=0.01) as server, \
+                    tele.TelegramClient(api_url=server.url, rate_limiter=limiter) as client, \
+                    tempfile.TemporaryDirectory() as tmp:
+                self.assertTrue(tele.send_telegram("bot_token", "chat_token", "hi", client))
+                self.assertTrue(tele.send_telegram("bot_token", "chat_token", "again", client))
+                path = os.path.join(tmp, "doc.txt")
+                with open(path, "wb") as f:
+                    f.write(b"x" * 5000)
+                sender = tele.AsyncSender(api_url=server.url, rate_limiter=limiter)
+                self.assertTrue(tele.send_telegram_file("bot_token", "chat_token", path, sender=sender))
+                sender.close()
+        finally:
+            tele.remove_api_hook(events.append)
+            tele.remove_api_hook(metrics)
+        self.assertEqual([(e["method"], e["outcome"], e["retries"]) for e in events],
+                         [("sendMessage", "ok", 0), ("sendMessage", "rate_limited", 0), ("sendMessage", "ok", 1),
+                          ("sendDocument", "rate_limited", 0), ("sendDocument", "ok", 1)])
+        self.assertEqual({e["chat_id"] for e in events}, {"chat_token"})
+        self.assertGreater(events[-1]["bytes_sent"], 5000)
+        self.assertTrue(all(e["bytes_received"] > 0 and e["latency"] > 0 for e in events))
+        text = metrics.prometheus_text()
+        self.assertIn('tele_api_request_duration_seconds_bucket{method="sendMessage",outcome="ok",le="+Inf"} 2', text)
+        self.assertIn('tele_api_request_duration_seconds_count{method="sendMessage",outcome="rate_limited"} 1', text)
+        self.assertIn('tele_api_retries_total{method="sendMessage",outcome="ok"} 1', text)
+        self.assertIn("# TYPE tele_api_request_duration_seconds histogram", text)
+        self.assertEqual([(s["method"], s["outcome"], s["count"]) for s in metrics.snapshot()],
+                         [("sendDocument", "ok", 1), ("sendDocument", "rate_limited", 1),
+                          ("sendMessage", "ok", 2), ("sendMessage", "rate_limited", 1)])
+
+    def test_logging_can_be_silenced(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+            with self.assertLogs("tele", logging.INFO) as logs:
+                tele.send_telegram("bot_token", "chat_token", "hi", client)
+            self.assertEqual(logs.output, ["INFO:tele:Sending to chat_token: hi"])
+            records = []
+            handler = logging.Handler()
+            handler.emit = records.append
+            tele.logger.addHandler(handler)
+            tele.logger.setLevel(logging.WARNING)
+            try:
+                with patch('builtins.print') as mock_print:
+                    tele.send_telegram("bot_token", "chat_token", "hi", client)
+            finally:
+                tele.logger.setLevel(logging.NOTSET)
+                tele.logger.removeHandler(handler)
+            self.assertEqual(records, [])
+            mock_print.assert_not_called()
+
+    def test_main_message_is_one_request_without_asyncio(self):
+        import subprocess
+        probe = "import sys, tele; tele.main(sys.argv[1:]); print('asyncio' in sys.modules, 'telegram' in sys.modules)"
+        with FakeTelegramServer() as server:
+            result = subprocess.run(
+                [sys.executable, "-c", probe, "--bot_token", "bot_token", "--chat_token", "chat_token", "--message", "hi"],
+                env=dict(os.environ, TELEGRAM_API_URL=server.url), capture_output=True, text=True, check=True)
+            self.assertEqual(server.calls, [("sendMessage", {"chat_id": "chat_token", "text": "hi"})])
+        self.assertEqual(result.stdout.splitlines()[-1], "False False")
+
+    def test_daemon_socket_is_owner_only(self):
+        import stat
+        with tempfile.TemporaryDirectory() as tmp:
+            umask = os.umask(0)
+            try:
+                daemon = tele.TeleDaemon(os.path.join(tmp, "tele.sock"))
+            finally:
+                os.umask(umask)
+            try:
+                self.assertEqual(stat.S_IMODE(os.stat(daemon.path).st_mode), 0o600)
+                self.assertEqual(os.umask(umask), umask)
+                self.assertEqual(os.listdir(tmp), ["tele.sock"])
+            finally:
+                daemon.stop()
+
+    def test_daemon_keeps_files_that_are_not_sockets(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "notes.txt")
+            with open(path, "w") as f:
+                f.write("keep me")
+            with self.assertRaises(FileExistsError):
+                tele.TeleDaemon(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), "keep me")
+
+    def test_daemon_serves_requests(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp:
+            server.add_file("FILE", b"data", "documents/file.txt")
+            socket_path = os.path.join(tmp, "tele.sock")
+            daemon = tele.TeleDaemon(socket_path, client=client).start()
+            try:
+                with patch('builtins.print'), tele.DaemonClient(socket_path) as daemon_client:
+                    response = daemon_client.send_message("bot_token", "chat_token", "hi")
+                    self.assertTrue(response["ok"])
+                    self.assertTrue(response["result"])
+                    self.assertGreater(response["latency_ms"], 0)
+                    response = daemon_client.fetch("bot_token", ["FILE"], tmp)
+                    self.assertEqual(response["result"], {"FILE": os.path.join(tmp, "FILE.txt")})
+                    response = daemon_client.request("unknown")
+                    self.assertFalse(response["ok"])
+                    self.assertIn("unknown op", response["error"])
+                    stats = daemon_client.stats()["result"]
+                    self.assertEqual(stats["message"]["count"], 1)
+                    self.assertEqual(stats["fetch"]["count"], 1)
+            finally:
+                daemon.stop()
+            self.assertFalse(os.path.exists(socket_path))
+            self.assertEqual([method for method, _ in server.calls], ["sendMessage", "getFile"])
+
+    def test_main_forwards_to_daemon(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp:
+            socket_path = os.path.join(tmp, "tele.sock")
+            daemon = tele.TeleDaemon(socket_path, client=client).start()
+            try:
+                with patch('builtins.print') as mock_print:
+                    tele.main(['--socket', socket_path, '--bot_token', 'bot_token', '--chat_token', 'chat_token', '--message', 'hi'])
+            finally:
+                daemon.stop()
+            self.assertEqual(server.calls, [("sendMessage", {"chat_id": "chat_token", "text": "hi"})])
+            response = json.loads(mock_print.call_args_list[-1][0][0])
+            self.assertTrue(response["ok"])
+
+    def test_interactive_bot_webhook(self):
+        import http.client
+        replied = []
+
+        async def ping(update, context):
+            await update.message.reply_text("pong")
+            replied.append(update.message.chat_id)
+
+        def post(address, secret, update):
+            connection = http.client.HTTPConnection(*address)
+            connection.request("POST", "/telegram", json.dumps(update), {"X-Telegram-Bot-Api-Secret-Token": secret})
+            status = connection.getresponse().status
+            connection.close()
+            return status
+
+        async def scenario(server):
+            bot = tele.InteractiveBot("1:a", {"ping": ping}, api_url=server.url)
+            await bot.start_webhook(port=0, secret_token="s3cret")
+            try:
+                statuses = [
+                    await asyncio.to_thread(post, bot.webhook_address, "wrong", {"update_id": 1, **command_message("/ping", 7)}),
+                    await asyncio.to_thread(post, bot.webhook_address, "s3cret", {"update_id": 2, **command_message("/ping", 8)}),
+                ]
+                for _ in range(100):
+                    if replied:
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                await bot.stop()
+            return statuses
+
+        with FakeTelegramServer() as server:
+            self.assertEqual(asyncio.run(scenario(server)), [403, 200])
+            self.assertEqual(replied, [8])
+            self.assertEqual([method for method, _ in server.calls], ["getMe", "sendMessage"])
+
+    def test_interactive_bot_orders_updates_per_chat(self):
+        from telegram import Update
+        events = []
+
+        async def slow(update, context):
+            events.append(("start", update.message.chat_id, update.message.message_id))
+            await asyncio.sleep(0.1)
+            events.append(("end", update.message.chat_id, update.message.message_id))
+
+        async def hang(update, context):
+            await asyncio.sleep(10)
+
+        async def fail(update, context):
+            raise ValueError("boom")
+
+        def render(update, context):
+            events.append(("thread", threading.current_thread() is threading.main_thread()))
+
+        async def scenario(server):
+            bot = tele.InteractiveBot("1:a", {"slow": slow, "hang": hang, "fail": fail, "render": render}, api_url=server.url,
+                                      concurrent_updates=4, handler_timeout=0.5)
+            await bot.start_webhook(port=0)
+            try:
+                updates = [("/slow", 1, 1), ("/slow", 1, 2), ("/slow", 2, 3), ("/hang", 3, 4), ("/fail", 4, 5), ("/render", 5, 6)]
+                for update_id, (text, chat_id, message_id) in enumerate(updates, 1):
+                    body = {"update_id": update_id, **command_message(text, chat_id, message_id)}
+                    await bot.application.update_queue.put(Update.de_json(body, bot.application.bot))
+                for _ in range(200):
+                    metrics = bot.metrics()
+                    if metrics["handled"] + metrics["timed_out"] + metrics["failed"] == len(updates):
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertEqual(await bot.offload(pow, 2, 10), 1024)
+                self.assertEqual(await bot.offload(pow, 2, 10, process=True), 1024)
+            finally:
+                with patch('builtins.print'):
+                    await bot.stop()
+            return metrics
+
+        with FakeTelegramServer() as server, patch('builtins.print'):
+            metrics = asyncio.run(scenario(server))
+        slow_events = [event for event in events if event[0] != "thread"]
+        # Chat 2 runs alongside chat 1, chat 1's second update waits for its first.
+        self.assertEqual(slow_events[:2], [("start", 1, 1), ("start", 2, 3)])
+        self.assertLess(slow_events.index(("end", 1, 1)), slow_events.index(("start", 1, 2)))
+        self.assertIn(("thread", False), events)
+        self.assertEqual((metrics["handled"], metrics["timed_out"], metrics["failed"]), (4, 1, 1))
+        self.assertEqual(metrics["durations"]["slow"]["count"], 3)
+        self.assertEqual((metrics["waiting"], metrics["running"]), (0, 0))
+
+    def test_default_client_is_shared(self):
+        tele.set_default_client(None)
+        self.assertIs(tele.get_default_client(), tele.get_default_client())
+        client = tele.TelegramClient()
+        tele.set_default_client(client)
+        self.assertIs(tele.get_default_client(), client)
+        tele.set_default_client(None)
+
+    def test_default_sender_is_created_once_across_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        tele.set_default_sender(None)
+
+        def slow_sender():
+            time.sleep(0.05)
+            return MagicMock()
+
+        with patch('tele.AsyncSender', side_effect=slow_sender) as mock_sender, patch('atexit.register'):
+            with ThreadPoolExecutor(4) as pool:
+                senders = list(pool.map(lambda _: tele.get_default_sender(), range(4)))
+        tele.set_default_sender(None)
+        self.assertEqual(mock_sender.call_count, 1)
+        self.assertTrue(all(sender is senders[0] for sender in senders))
+
+    def test_file_id_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = tele.FileIdCache(os.path.join(tmp, "ids.sqlite"), max_entries=2)
+            cache.put("1:a", "photo", "d1", "id1")
+            self.assertEqual(cache.get("1:a", "photo", "d1"), "id1")
+            self.assertIsNone(cache.get("1:a", "document", "d1"))
+            self.assertIsNone(cache.get("2:b", "photo", "d1"))
+            cache.put("1:a", "photo", "d2", "id2")
+            cache.get("1:a", "photo", "d1")
+            cache.put("1:a", "photo", "d3", "id3")
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get("1:a", "photo", "d2"))
+            cache.max_age = -1
+            self.assertIsNone(cache.get("1:a", "photo", "d1"))
+            cache.close()
+
+    def test_send_media_resends_by_file_id(self):
+        from telegram.error import BadRequest
+        sent = []
+
+        async def send_photo(**kwargs):
+            photo = kwargs['photo']
+            sent.append(photo if isinstance(photo, str) else "upload")
+            if photo == "stale":
+                raise BadRequest("Wrong file identifier")
+            if kwargs['chat_id'] == "gone":
+                raise BadRequest("Chat not found")
+            return MagicMock(photo=(MagicMock(file_id="small"), MagicMock(file_id=f"id{len(sent)}")))
+
+        bot = MagicMock()
+        bot.send_photo = send_photo
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = tele.FileIdCache(os.path.join(tmp, "ids.sqlite"))
+            sender = tele.AsyncSender(file_id_cache=cache, rate_limiter=tele.RateLimiter(chat_burst=10))
+            path = os.path.join(tmp, "logo.png")
+            with open(path, "wb") as f:
+                f.write(b"png")
+            with patch.object(tele.AsyncSender, 'get_bot', return_value=bot), patch('builtins.print'):
+                for _ in range(2):
+                    sender.run(tele.send_telegram_image("1:a", "chat_token", path, sender=sender))
+                self.assertEqual(sent, ["upload", "id1"])
+                cache.put("1:a", "photo", tele.file_digest(path), "stale")
+                sender.run(tele.send_telegram_image("1:a", "chat_token", path, sender=sender))
+            self.assertEqual(sent, ["upload", "id1", "stale", "upload"])
+            self.assertEqual(cache.get("1:a", "photo", tele.file_digest(path)), "id4")
+            # Errors that are not about the file_id neither evict it nor upload the file again.
+            with patch.object(tele.AsyncSender, 'get_bot', return_value=bot):
+                self.assertFalse(sender.run(tele.send_telegram_image("1:a", "gone", path, sender=sender)))
+            self.assertEqual(sent[4:], ["id4"])
+            self.assertEqual(cache.get("1:a", "photo", tele.file_digest(path)), "id4")
+            sender.close()
+            cache.close()
+
+    def test_rate_limiter_buckets(self):
+        limiter = tele.RateLimiter(global_rate=30, chat_rate=1, chat_burst=2, group_rate=20 / 60, group_burst=1)
+        self.assertEqual(limiter.reserve("bot", "1"), 0)
+        self.assertEqual(limiter.reserve("bot", "1"), 0)
+        self.assertAlmostEqual(limiter.reserve("bot", "1"), 1, places=1)
+        self.assertEqual(limiter.reserve("bot", "2"), 0)
+        self.assertEqual(limiter.reserve("bot", "-100"), 0)
+        self.assertAlmostEqual(limiter.reserve("bot", "-100"), 3, places=1)
+        limiter.pause("bot", "3", 5)
+        self.assertAlmostEqual(limiter.reserve("bot", "3"), 5, places=1)
+        self.assertEqual(limiter.stats(), {"throttled": 3, "rate_limited": 1, "retried": 0, "failed": 0})
+
+    @patch('tele.time.sleep')
+    @patch.object(tele.TelegramClient, 'post')
+    def test_send_telegram_retries_after_flood_control(self, mock_post, mock_sleep):
+        flooded = MagicMock(status_code=429)
+        flooded.json.return_value = {"ok": False, "error_code": 429, "parameters": {"retry_after": 7}}
+        broken = MagicMock(status_code=502)
+        mock_post.side_effect = [flooded, broken, MagicMock(status_code=200)]
+        limiter = tele.RateLimiter()
+        client = tele.TelegramClient(rate_limiter=limiter)
+        tele.send_telegram("bot_token", "chat_token", "test message", client)
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertIn(call(7.0), mock_sleep.call_args_list)
+        self.assertEqual(limiter.stats()["retried"], 2)
+        self.assertEqual(limiter.stats()["rate_limited"], 1)
+
+    def test_send_media_retries_after_flood_control(self):
+        from telegram.error import RetryAfter
+        attempts = []
+
+        async def send_document(**kwargs):
+            attempts.append(kwargs['document'].read())
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+
+        bot = MagicMock()
+        bot.send_document = send_document
+        limiter = tele.RateLimiter(chat_rate=100)
+        sender = tele.AsyncSender(rate_limiter=limiter)
+        with tempfile.TemporaryDirectory() as tmp, patch.object(tele.AsyncSender, 'get_bot', return_value=bot), \
+                patch('builtins.print'):
+            path = os.path.join(tmp, "report.pdf")
+            with open(path, "wb") as f:
+                f.write(b"pdf")
+            tele.send_telegram_file("bot_token", "chat_token", path, sender=sender)
+        sender.close()
+        self.assertEqual(attempts, [b"pdf", b"pdf"])
+        self.assertEqual(limiter.stats()["retried"], 1)
+
+    def test_message_queue_priority_and_redelivery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "queue.sqlite")
+            queue = tele.MessageQueue(path, lease=0.1)
+            low = queue.enqueue_message("bot_token", "chat_token", "low")
+            high = queue.enqueue_message("bot_token", "chat_token", "high", priority=5)
+            queue.enqueue_file("bot_token", "chat_token", "report.pdf", priority=1)
+            batch = queue.claim(2)
+            self.assertEqual([item["id"] for item in batch], [high, 3])
+            self.assertEqual(batch[1]["filename"], os.path.abspath("report.pdf"))
+            stats = queue.stats()
+            self.assertEqual((stats["depth"], stats["in_flight"], stats["dead"]), (3, 2, 0))
+            queue.ack([high])
+            # The worker holding the file "crashes", its lease expires and it is delivered again.
+            queue.close()
+            time.sleep(0.15)
+            queue = tele.MessageQueue(path, lease=0.1)
+            self.assertEqual([item["id"] for item in queue.claim(10)], [3, low])
+            self.assertGreaterEqual(queue.stats()["oldest_age"], 0.15)
+            queue.close()
+
+    def test_queue_uses_module_media_types(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = tele.MessageQueue(os.path.join(tmp, "queue.sqlite"))
+            with self.assertRaises(ValueError):
+                queue.enqueue_file("bot_token", "chat_token", "chart.bin", media="image")
+            queue.enqueue_file("bot_token", "chat_token", "chart.bin", media="photo")
+            [item] = queue.claim()
+            queue.close()
+        sender = MagicMock()
+        worker = tele.QueueWorker(queue, sender=sender)
+        with patch('tele.send_telegram_image') as mock_send_image:
+            worker._send(item)
+            # Items spooled under the old name are still sent as photos.
+            worker._send(dict(item, media="image"))
+        self.assertEqual(mock_send_image.call_count, 2)
+        self.assertEqual(mock_send_image.call_args[0][:3], ("bot_token", "chat_token", item["filename"]))
+
+    def test_queue_worker_delivers_and_retries(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp, patch('builtins.print'):
+            queue = tele.MessageQueue(os.path.join(tmp, "queue.sqlite"), max_attempts=1)
+            for i in range(3):
+                queue.enqueue_message("bot_token", str(i), f"message {i}")
+            queue.enqueue_file("bot_token", "chat_token", os.path.join(tmp, "missing.pdf"))
+            worker = tele.QueueWorker(queue, workers=2, poll_interval=0.01, client=client).start()
+            deadline = time.monotonic() + 5
+            while queue.stats()["depth"] > 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            worker.stop()
+            self.assertEqual(sorted(params["text"] for _, params in server.calls), ["message 0", "message 1", "message 2"])
+            self.assertEqual(queue.stats()["dead"], 1)
+            queue.close()
+
+    @patch('tele.get_telegram_updates', return_value={"ok": True, "result": []})
+    def test_main_queue(self, mock_get_updates):
+        with tempfile.TemporaryDirectory() as tmp, patch('builtins.print') as mock_print:
+            path = os.path.join(tmp, "queue.sqlite")
+            tele.main(['--message', 'queued', '--bot_token', 'bot_token', '--chat_token', 'chat_token', '--queue', path])
+            tele.main(['--document', 'a.pdf', 'b.pdf', '--bot_token', 'bot_token', '--chat_token', 'chat_token', '--queue', path, '--queue_stats'])
+            self.assertEqual(json.loads(mock_print.call_args[0][0])["depth"], 3)
+            queue = tele.MessageQueue(path)
+            self.assertEqual([item.get("message", item.get("media")) for item in queue.claim(10)], ["queued", "document", "document"])
+            queue.close()
+
+    @patch.object(tele.TelegramClient, 'get')
     def test_get_telegram_file(self, mock_get):
         mock_response = MagicMock()
         mock_response.json.return_value = {
@@ -49,16 +702,117 @@ class TestTele(unittest.TestCase):
             }
         }
         mock_response.status_code = 200
-        mock_response.content = b"file content"
+        mock_response.headers = {}
+        mock_response.iter_content.return_value = [b"file ", b"content"]
         mock_get.return_value = mock_response
 
-        with patch('builtins.open', unittest.mock.mock_open()) as mock_open:
-            filename = tele.get_telegram_file("bot_token", "chat_token", "file_id", ".")
+        with tempfile.TemporaryDirectory() as tmp, patch('builtins.print'):
+            filename = tele.get_telegram_file("bot_token", "chat_token", "file_id", tmp)
             self.assertTrue(filename.endswith(".jpg"))
-            mock_open.assert_called_once()
+            with open(os.path.join(tmp, filename), "rb") as f:
+                self.assertEqual(f.read(), b"file content")
+            self.assertEqual(os.listdir(tmp), [filename])
+
+    def test_get_telegram_file_resumes_partial_download(self):
+        data = os.urandom(200000)
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp, patch('builtins.print'):
+            server.add_file("file_id", data, "videos/clip.mp4", "unique")
+            with open(os.path.join(tmp, ".unique.mp4.part"), "wb") as f:
+                f.write(data[:50000])
+            progress = []
+            filename = tele.get_telegram_file("bot_token", "", "file_id", tmp, client,
+                                              progress=lambda done, total: progress.append((done, total)),
+                                              sha256=hashlib.sha256(data).hexdigest())
+            with open(os.path.join(tmp, filename), "rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(progress[-1], (len(data), len(data)))
+            self.assertGreater(progress[0][0], 50000)
+            self.assertEqual(os.listdir(tmp), [filename])
+
+    def test_download_discards_stale_part_file(self):
+        data = os.urandom(1000)
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp:
+            server.add_file("file_id", data, "documents/new.bin", "new")
+            out_path = os.path.join(tmp, "new.bin")
+            # Left over from a longer file, so the range starts past the end of this one.
+            with open(out_path + ".part", "wb") as f:
+                f.write(os.urandom(3000))
+            self.assertTrue(client.download(client.file_url("bot_token", "documents/new.bin"), out_path))
+            with open(out_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            with open(os.path.join(tmp, ".new.bin.part"), "wb") as f:
+                f.write(os.urandom(3000))
+            os.remove(out_path)
+            self.assertEqual(tele.get_telegram_file("bot_token", "", "file_id", tmp, client), "new.bin")
+            with open(out_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(sorted(os.listdir(tmp)), ["new.bin"])
+
+    def test_get_telegram_file_checksum_mismatch(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp, patch('builtins.print'):
+            server.add_file("file_id", b"contents")
+            self.assertEqual(tele.get_telegram_file("bot_token", "", "file_id", tmp, client, sha256="00"), "")
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_get_telegram_files_deduplicates(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp, patch('builtins.print'):
+            server.add_file("a1", b"aaa", "photos/a.jpg", "A")
+            server.add_file("a2", b"aaa", "photos/a.jpg", "A")
+            server.add_file("b", b"bbb", "documents/b.pdf", "B")
+            server.add_file("c", b"ccc", "documents/c.txt", "C")
+            with open(os.path.join(tmp, "C.txt"), "wb") as f:
+                f.write(b"ccc")
+            paths = tele.get_telegram_files("bot_token", ["a1", "a2", "b", "c", "missing", "b"], tmp, client)
+            self.assertEqual(paths, {
+                "a1": os.path.join(tmp, "A.jpg"),
+                "a2": os.path.join(tmp, "A.jpg"),
+                "b": os.path.join(tmp, "B.pdf"),
+                "c": os.path.join(tmp, "C.txt"),
+                "missing": "",
+            })
+            self.assertEqual(sorted(server.downloads), ["documents/b.pdf", "photos/a.jpg"])
+
+    def test_get_telegram_files_isolates_failures(self):
+        import requests
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp:
+            server.add_file("a", b"aaa", "photos/a.jpg", "A")
+            server.add_file("b", b"bbb", "documents/b.pdf", "B")
+            server.add_file("c", b"ccc", "documents/c.txt", "C")
+            get, download = client.get, client.download
 
-    @patch('requests.get')
-    def test_get_telegram_file_error(self, mock_get):
+            def flaky_get(url, **kwargs):
+                if url.endswith("file_id=b"):
+                    response = requests.Response()
+                    response.status_code = 502
+                    response._content = b"<html>Bad Gateway</html>"
+                    return response
+                return get(url, **kwargs)
+
+            def flaky_download(url, *args, **kwargs):
+                if url.endswith("c.txt"):
+                    raise requests.ConnectionError("connection reset")
+                return download(url, *args, **kwargs)
+
+            with patch.object(client, "get", flaky_get), patch.object(client, "download", flaky_download):
+                paths = tele.get_telegram_files("bot_token", ["a", "b", "c"], tmp, client)
+            self.assertEqual(paths, {"a": os.path.join(tmp, "A.jpg"), "b": "", "c": ""})
+
+    @patch('tele.get_telegram_updates', return_value={"ok": True, "result": []})
+    @patch('tele.get_telegram_files', return_value={"a": "./A.jpg", "b": ""})
+    def test_main_fetch(self, mock_get_files, mock_get_updates):
+        with patch('builtins.print'):
+            tele.main(['--fetch', 'a', 'b', '--fetch_dir', 'out', '--bot_token', 'bot_token'])
+        mock_get_files.assert_called_with("bot_token", ["a", "b"], "out", max_workers=4)
+
+    @patch.object(tele.TelegramClient, 'post')
+    @patch.object(tele.TelegramClient, 'get')
+    def test_get_telegram_file_error(self, mock_get, mock_post):
+        mock_post.return_value.status_code = 200
         mock_response = MagicMock()
         # Simulate Telegram API error response
         mock_response.json.return_value = {"ok": False, "description": "Bad Request"}
@@ -68,8 +822,9 @@ class TestTele(unittest.TestCase):
         with patch('builtins.print'):
             filename = tele.get_telegram_file("bot_token", "chat_token", "bad_file_id", ".")
             self.assertEqual(filename, "")
+        self.assertEqual(mock_post.call_args[1]['data']['text'], "Error getting image")
 
-    @patch('requests.get')
+    @patch.object(tele.TelegramClient, 'get')
     def test_get_telegram_updates(self, mock_get):
         mock_response = MagicMock()
         mock_response.json.return_value = {"ok": True, "result": []}
@@ -79,27 +834,27 @@ class TestTele(unittest.TestCase):
         self.assertEqual(updates, {"ok": True, "result": []})
         mock_get.assert_called_with("https://api.telegram.org/botbot_token/getUpdates")
 
-    @patch('tele.asyncio.run')
+    @patch.object(tele.AsyncSender, 'run')
     def test_send_telegram_file_image(self, mock_asyncio_run):
         tele.send_telegram_file("bot_token", "chat_token", "image.jpg")
         mock_asyncio_run.assert_called()
 
-    @patch('tele.asyncio.run')
+    @patch.object(tele.AsyncSender, 'run')
     def test_send_telegram_file_video(self, mock_asyncio_run):
         tele.send_telegram_file("bot_token", "chat_token", "video.mp4")
         mock_asyncio_run.assert_called()
 
-    @patch('tele.asyncio.run')
+    @patch.object(tele.AsyncSender, 'run')
     def test_send_telegram_file_audio(self, mock_asyncio_run):
         tele.send_telegram_file("bot_token", "chat_token", "audio.mp3")
         mock_asyncio_run.assert_called()
     
-    @patch('tele.asyncio.run')
+    @patch.object(tele.AsyncSender, 'run')
     def test_send_telegram_file_animation(self, mock_asyncio_run):
         tele.send_telegram_file("bot_token", "chat_token", "animation.gif")
         mock_asyncio_run.assert_called()
 
-    @patch('tele.asyncio.run')
+    @patch.object(tele.AsyncSender, 'run')
     def test_send_telegram_file_document(self, mock_asyncio_run):
         tele.send_telegram_file("bot_token", "chat_token", "document.txt")
         mock_asyncio_run.assert_called()
@@ -125,7 +880,7 @@ class TestTele(unittest.TestCase):
         # So we need to mock asyncio.run inside main, OR make our mock awaitable.
         pass
 
-    @patch('tele.asyncio.run')
+    @patch.object(tele.AsyncSender, 'run')
     @patch('tele.get_telegram_updates', return_value={"ok": True, "result": []})
     @patch('tele.send_telegram_file')
     @patch('tele.send_telegram_image')
@@ -141,17 +896,218 @@ class TestTele(unittest.TestCase):
         mock_send_image.assert_called_with("bot_token", "chat_token", "test.jpg", "test.jpg", timeout=60)
         mock_send_file.assert_not_called()
 
+    @patch.object(tele.AsyncSender, 'run')
     @patch('tele.get_telegram_updates', return_value={"ok": True, "result": []})
-    @patch('tele.send_telegram_file')
-    def test_main_with_file(self, mock_send_file, mock_get_updates):
+    @patch('tele.send_telegram_document')
+    def test_main_with_file(self, mock_send_document, mock_get_updates, mock_run):
         tele.main(['--file', 'test.txt', '--bot_token', 'bot_token', '--chat_token', 'chat_token'])
-        mock_send_file.assert_called_with("bot_token", "chat_token", "test.txt", "test.txt", timeout=360)
+        mock_send_document.assert_called_with("bot_token", "chat_token", "test.txt", "test.txt", timeout=360)
+        mock_run.assert_called_once()
+
+    def test_async_sender_reuses_loop_and_bot(self):
+        sender = tele.AsyncSender()
+
+        async def current():
+            return asyncio.get_running_loop(), sender.get_bot("123:abc")
+
+        first_loop, first_bot = sender.run(current())
+        second_loop, second_bot = sender.run(current())
+        self.assertIs(first_loop, second_loop)
+        self.assertIs(first_bot, second_bot)
+        sender.close()
+
+    def test_send_telegram_files_bounded_concurrency(self):
+        sender = tele.AsyncSender(max_concurrent_uploads=2, rate_limiter=tele.RateLimiter(chat_burst=10))
+        active = []
+        peak = []
 
-    @patch('tele.asyncio.run')
+        async def send_photo(**kwargs):
+            active.append(kwargs['caption'])
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.remove(kwargs['caption'])
+
+        bot = MagicMock()
+        bot.send_photo = send_photo
+        with tempfile.TemporaryDirectory() as tmp, patch.object(tele.AsyncSender, 'get_bot', return_value=bot):
+            paths = []
+            for i in range(5):
+                paths.append(os.path.join(tmp, f"{i}.jpg"))
+                with open(paths[-1], "wb") as f:
+                    f.write(b"jpg")
+            with patch('builtins.print'):
+                tele.send_telegram_files("bot_token", "chat_token", paths, sender=sender)
+        sender.close()
+        self.assertEqual(len(peak), 5)
+        self.assertEqual(max(peak), 2)
+
+    def test_group_album_items(self):
+        types = ['photo'] * 12 + ['video', 'animation', 'animation', 'audio', 'audio', 'document', 'photo']
+        self.assertEqual(tele.group_album_items(types), [
+            list(range(10)), [10, 11, 12], [13], [14], [15, 16], [17], [18],
+        ])
+
+    def test_send_telegram_album(self):
+        sender = tele.AsyncSender(rate_limiter=tele.RateLimiter(chat_burst=10))
+        albums = []
+        singles = []
+
+        async def send_media_group(**kwargs):
+            albums.append([(type(m).__name__, m.caption) for m in kwargs['media']])
+            return [MagicMock(photo=(MagicMock(file_id=f"id{i}"),)) for i in range(len(kwargs['media']))]
+
+        async def send_animation(**kwargs):
+            singles.append(kwargs['caption'])
+
+        bot = MagicMock()
+        bot.send_media_group = send_media_group
+        bot.send_animation = send_animation
+        with tempfile.TemporaryDirectory() as tmp, patch.object(tele.AsyncSender, 'get_bot', return_value=bot):
+            paths = []
+            for name in ["0.jpg", "1.mp4", "2.gif", "3.png", "4.png"]:
+                paths.append(os.path.join(tmp, name))
+                with open(paths[-1], "wb") as f:
+                    f.write(name.encode())
+            with patch('builtins.print'):
+                sent = tele.send_telegram_files("bot_token", "chat_token", paths, sender=sender, albums=True)
+        sender.close()
+        self.assertEqual(sent, [True] * 5)
+        self.assertEqual(albums, [
+            [("InputMediaPhoto", "0.jpg"), ("InputMediaVideo", "1.mp4")],
+            [("InputMediaPhoto", "3.png"), ("InputMediaPhoto", "4.png")],
+        ])
+        self.assertEqual(singles, ["2.gif"])
+
+    def test_broadcast_uploads_once(self):
+        from telegram.error import BadRequest
+        sender = tele.AsyncSender(rate_limiter=tele.RateLimiter(chat_burst=10, group_burst=10))
+        photos = []
+        texts = []
+
+        async def send_photo(**kwargs):
+            if kwargs['chat_id'] == "404":
+                raise BadRequest("Chat not found")
+            photo = kwargs['photo']
+            photos.append(photo if isinstance(photo, str) else "upload")
+            await asyncio.sleep(0.01)
+            return MagicMock(photo=(MagicMock(file_id="small"), MagicMock(file_id="id1")))
+
+        async def send_message(**kwargs):
+            texts.append((kwargs['chat_id'], kwargs['text']))
+
+        bot = MagicMock()
+        bot.send_photo = send_photo
+        bot.send_message = send_message
+        chats = ["404", "1", "2", "-100", "3", "1"]
+        with tempfile.TemporaryDirectory() as tmp, patch.object(tele.AsyncSender, 'get_bot', return_value=bot):
+            path = os.path.join(tmp, "chart.png")
+            with open(path, "wb") as f:
+                f.write(b"png")
+            report = tele.broadcast_telegram("bot_token", chats, "alert", [path], sender=sender)
+        sender.close()
+        self.assertEqual(list(report), ["404", "1", "2", "-100", "3"])
+        self.assertEqual(report["404"], {"ok": False, "error": "Chat not found"})
+        self.assertTrue(all(report[chat]["ok"] for chat in ["1", "2", "-100", "3"]))
+        self.assertEqual(sorted(photos), ["id1", "id1", "id1", "upload"])
+        self.assertEqual(len(texts), 5)
+
+    def test_broadcast_reports_missing_file_with_cache(self):
+        bot = MagicMock()
+        with tempfile.TemporaryDirectory() as tmp, patch.object(tele.AsyncSender, 'get_bot', return_value=bot):
+            cache = tele.FileIdCache(os.path.join(tmp, "ids.sqlite"))
+            sender = tele.AsyncSender(file_id_cache=cache)
+            try:
+                report = tele.broadcast_telegram("bot_token", ["1", "2"], "", [os.path.join(tmp, "missing.png")], sender=sender)
+            finally:
+                sender.close()
+                cache.close()
+        self.assertEqual(list(report), ["1", "2"])
+        self.assertFalse(any(result["ok"] for result in report.values()))
+        self.assertIn("missing.png", report["1"]["error"])
+        bot.send_photo.assert_not_called()
+
+    @patch('tele.get_telegram_updates', return_value={"ok": True, "result": []})
+    @patch('tele.broadcast_telegram', return_value={"1": {"ok": True, "error": None}})
+    def test_main_broadcast(self, mock_broadcast, mock_get_updates):
+        with patch('builtins.print') as mock_print:
+            tele.main(['--bot_token', 'bot_token', '--chats', '1', '2', '--image', 'a.jpg', '--message', 'hi'])
+        mock_broadcast.assert_called_with('bot_token', ['1', '2'], "", ['a.jpg'], 'hi', timeout=360)
+        mock_print.assert_called_with(json.dumps({"1": {"ok": True, "error": None}}))
+
+    @patch.object(tele.AsyncSender, 'run')
+    @patch('tele.get_telegram_updates', return_value={"ok": True, "result": []})
+    @patch('tele.send_telegram_album')
+    def test_main_with_images_sends_album(self, mock_send_album, mock_get_updates, mock_run):
+        tele.main(['--image', 'a.jpg', 'b.jpg', '--video', 'c.mp4', '--bot_token', 'bot_token', '--chat_token', 'chat_token'])
+        mock_send_album.assert_called_with("bot_token", "chat_token", ['a.jpg', 'b.jpg', 'c.mp4'], ['a.jpg', 'b.jpg', 'c.mp4'],
+                                           timeout=180, media_types=['photo', 'photo', 'video'])
+
+    def test_iter_telegram_updates_resumes_from_offset_file(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client, \
+                tempfile.TemporaryDirectory() as tmp:
+            offset_file = os.path.join(tmp, "offset")
+            for i in range(3):
+                server.push_update({"message": {"text": str(i)}})
+            seen = []
+            for update in tele.iter_telegram_updates("bot_token", timeout=1, offset_file=offset_file, client=client):
+                seen.append(update["update_id"])
+                if update["update_id"] == 2:
+                    # Stop before update 2 is acknowledged, it must be delivered again.
+                    break
+            with open(offset_file) as f:
+                self.assertEqual(f.read(), "2")
+            for update in tele.iter_telegram_updates("bot_token", timeout=1, offset_file=offset_file, client=client):
+                seen.append(update["update_id"])
+                if update["update_id"] == 3:
+                    break
+            self.assertEqual(seen, [1, 2, 2, 3])
+
+    def test_iter_telegram_updates_long_polls(self):
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+            server.push_update({"edited_message": {"text": "skipped"}})
+            threading.Timer(0.2, server.push_update, [{"message": {"text": "late"}}]).start()
+            start = time.monotonic()
+            update = next(tele.iter_telegram_updates("bot_token", timeout=10, allowed_updates=["message"], client=client))
+            self.assertEqual(update["message"]["text"], "late")
+            self.assertLess(time.monotonic() - start, 5)
+            method, params = server.calls[-1]
+            self.assertEqual((method, params["timeout"], params["allowed_updates"]), ("getUpdates", "10", '["message"]'))
+
+    def test_aiter_telegram_updates(self):
+        async def first_two(client):
+            seen = []
+            async for update in tele.aiter_telegram_updates("bot_token", timeout=1, client=client):
+                seen.append(update["message"]["text"])
+                if len(seen) == 2:
+                    break
+            return seen
+
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+            server.push_update({"message": {"text": "a"}})
+            server.push_update({"message": {"text": "b"}})
+            self.assertEqual(asyncio.run(first_two(client)), ["a", "b"])
+
+    def test_aiter_telegram_updates_can_be_cancelled(self):
+        async def cancel_waiting(client):
+            updates = tele.aiter_telegram_updates("bot_token", timeout=1, client=client)
+            task = asyncio.ensure_future(updates.__anext__())
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await updates.aclose()
+
+        with FakeTelegramServer() as server, tele.TelegramClient(api_url=server.url) as client:
+            start = time.monotonic()
+            asyncio.run(cancel_waiting(client))
+            self.assertLess(time.monotonic() - start, 5)
+
+    @patch('asyncio.run')
     @patch('telegram.Bot')
     def test_telegram_set_commands(self, mock_bot_cls, mock_asyncio_run):
         mock_bot = MagicMock()
         mock_bot_cls.return_value = mock_bot
+        mock_asyncio_run.side_effect = lambda coroutine: coroutine.close()
         # Mock the async method set_my_commands. 
         # Since it's awaited in the source, we need to handle it.
         # But here asyncio.run is mocked, so we just check if the coroutine was created/passed.
@@ -160,11 +1116,25 @@ class TestTele(unittest.TestCase):
         tele.telegram_set_commands("bot_token", commands)
         
         # Verify Bot initialized
-        mock_bot_cls.assert_called_with(token="bot_token")
+        self.assertEqual(mock_bot_cls.call_args[1]["token"], "bot_token")
+        self.assertEqual(mock_bot_cls.call_args[1]["base_url"], "https://api.telegram.org/bot")
         
         # Verify asyncio.run called
         mock_asyncio_run.assert_called()
 
+    def test_telegram_set_commands_is_instrumented(self):
+        events = []
+        tele.add_api_hook(events.append)
+        try:
+            with FakeTelegramServer() as server:
+                tele.telegram_set_commands("bot_token", {"start": "Start bot"}, api_url=server.url)
+                [(method, params)] = server.calls
+        finally:
+            tele.remove_api_hook(events.append)
+        self.assertEqual(method, "setMyCommands")
+        self.assertEqual(json.loads(params["commands"]), [{"command": "start", "description": "Start bot"}])
+        self.assertEqual([(e["method"], e["outcome"]) for e in events], [("setMyCommands", "ok")])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file